@@ -21,7 +21,7 @@ setup(name='fusegen',
       py_modules=[],
       include_package_data=False,
       zip_safe=False,
-      scripts=['src/fuse_decode', 'src/run_fusegen'],
+      scripts=['src/fuse_decode', 'src/fuse_logdecode', 'src/run_fusegen'],
       description='generator for fusegen projects',
       url='https://jddixon.github.io/fusegen',
       classifiers=[
@@ -11,10 +11,13 @@ import sys
 
 __all__ = ['__version__', '__version_date__',
            'BASH', 'SH',
-           'DEPRECATED', 'NOT_IMPLEMENTED',
+           'CACHE_TIMEOUTS', 'CONN_CAPS', 'CONN_LIMITS',
+           'DEPRECATED', 'FUSE_APIS', 'INST_MODES', 'LL_OP_NAMES',
+           'LOG_FORMATS', 'NOT_IMPLEMENTED', 'REC_VERSIONS',
            # functions
-           'check_date', 'check_pkg_name', 'check_pgm_names', 'check_version',
-           'invoke_shell', 'make_fuse_pkg',
+           'check_date', 'check_op_list', 'check_pkg_name', 'check_pgm_names',
+           'check_version',
+           'invoke_shell', 'join_build_flags', 'make_fuse_pkg',
            'op_names', ]
 
 # -- exported constants ---------------------------------------------
@@ -26,6 +29,44 @@ SH = '/bin/sh'
 
 # path to text file of quasi-prototypes
 PATH_TO_FIRST_LINES = 'fragments/prototypes'
+# and to those of the FUSE 3 ops, used with --fuse_api 3
+PATH_TO_FIRST_LINES_3 = 'fragments/prototypes3'
+# and to those of the low-level ops, used with --lowlevel
+PATH_TO_FIRST_LINES_LL = 'fragments/prototypes_ll'
+
+# The FUSE API the generated file system is written against (--fuse_api).
+#   2:  FUSE_USE_VERSION 26, built with the fuse.h shipped in c_src;
+#       main() hands everything to fuse_main()
+#   3:  FUSE_USE_VERSION 312, built with the system's libfuse 3.12 or
+#       later; main() sets up the session itself and runs it with
+#       fuse_loop_mt(), whose worker threads can be tuned
+FUSE_APIS = [2, 3, ]
+
+# How the generated file system collects instrumentation data (-I).
+#   mutex:  all threads share one bucket, guarded by a mutex
+#   thread: each FUSE worker thread owns its slots; no lock per op
+#   flush:  two fixed-size buckets; when one fills it is appended to
+#           the data file by a background writer while the other fills
+#   mmap:   slots are records in a memory-mapped data file, claimed by
+#           atomic increment of the count in the file's header
+INST_MODES = ['mutex', 'thread', 'flush', 'mmap', ]
+
+# Layouts of the instrumentation record (opData_t).
+#   1:  16 bytes; byte count limited to 17 bits and latency seconds to 7
+#   2:  48 bytes, adding file offset, file handle, and thread ID; the
+#       data file always begins with a header naming the opcodes
+REC_VERSIONS = [1, 2, ]
+
+# The most characters of build flags a version 2 data file header holds,
+# less the terminating null: BUILD_FLAGS_LEN in the generated C, less 1.
+BUILD_FLAGS_MAX = 127
+
+# How the generated file system writes its log (-L).
+#   text:   printf-style messages, appended to PKG.log
+#   binary: fixed-size records holding opcodes, raw argument values,
+#           and ids standing for strings, appended to PKG.blog;
+#           fuse_logdecode turns them back into text
+LOG_FORMATS = ['text', 'binary', ]
 
 # a table of FUSE function names
 OP_NAMES = [
@@ -42,12 +83,26 @@ OP_NAMES = [
     'flock',
     # fusion 2.9.1
     'fallocate',
+    # fusion 2.9; generated only with --buf_ops
+    'write_buf', 'read_buf',
     # AS THESE ARE IMPLEMENTED, update the consistency check in fuseGen
     # NOT YET IMPLEMENTED
     # fusion 2.8
     # 'ioctl',        'poll',
-    # fusion 2.9
-    # 'write_buf','read_buf',
+]
+
+# With --lowlevel the file system is written against the FUSE 3
+# low-level API, which knows files by inode number rather than by path.
+# These are its ops, in the order of their prototypes and so of their
+# opcodes.
+LL_OP_NAMES = [
+    'init', 'destroy', 'lookup', 'forget', 'getattr',
+    'setattr', 'readlink', 'mknod', 'mkdir', 'unlink',
+    'rmdir', 'symlink', 'rename', 'link', 'open',
+    'read', 'write_buf', 'flush', 'release', 'fsync',
+    'opendir', 'readdir', 'releasedir', 'fsyncdir', 'statfs',
+    'setxattr', 'getxattr', 'listxattr', 'removexattr', 'create',
+    'fallocate', 'flock', 'readdirplus', 'forget_multi',
 ]
 
 
@@ -110,11 +165,455 @@ OP_CALL_MAP = {
     'bmap': ('_bmap', SET_STATUS),
     'lock': ('ulockmgr_op', SET_STATUS),
     'flock': ('flock', SET_STATUS),
-    'fallocate': ('posix_fallocate', SET_STATUS),
+    'fallocate': ('fallocate', SET_STATUS),
+    'write_buf': ('fuse_buf_copy', SET_STATUS | OP_SPECIAL),
+    'read_buf': ('malloc', SET_STATUS | OP_SPECIAL),    # of the fuse_bufvec
+}
+
+# With --attr_cache, the ops which change the attributes of the file
+# named by their path, and so must forget any cached for it.  rename
+# forgets everything, and open forgets if it truncates: with FUSE 3's
+# atomic_o_trunc no truncate precedes it.
+ATTR_FORGET_OPS = ['chmod', 'chown', 'create', 'fallocate', 'ftruncate',
+                   'link', 'removexattr', 'rmdir', 'setxattr', 'truncate',
+                   'unlink', 'utimens', 'write', 'write_buf', ]
+
+# Ops not generated with --fuse_api 3: getdir and utime are gone,
+# fgetattr and ftruncate are folded into getattr and truncate, which are
+# passed the fuse_file_info if there is one, and lock needs ulockmgr,
+# which libfuse 3 no longer ships.
+FUSE2_ONLY_OPS = ['fgetattr', 'ftruncate', 'getdir', 'lock', 'utime', ]
+
+# What the generated init asks of the kernel.  Each is chosen by the
+# fuseGen option of the same name and by the runtime fg* flag given.
+#   capabilities, added to conn->want if in conn->capable; FUSE 3 always
+#   has big writes
+CONN_CAPS = [
+    ('async_read', 'fgAsyncRead', 'FUSE_CAP_ASYNC_READ'),
+    ('big_writes', 'fgBigWrites', 'FUSE_CAP_BIG_WRITES'),
+    ('splice_read', 'fgSpliceRead', 'FUSE_CAP_SPLICE_READ'),
+    ('splice_write', 'fgSpliceWrite', 'FUSE_CAP_SPLICE_WRITE'),
+    ('splice_move', 'fgSpliceMove', 'FUSE_CAP_SPLICE_MOVE'),
+]
+#   fuse_conn_info fields, left alone if 0; max_write can only be
+#   lowered, as FUSE's buffers hold no more than it offers
+CONN_LIMITS = [
+    ('max_write', 'fgMaxWrite'),
+    ('max_readahead', 'fgMaxReadahead'),
+    ('max_background', 'fgMaxBackground'),
+    ('congestion_threshold', 'fgCongestionThreshold'),
+]
+
+# How long, in seconds, the kernel may trust what it has been told about
+# a file's attributes, about a name, and about a name not existing.  Each
+# is chosen by the fuseGen option of the same name and by the runtime fg*
+# flag given, and passed on to FUSE as a -o option.
+CACHE_TIMEOUTS = [
+    ('attr_timeout', 'fgAttrTimeout'),
+    ('entry_timeout', 'fgEntryTimeout'),
+    ('negative_timeout', 'fgNegativeTimeout'),
+]
+
+# With --at_calls, map FUSE op name to the syscall made relative to the
+# root directory fd instead, and to its arguments.  Where the arguments
+# are None the call is written out in full.  Ops not listed here (statfs,
+# the xattr ops, bmap) have no *at form and still use FullPath.
+AT_CALL_MAP = {
+    'access': ('faccessat', 'rootfd, rpath, mask, 0'),
+    'chmod': ('fchmodat', 'rootfd, rpath, mode, 0'),
+    'chown': ('fchownat', 'rootfd, rpath, uid, gid, 0'),
+    'create': ('openat', 'rootfd, rpath, O_CREAT | O_WRONLY | O_TRUNC, mode'),
+    'fallocate': ('fallocate', None),
+    'getattr': ('fstatat', 'rootfd, rpath, statbuf, AT_SYMLINK_NOFOLLOW'),
+    'link': ('linkat', 'rootfd, rpath, rootfd, rnewpath, 0'),
+    'mkdir': ('mkdirat', 'rootfd, rpath, mode'),
+    'mknod': ('mknodat', None),
+    'open': ('openat', 'rootfd, rpath, fi->flags'),
+    'opendir': ('fdopendir', None),
+    'readlink': ('readlinkat', 'rootfd, rpath, link, size - 1'),
+    'rename': ('renameat', 'rootfd, rpath, rootfd, rnewpath'),
+    'rmdir': ('unlinkat', 'rootfd, rpath, AT_REMOVEDIR'),
+    'symlink': ('symlinkat', 'path, rootfd, rlink'),
+    'truncate': ('truncate', None),
+    'unlink': ('unlinkat', 'rootfd, rpath, 0'),
+    'utimens': ('utimensat', 'rootfd, rpath, tv, AT_SYMLINK_NOFOLLOW'),
+}
+
+# With --fuse_api 3, the call made instead on the open file when FUSE
+# passes these ops a fuse_file_info, so that no path is resolved again.
+FH_CALL_MAP = {
+    'chmod': 'fchmod(fi->fh, mode)',
+    'chown': 'fchown(fi->fh, uid, gid)',
+    'getattr': 'fstat(fi->fh, statbuf)',
+    'truncate': 'ftruncate(fi->fh, newsize)',
+    'utimens': 'futimens(fi->fh, tv)',
+}
+
+# With --lowlevel, the body of each low-level op other than init and
+# destroy: its declarations, its code, which sets status to 0 or -errno,
+# its reply on success, and the code logging its results, which is used
+# only if the op is logged.  A reply of None replies with status alone;
+# one indented is written out in full.  {0:s} is the prefix.
+LL_OP_CODE = {
+    'lookup': ("""\
+    struct fuse_entry_param e;""", """\
+    status = {0:s}DoLookup(parent, name, &e);
+    if ((status == -ENOENT) && (fgNegativeTimeout > 0)) {{
+        // no inode: the kernel may remember that there is no such name
+        memset(&e, 0, sizeof(e));
+        e.entry_timeout = fgNegativeTimeout;
+        status = 0;
+    }}""", 'fuse_reply_entry(req, &e);', """\
+    if ((status == 0) && (e.ino != 0))
+        {0:s}LogStat(&e.attr);"""),
+    'forget': (None, """\
+    {0:s}Forget(ino, nlookup);""", 'fuse_reply_none(req);', None),
+    'getattr': ("""\
+    struct stat si;""", """\
+    status = fstatat({0:s}InodeFd(ino), "", &si,
+                                    AT_EMPTY_PATH | AT_SYMLINK_NOFOLLOW);
+    if (status < 0)
+        status = {0:s}Error("{0:s}getattr fstatat");""",
+                'fuse_reply_attr(req, &si, fgAttrTimeout);', """\
+    if (status == 0)
+        {0:s}LogStat(&si);"""),
+    'setattr': ("""\
+    struct stat si;
+    char procname[64];
+    int fd = {0:s}InodeFd(ino);""", """\
+    // an O_PATH fd will not do for most of these; its /proc name will
+    {0:s}ProcPath(procname, fd);
+    if (to_set & FUSE_SET_ATTR_MODE) {{
+        status = fi ? fchmod(fi->fh, attr->st_mode)
+                    : chmod(procname, attr->st_mode);
+        if (status < 0)
+            status = {0:s}Error("{0:s}setattr chmod");
+    }}
+    if ((status == 0) &&
+            (to_set & (FUSE_SET_ATTR_UID | FUSE_SET_ATTR_GID))) {{
+        uid_t uid = (to_set & FUSE_SET_ATTR_UID) ? attr->st_uid : -1;
+        gid_t gid = (to_set & FUSE_SET_ATTR_GID) ? attr->st_gid : -1;
+        status = fchownat(fd, "", uid, gid,
+                                    AT_EMPTY_PATH | AT_SYMLINK_NOFOLLOW);
+        if (status < 0)
+            status = {0:s}Error("{0:s}setattr fchownat");
+    }}
+    if ((status == 0) && (to_set & FUSE_SET_ATTR_SIZE)) {{
+        status = fi ? ftruncate(fi->fh, attr->st_size)
+                    : truncate(procname, attr->st_size);
+        if (status < 0)
+            status = {0:s}Error("{0:s}setattr truncate");
+    }}
+    if ((status == 0) &&
+            (to_set & (FUSE_SET_ATTR_ATIME | FUSE_SET_ATTR_MTIME))) {{
+        struct timespec tv[2];
+        tv[0].tv_sec  = tv[1].tv_sec  = 0;
+        tv[0].tv_nsec = tv[1].tv_nsec = UTIME_OMIT;
+        if (to_set & FUSE_SET_ATTR_ATIME_NOW)
+            tv[0].tv_nsec = UTIME_NOW;
+        else if (to_set & FUSE_SET_ATTR_ATIME)
+            tv[0] = attr->st_atim;
+        if (to_set & FUSE_SET_ATTR_MTIME_NOW)
+            tv[1].tv_nsec = UTIME_NOW;
+        else if (to_set & FUSE_SET_ATTR_MTIME)
+            tv[1] = attr->st_mtim;
+        status = fi ? futimens(fi->fh, tv)
+                    : utimensat(AT_FDCWD, procname, tv, 0);
+        if (status < 0)
+            status = {0:s}Error("{0:s}setattr utimensat");
+    }}
+    if (status == 0) {{
+        status = fstatat(fd, "", &si, AT_EMPTY_PATH | AT_SYMLINK_NOFOLLOW);
+        if (status < 0)
+            status = {0:s}Error("{0:s}setattr fstatat");
+    }}""", 'fuse_reply_attr(req, &si, fgAttrTimeout);', """\
+    if (status == 0)
+        {0:s}LogStat(&si);"""),
+    'readlink': ("""\
+    char link[PATH_MAX];""", """\
+    status = readlinkat({0:s}InodeFd(ino), "", link, sizeof(link) - 1);
+    if (status < 0)
+        status = {0:s}Error("{0:s}readlink readlinkat");
+    else {{
+        link[status] = '\\0';
+        status = 0;
+    }}""", 'fuse_reply_readlink(req, link);', """\
+    if (status == 0)
+        {0:s}LogMsg("    link=\\"%s\\"\\n", link);"""),
+    'mknod': ("""\
+    struct fuse_entry_param e;""", """\
+    status = mknodat({0:s}InodeFd(parent), name, mode, rdev);
+    if (status < 0)
+        status = {0:s}Error("{0:s}mknod mknodat");
+    else
+        status = {0:s}DoLookup(parent, name, &e);""",
+              'fuse_reply_entry(req, &e);', None),
+    'mkdir': ("""\
+    struct fuse_entry_param e;""", """\
+    status = mkdirat({0:s}InodeFd(parent), name, mode);
+    if (status < 0)
+        status = {0:s}Error("{0:s}mkdir mkdirat");
+    else
+        status = {0:s}DoLookup(parent, name, &e);""",
+              'fuse_reply_entry(req, &e);', None),
+    'unlink': (None, """\
+    status = unlinkat({0:s}InodeFd(parent), name, 0);
+    if (status < 0)
+        status = {0:s}Error("{0:s}unlink unlinkat");""", None, None),
+    'rmdir': (None, """\
+    status = unlinkat({0:s}InodeFd(parent), name, AT_REMOVEDIR);
+    if (status < 0)
+        status = {0:s}Error("{0:s}rmdir unlinkat");""", None, None),
+    'symlink': ("""\
+    struct fuse_entry_param e;""", """\
+    status = symlinkat(link, {0:s}InodeFd(parent), name);
+    if (status < 0)
+        status = {0:s}Error("{0:s}symlink symlinkat");
+    else
+        status = {0:s}DoLookup(parent, name, &e);""",
+                'fuse_reply_entry(req, &e);', None),
+    'rename': (None, """\
+    // RENAME_EXCHANGE and RENAME_NOREPLACE are not passed on
+    if (flags) {{
+        status = -1;
+        errno  = EINVAL;
+    }} else
+        status = renameat({0:s}InodeFd(parent), name,
+                                    {0:s}InodeFd(newparent), newname);
+    if (status < 0)
+        status = {0:s}Error("{0:s}rename renameat");""", None, None),
+    'link': ("""\
+    struct fuse_entry_param e;
+    char procname[64];""", """\
+    {0:s}ProcPath(procname, {0:s}InodeFd(ino));
+    status = linkat(AT_FDCWD, procname, {0:s}InodeFd(newparent), newname,
+                                                    AT_SYMLINK_FOLLOW);
+    if (status < 0)
+        status = {0:s}Error("{0:s}link linkat");
+    else
+        status = {0:s}DoLookup(newparent, newname, &e);""",
+             'fuse_reply_entry(req, &e);', None),
+    'open': ("""\
+    char procname[64];
+    int fd;""", """\
+    // the O_PATH fd is reopened by its /proc name
+    {0:s}ProcPath(procname, {0:s}InodeFd(ino));
+    fd = open(procname, fi->flags & ~O_NOFOLLOW);
+    if (fd < 0)
+        status = {0:s}Error("{0:s}open open");
+    else
+        fi->fh = fd;""", 'fuse_reply_open(req, fi);', None),
+    'read': ("""\
+    struct fuse_bufvec buf = FUSE_BUFVEC_INIT(size);""", """\
+    // FUSE reads the file itself, splicing it to the device if it can
+    buf.buf[0].flags = FUSE_BUF_IS_FD | FUSE_BUF_FD_SEEK;
+    buf.buf[0].fd    = fi->fh;
+    buf.buf[0].pos   = offset;""", """\
+    fuse_reply_data(req, &buf, FUSE_BUF_SPLICE_MOVE);""", None),
+    'write_buf': ("""\
+    size_t size = fuse_buf_size(buf);
+    struct fuse_bufvec dst = FUSE_BUFVEC_INIT(size);""", """\
+    // data spliced from the FUSE device goes straight to the file
+    dst.buf[0].flags = FUSE_BUF_IS_FD | FUSE_BUF_FD_SEEK;
+    dst.buf[0].fd    = fi->fh;
+    dst.buf[0].pos   = offset;
+    status = fuse_buf_copy(&dst, buf, FUSE_BUF_SPLICE_NONBLOCK);
+    if (status < 0) {{
+        errno  = -status;
+        status = {0:s}Error("{0:s}write_buf fuse_buf_copy");
+    }}""", 'fuse_reply_write(req, status);', None),
+    'flush': (None, """\
+    // closing a duplicate drops POSIX locks as closing the file would
+    status = close(dup(fi->fh));
+    if (status < 0)
+        status = {0:s}Error("{0:s}flush close");""", None, None),
+    'release': (None, """\
+    status = close(fi->fh);
+    if (status < 0)
+        status = {0:s}Error("{0:s}release close");""", None, None),
+    'fsync': (None, """\
+#ifdef HAVE_FDATASYNC
+    if (datasync)
+        status = fdatasync(fi->fh);
+    else
+#endif
+        status = fsync(fi->fh);
+    if (status < 0)
+        status = {0:s}Error("{0:s}fsync fsync");""", None, None),
+    'opendir': ("""\
+    llDir_t *d;
+    int fd = -1;""", """\
+    d = calloc(1, sizeof(llDir_t));
+    if (d != NULL)
+        fd = openat({0:s}InodeFd(ino), ".", O_RDONLY | O_DIRECTORY);
+    if ((fd < 0) || ((d->dp = fdopendir(fd)) == NULL)) {{
+        status = {0:s}Error("{0:s}opendir fdopendir");
+        if (fd >= 0)
+            close(fd);
+        free(d);
+    }} else
+        fi->fh = (uintptr_t) d;""", 'fuse_reply_open(req, fi);', None),
+    'readdir': ("""\
+    char *buf = malloc(size);""", """\
+    if (buf == NULL) {{
+        errno  = ENOMEM;
+        status = {0:s}Error("{0:s}readdir malloc");
+    }} else
+        status = {0:s}FillDir(req, ino, buf, size, offset,
+                        (llDir_t *) (uintptr_t) fi->fh, 0);""", """\
+    if (status < 0)
+        fuse_reply_err(req, -status);
+    else
+        fuse_reply_buf(req, buf, status);
+    free(buf);""", """\
+    if (status >= 0)
+        {0:s}LogMsg("    %d bytes of entries\\n", status);"""),
+    'releasedir': ("""\
+    llDir_t *d = (llDir_t *) (uintptr_t) fi->fh;""", """\
+    status = closedir(d->dp);
+    if (status < 0)
+        status = {0:s}Error("{0:s}releasedir closedir");
+    free(d);""", None, None),
+    'fsyncdir': ("""\
+    int fd = dirfd(((llDir_t *) (uintptr_t) fi->fh)->dp);""", """\
+#ifdef HAVE_FDATASYNC
+    if (datasync)
+        status = fdatasync(fd);
+    else
+#endif
+        status = fsync(fd);
+    if (status < 0)
+        status = {0:s}Error("{0:s}fsyncdir fsync");""", None, None),
+    'statfs': ("""\
+    struct statvfs sv;""", """\
+    status = fstatvfs({0:s}InodeFd(ino), &sv);
+    if (status < 0)
+        status = {0:s}Error("{0:s}statfs fstatvfs");""",
+               'fuse_reply_statfs(req, &sv);', """\
+    if (status == 0)
+        {0:s}LogstatVFS(&sv);"""),
+    'setxattr': ("""\
+    char procname[64];""", """\
+    {0:s}ProcPath(procname, {0:s}InodeFd(ino));
+    status = setxattr(procname, name, value, size, flags);
+    if (status < 0)
+        status = {0:s}Error("{0:s}setxattr setxattr");""", None, None),
+    'getxattr': ("""\
+    char procname[64];
+    char *value = NULL;""", """\
+    // a size of 0 asks only how big the value is
+    {0:s}ProcPath(procname, {0:s}InodeFd(ino));
+    if ((size > 0) && ((value = malloc(size)) == NULL)) {{
+        errno  = ENOMEM;
+        status = {0:s}Error("{0:s}getxattr malloc");
+    }} else {{
+        status = getxattr(procname, name, value, size);
+        if (status < 0)
+            status = {0:s}Error("{0:s}getxattr getxattr");
+    }}""", """\
+    if (status < 0)
+        fuse_reply_err(req, -status);
+    else if (size > 0)
+        fuse_reply_buf(req, value, status);
+    else
+        fuse_reply_xattr(req, status);
+    free(value);""", None),
+    'listxattr': ("""\
+    char procname[64];
+    char *list = NULL;""", """\
+    // a size of 0 asks only how big the list is
+    {0:s}ProcPath(procname, {0:s}InodeFd(ino));
+    if ((size > 0) && ((list = malloc(size)) == NULL)) {{
+        errno  = ENOMEM;
+        status = {0:s}Error("{0:s}listxattr malloc");
+    }} else {{
+        status = listxattr(procname, list, size);
+        if (status < 0)
+            status = {0:s}Error("{0:s}listxattr listxattr");
+    }}""", """\
+    if (status < 0)
+        fuse_reply_err(req, -status);
+    else if (size > 0)
+        fuse_reply_buf(req, list, status);
+    else
+        fuse_reply_xattr(req, status);
+    free(list);""", None),
+    'removexattr': ("""\
+    char procname[64];""", """\
+    {0:s}ProcPath(procname, {0:s}InodeFd(ino));
+    status = removexattr(procname, name);
+    if (status < 0)
+        status = {0:s}Error("{0:s}removexattr removexattr");""", None, None),
+    'create': ("""\
+    struct fuse_entry_param e;
+    int fd;""", """\
+    fd = openat({0:s}InodeFd(parent), name,
+                                (fi->flags | O_CREAT) & ~O_NOFOLLOW, mode);
+    if (fd < 0)
+        status = {0:s}Error("{0:s}create openat");
+    else {{
+        status = {0:s}DoLookup(parent, name, &e);
+        if (status < 0)
+            close(fd);
+        else
+            fi->fh = fd;
+    }}""", 'fuse_reply_create(req, &e, fi);', None),
+    'fallocate': (None, """\
+#ifdef HAVE_FALLOCATE
+    // mode may punch a hole or keep the size
+    status = fallocate(fi->fh, mode, offset, length);
+#else
+    // posix_fallocate() returns the error number rather than setting errno
+    if (mode) {{
+        status = -1;
+        errno  = EOPNOTSUPP;
+    }} else if ((status = posix_fallocate(fi->fh, offset, length)) != 0) {{
+        errno  = status;
+        status = -1;
+    }}
+#endif
+    if (status < 0)
+        status = {0:s}Error("{0:s}fallocate fallocate");""",
+                  None, None),
+    'flock': (None, """\
+    status = flock(fi->fh, op);
+    if (status < 0)
+        status = {0:s}Error("{0:s}flock flock");""", None, None),
+    'readdirplus': ("""\
+    char *buf = malloc(size);""", """\
+    if (buf == NULL) {{
+        errno  = ENOMEM;
+        status = {0:s}Error("{0:s}readdirplus malloc");
+    }} else
+        status = {0:s}FillDir(req, ino, buf, size, offset,
+                        (llDir_t *) (uintptr_t) fi->fh, 1);""", """\
+    if (status < 0)
+        fuse_reply_err(req, -status);
+    else
+        fuse_reply_buf(req, buf, status);
+    free(buf);""", """\
+    if (status >= 0)
+        {0:s}LogMsg("    %d bytes of entries\\n", status);"""),
+    'forget_multi': ("""\
+    size_t i;""", """\
+    for (i = 0; i < count; i++)
+        {0:s}Forget(forgets[i].ino, forgets[i].nlookup);""",
+                     'fuse_reply_none(req);', None),
+}
+
+# low-level ops compiled only if configure finds what they call
+LL_OP_GUARDS = {
+    'setxattr': 'HAVE_SYS_XATTR_H',
+    'getxattr': 'HAVE_SYS_XATTR_H',
+    'listxattr': 'HAVE_SYS_XATTR_H',
+    'removexattr': 'HAVE_SYS_XATTR_H',
+    'fallocate': 'HAVE_POSIX_FALLOCATE',
 }
+
 LOG_ENTRY_PAT_MAP = {
     'blocksize': '0x%08x',
     'buf': '0x%08x',
+    'bufp': '0x%08x',
     'cmd': '%d',
     'datasync': '%d',
     'dev': '%lld',
@@ -146,6 +645,81 @@ LOG_ENTRY_PAT_MAP = {
     'userdata': '0x%08x',
     'value': '\\"%s\\"',
 }
+
+# Structures dumped in binary logs, field by field, in the same order
+# and with the same formats as the ADD_*_FIELD macros use in text logs.
+# A field is (kind, struct, field): kind is INT, ULONG, LL, or ULL, or
+# else the printf format given to ADD_FIELD.  A struct of DATA is the
+# file system's private data.
+LOG_STRUCTS = [
+    ('LogContext', 'struct fuse_context', 'ctx', 'struct is from fuse.h', [
+        ('ULONG', 'ctx', 'fuse'),
+        ('INT', 'ctx', 'uid'),
+        ('INT', 'ctx', 'gid'),
+        ('INT', 'ctx', 'pid'),
+        ('%05o', 'ctx', 'umask'),
+        ('ULONG', 'ctx', 'private_data'),
+        ('ULONG', 'DATA', 'logfile'),
+        ('%s', 'DATA', 'rootdir'), ]),
+    ('LogConn', 'struct fuse_conn_info', 'conn',
+     'struct is from fuse_common.h', [
+         ('INT', 'conn', 'proto_major'),
+         ('INT', 'conn', 'proto_minor'),
+         ('INT', 'conn', 'async_read'),
+         ('INT', 'conn', 'max_write'),
+         ('INT', 'conn', 'max_readahead'),
+         ('ULONG', 'conn', 'capable'),
+         ('ULONG', 'conn', 'want'),
+         ('INT', 'conn', 'max_background'),
+         ('INT', 'conn', 'congestion_threshold'), ]),
+    ('LogFI', 'struct fuse_file_info', 'fi', 'struct is from fuse_common.h', [
+        ('ULONG', 'fi', 'flags'),
+        ('ULL', 'fi', 'fh_old'),
+        ('INT', 'fi', 'writepage'),
+        ('INT', 'fi', 'direct_io'),
+        ('INT', 'fi', 'keep_cache'),
+        ('INT', 'fi', 'flush'),
+        ('INT', 'fi', 'nonseekable'),
+        ('INT', 'fi', 'flock_release'),
+        ('ULL', 'fi', 'fh'),
+        ('ULL', 'fi', 'lock_owner'), ]),
+    ('LogStat', 'struct stat', 'ss', 'for struct see man struct stat', [
+        ('ULL', 'ss', 'st_dev'),
+        ('ULL', 'ss', 'st_ino'),
+        ('0%o', 'ss', 'st_mode'),
+        ('INT', 'ss', 'st_nlink'),
+        ('INT', 'ss', 'st_uid'),
+        ('INT', 'ss', 'st_gid'),
+        ('ULL', 'ss', 'st_rdev'),
+        ('ULL', 'ss', 'st_size'),
+        ('%ld', 'ss', 'st_blksize'),
+        ('ULL', 'ss', 'st_blocks'),
+        ('ULONG', 'ss', 'st_atime'),
+        ('ULONG', 'ss', 'st_mtime'),
+        ('ULONG', 'ss', 'st_ctime'), ]),
+    ('LogStatVFS', 'struct statvfs', 'sv', 'for struct see man struct statvfs',
+     [('%ld', 'sv', 'f_bsize'),
+      ('%ld', 'sv', 'f_frsize'),
+      ('LL', 'sv', 'f_blocks'),
+      ('LL', 'sv', 'f_bfree'),
+      ('LL', 'sv', 'f_bavail'),
+      ('LL', 'sv', 'f_files'),
+      ('LL', 'sv', 'f_ffree'),
+      ('LL', 'sv', 'f_favail'),
+      ('%ld', 'sv', 'f_fsid'),
+      ('ULL', 'sv', 'f_flag'),
+      ('%ld', 'sv', 'f_namemax'), ]),
+]
+# fields of the structures above which FUSE 3 dropped
+FUSE2_ONLY_FIELDS = [('conn', 'async_read'), ('fi', 'fh_old'), ]
+
+# kind => (format of the line, C cast of the value)
+LOG_FIELD_KINDS = {
+    'INT': ('  %-20s  = %%d\\n', '(int)'),
+    'ULONG': ('  %-20s  = 0x%%08lx\\n', '(uintptr_t)'),
+    'LL': ('  %-20s  = %%lld\\n', '(long long)'),
+    'ULL': ('  %-20s  = 0x%%016llx\\n', '(unsigned long long)'),
+}
 PAT_MAP = {
     'buf': '0x%08x',  # XXX ?
     'fi': '0x%08x',
@@ -154,6 +728,54 @@ PAT_MAP = {
 }
 
 # -- functions ------------------------------------------------------
+
+
+def log_entry_pat(name, p_name):
+    """ Return the printf pattern used to log parameter p_name of name. """
+    if p_name == 'size':
+        if name in ['read', 'write', ]:
+            pat = '%lld'
+        else:
+            pat = '%d'
+    elif p_name == 'value':
+        if name in ['getxattr', ]:
+            pat = '0x%08x'
+        else:
+            pat = '\\"%s\\"'
+    elif p_name in LOG_ENTRY_PAT_MAP:
+        pat = LOG_ENTRY_PAT_MAP[p_name]
+    else:
+        pat = 'UNKNOWN PAT FOR \'%s\'' % p_name
+    return pat
+
+
+def ll_log_pat(p_type, p_name):
+    """
+    Return the printf pattern used to log parameter p_name of a low-level
+    op, and the argument passed to it, or None if it is not logged.  The
+    argument is cast to the type the pattern expects.
+    """
+    p_type = p_type.strip()
+    if p_type == 'fuse_req_t' or p_name == 'value' or \
+            p_type.startswith('struct ') or p_type == 'void *':
+        return None
+    if p_type == 'const char *':
+        return '\\"%s\\"', p_name
+    if p_type == 'fuse_ino_t':
+        return '0x%llx', '(unsigned long long) %s' % p_name
+    if p_type in ['dev_t', 'uint64_t', ]:
+        return '%llu', '(unsigned long long) %s' % p_name
+    if p_type == 'off_t':
+        return '%lld', '(long long) %s' % p_name
+    if p_type == 'size_t':
+        return '%zu', p_name
+    if p_type == 'mode_t':
+        return '0%03o', p_name
+    if p_name in ['flags', 'to_set', ]:
+        return '0x%x', p_name
+    return '%d', p_name
+
+
 PKG_DATE_RE = re.compile(r'^[\d]{4}-\d\d-\d\d$')
 
 
@@ -171,6 +793,45 @@ def check_date(str_):
             sys.exit(1)
 
 
+def check_op_list(str_, lowlevel=False):
+    """
+    Split a comma-separated list of FUSE op names, as given to --log_ops
+    or --time_ops, verifying each name, which with lowlevel is that of a
+    low-level op.  None, for no list, means all ops.
+    """
+
+    if str_ is None:
+        return None
+    ops = [op_.strip() for op_ in str_.split(',') if op_.strip()]
+    if not ops:
+        print("the list of ops must not be empty")
+        sys.exit(1)
+    for op_ in ops:
+        if op_ not in (LL_OP_NAMES if lowlevel else OP_NAMES):
+            print("'%s' is not the name of a FUSE %sop" % (
+                op_, 'low-level ' if lowlevel else ''))
+            sys.exit(1)
+    return ops
+
+
+def join_build_flags(build_flags):
+    """
+    Join the build flags recorded in version 2 data file headers with
+    spaces.  If they are longer than BUILD_FLAGS_MAX, whole flags are
+    dropped from the end and '...' ends the string instead.
+    """
+
+    text = ' '.join(build_flags)
+    if len(text) <= BUILD_FLAGS_MAX:
+        return text
+    kept = []
+    for flag in build_flags:
+        if len(' '.join(kept + [flag, '...'])) > BUILD_FLAGS_MAX:
+            break
+        kept.append(flag)
+    return ' '.join(kept + ['...'])
+
+
 PKG_NAME_RE = re.compile(r'^[a-z_][a-z0-9_\-]*$', re.IGNORECASE)
 
 
@@ -333,7 +994,7 @@ class FuseFunc(object):
             arg_type = chunks[0].strip()
             arg_type += ' '
             art_name = chunks[1]
-            if art_name[0] == '*':
+            while art_name[0] == '*':
                 art_name = art_name[1:]
                 arg_type += '*'
             # DEBUG
@@ -345,11 +1006,11 @@ class FuseFunc(object):
         return base_name, FuseFunc(f_name, f_type, params, p2t_map)
 
     @classmethod
-    def get_func_map(cls, prefix=''):
+    def get_func_map(cls, prefix='', path=PATH_TO_FIRST_LINES):
         """ Build a map from function name to index. """
 
         lines = []
-        with open(PATH_TO_FIRST_LINES, 'r') as file:
+        with open(path, 'r') as file:
             line = file.readline()
             while line and line != '':
                 # simplified comments
@@ -409,7 +1070,7 @@ def set_op_attrs():
         attrs = 0
         if name in ['getdir', 'utime', ]:
             attrs |= DEPRECATED
-        elif name in ['ioctl', 'poll', 'write_buf', 'read_buf', ]:
+        elif name in ['ioctl', 'poll', ]:
             attrs |= NOT_IMPLEMENTED
         else:
             if name in ['symlink', ]:
@@ -426,11 +1087,13 @@ def set_op_attrs():
                             'symlink',
                             'read', 'write', 'flush', 'release', 'fsync',
                             'readdir', 'releasedir', 'fsyncdir', 'init',
-                            'destroy', 'ftruncate', 'fgetattr']:
+                            'destroy', 'ftruncate', 'fgetattr',
+                            'write_buf', 'read_buf', ]:
                 attrs |= FULL_PATH
 
             if name not in ['destroy', 'flush', 'fsyncdir',
-                            'init', 'mknod', 'readdir', ]:
+                            'init', 'mknod', 'readdir',
+                            'write_buf', 'read_buf', ]:
                 attrs |= CHECK_ERR_AND_FLIP
 
             if name in ['setxattr', 'getxattr', 'listxattr', 'removexattr', ]:
@@ -440,7 +1103,7 @@ def set_op_attrs():
                         'fsync', 'fsyncdir', 'ftruncate',
                         'lock',
                         'opendir', 'open', 'readdir', 'read', 'releasedir',
-                        'release', 'write', ]:
+                        'release', 'write', 'write_buf', 'read_buf', ]:
                 attrs |= LOGGING_FI
 
             if name in ['create', 'open', ]:
@@ -473,13 +1136,267 @@ def set_op_attrs():
 #             raise exc
 #
 
+
+def conn_init_lines(prefix, fuse_api, op_logging, passthrough=False):
+    """
+    Return the lines of C with which init asks the kernel for what
+    fuseGen or the fg* flags chose.
+    """
+    strings = ["    // ask for what fuseGen or the fg* flags chose"]
+    for cap_name, fg_name, cap in CONN_CAPS:
+        if fuse_api == 3 and cap_name == 'big_writes':
+            continue
+        strings.append('    if (%s)' % fg_name)
+        strings.append('        conn->want |= conn->capable & %s;' % cap)
+    if passthrough:
+        strings.append("""\
+    // before Linux 6.9 reads and writes all come to the file system
+    if (fgPassthrough && (conn->capable & FUSE_CAP_PASSTHROUGH))
+        conn->want |= FUSE_CAP_PASSTHROUGH;
+    else
+        fgPassthrough = 0;""")
+    for limit, fg_name in CONN_LIMITS:
+        if limit == 'max_write':
+            strings.append('    if ((%s > 0) && (%s < conn->%s))' % (
+                fg_name, fg_name, limit))
+        else:
+            strings.append('    if (%s > 0)' % fg_name)
+        strings.append('        conn->%s = %s;' % (limit, fg_name))
+    strings.append("""\
+    if (fgVerbose)
+        fprintf(stderr, "init: want 0x%x of 0x%x, max_write %u, "
+                "max_readahead %u, max_background %u, "
+                "congestion_threshold %u\\n", conn->want, conn->capable,
+                conn->max_write, conn->max_readahead, conn->max_background,
+                conn->congestion_threshold);""")
+    if op_logging:
+        strings.append('    %sLogMsg("  as negotiated:\\n");' % prefix)
+        strings.append('    %sLogConn(conn);' % prefix)
+    return strings
+
+
+def make_ll_incs(path_to_src, prefix, func_map, logging=False,
+                 binary_log=False, log_ops=None, instrumenting=False,
+                 time_ops=None, inst_mode='mutex', async_log=False,
+                 keep_cache=False, passthrough=False):
+    """
+    Write optable.inc and an .inc file for each op of a --lowlevel file
+    system to path_to_src.  func_map maps op names to the FuseFunc parsed
+    from PATH_TO_FIRST_LINES_LL.
+    """
+
+    # optable.inc -----------------------------------------
+    content = """/** optable.inc */
+
+struct fuse_lowlevel_ops {0:s}OpTable = {{
+""".format(prefix)
+    guard = None
+    for name in LL_OP_NAMES:
+        if LL_OP_GUARDS.get(name) != guard:
+            if guard:
+                content += '#endif\n'
+            guard = LL_OP_GUARDS.get(name)
+            if guard:
+                content += '#ifdef %s\n' % guard
+        content += '    .%-13s= %s%s,\n' % (name, prefix, name)
+    if guard:
+        content += '#endif\n'
+    content += """\
+};
+"""
+    with open(os.path.join(path_to_src, 'optable.inc'), 'w') as file:
+        file.write(content)
+
+    # generate op .inc files ------------------------------
+    for name in LL_OP_NAMES:
+        f_map = func_map[name]    # FuseFunc for this name
+        op_code = "FG_%s" % name.upper()
+        op_logging = logging and (log_ops is None or name in log_ops)
+        op_timing = instrumenting and (time_ops is None or name in time_ops)
+        guard = LL_OP_GUARDS.get(name)
+        if name in ['init', 'destroy', ]:
+            decls, code, reply, results = None, None, None, None
+        else:
+            decls, code, reply, results = LL_OP_CODE[name]
+
+        strings = []
+        strings.append("/** %s.inc */\n" % name)
+        if guard:
+            strings.append("#ifdef %s" % guard)
+        strings.append("static %s\n{" % f_map.first_line())
+
+        # -- instrumentation and declarations ---------
+        if op_timing:
+            strings.append("""\
+    struct timespec tEntry;
+    opData_t *myData = {0:s}ClockMeIn(&tEntry, {1:s});""".format(
+                prefix, op_code))
+        if code is not None and 'status' in code + (reply or 'status'):
+            strings.append('    int status = 0;')
+        if decls is not None:
+            strings.append(decls.format(prefix))
+        strings.append("")
+
+        # -- log on entry -----------------------------
+        if op_logging:
+            pats = []
+            log_args = []
+            for p_type, p_name in f_map.params:
+                pat_arg = ll_log_pat(p_type, p_name)
+                if pat_arg is None:
+                    continue
+                pat, arg = pat_arg
+                pats.append('%s=%s' % (p_name, pat))
+                if not binary_log:
+                    log_args.append(arg)
+                elif pat == '\\"%s\\"':
+                    log_args.append('%sIntern(%s)' % (prefix, p_name))
+                else:
+                    log_args.append('(uint64_t) %s' % p_name)
+            fmt = '\\n%s%s(%s)\\n' % (prefix, name, ', '.join(pats))
+            if binary_log:
+                line = '    %sLogCall(%s, "%s", %d' % (
+                    prefix, op_code, fmt, len(log_args))
+            else:
+                line = '    %sLogEntry("%s"' % (prefix, fmt)
+            if log_args:
+                strings.append(line + ',')
+                strings.append('             %s);' % ', '.join(log_args))
+            else:
+                strings.append(line + ');')
+            if name == 'init':
+                strings.append('    %sLogConn(conn);' % prefix)
+            elif name in ['getattr', 'setattr', ]:
+                # passed a NULL fi unless the file is open
+                strings.append('    if (fi)')
+                strings.append('        %sLogFI(fi);' % prefix)
+            elif 'fi' in f_map.p2t_map and \
+                    name not in ['open', 'opendir', 'create', ]:
+                strings.append('    %sLogFI(fi);' % prefix)
+            strings.append("")
+
+        # -- the op itself ----------------------------
+        if name == 'init':
+            strings += conn_init_lines(prefix, 3, op_logging, passthrough)
+        elif name == 'destroy':
+            if keep_cache:
+                strings.append("    %sKeepCacheReport();" % prefix)
+            if passthrough:
+                strings.append("    %sPassthroughReport();" % prefix)
+            strings.append("    %sInodeReport();" % prefix)
+        else:
+            if passthrough and name == 'release':
+                strings.append('    %sPassthroughRelease(req, ino);' % prefix)
+            strings.append(code.format(prefix))
+            if keep_cache and name == 'open':
+                strings.append('    if (fgKeepCache && (fd >= 0))')
+                strings.append(
+                    '        fi->keep_cache = %sKeepCache(fd);' % prefix)
+            if passthrough and name in ['open', 'create', ]:
+                # the kernel reads and writes the file itself from now on
+                call = '%sPassthroughOpen(req, %s, fi)' % (
+                    prefix, 'ino' if name == 'open' else 'e.ino')
+                if op_timing:
+                    strings.append('    if ((status == 0) && %s &&' % call)
+                    strings.append('                                '
+                                   '            (myData != NULL))')
+                    strings.append('        myData->flags |= REC_PASSTHROUGH;')
+                else:
+                    strings.append('    if (status == 0)')
+                    strings.append('        %s;' % call)
+            if op_logging and results is not None:
+                strings.append(results.format(prefix))
+            if op_logging and name in ['open', 'opendir', 'create', ]:
+                strings.append('    if (status == 0)')
+                strings.append('        %sLogFI(fi);' % prefix)
+
+            # -- reply --------------------------------
+            # every request but a forget is answered exactly once
+            if reply is None:
+                strings.append('    fuse_reply_err(req, -status);')
+            elif reply.startswith('    '):
+                strings.append(reply)
+            elif reply == 'fuse_reply_none(req);':
+                strings.append('    ' + reply)
+            else:
+                strings.append('    if (status < 0)')
+                strings.append('        fuse_reply_err(req, -status);')
+                strings.append('    else')
+                strings.append('        ' + reply)
+
+        # -- instrumentation at exit ------------------
+        # which is after the reply, so that a read is timed until its
+        # data has been handed to the kernel
+        if op_timing:
+            if name in ['read', 'write_buf',
+                        'setxattr', 'getxattr', 'listxattr', ]:
+                count_arg = 'size'
+            else:
+                count_arg = '0'
+            offset_arg = 'offset' if 'offset' in f_map.p2t_map else '0'
+            if name in ['getattr', 'setattr', ]:
+                fh_arg = '(fi ? fi->fh : 0)'
+            elif 'fi' in f_map.p2t_map:
+                fh_arg = 'fi->fh'
+            else:
+                fh_arg = '0'
+            strings.append(
+                '    %sClockMeOut(&tEntry, myData, %s, %s, %s);' %
+                (prefix, count_arg, offset_arg, fh_arg))
+        if instrumenting:
+            if name == 'destroy':
+                strings.append('\n    %sWriteBucket();' % prefix)
+            elif name == 'init' and inst_mode == 'flush':
+                strings.append('\n    %sStartBucketWriter();' % prefix)
+            elif name == 'init' and inst_mode == 'mmap':
+                strings.append('\n    %sMapBucketFile();' % prefix)
+        if async_log:
+            if name == 'init':
+                strings.append('\n    %sStartLogWriter();' % prefix)
+            elif name == 'destroy':
+                strings.append('\n    %sStopLogWriter();' % prefix)
+        strings.append("}")
+        if guard:
+            strings.append("#endif")
+
+        out = "\n".join(strings) + "\n"
+        with open(os.path.join(path_to_src, "%s.inc" % name), 'w') as file:
+            file.write(out)
+
+
 def make_fuse_pkg(args):
     """ Create = serialize the fuse package. """
     ac_prereq = args.ac_prereq
     email_addr = args.email_addr
     instrumenting = args.instrumenting
+    inst_mode = getattr(args, 'inst_mode', 'mutex')
+    rec_version = getattr(args, 'rec_version', 1)
+    sampling = getattr(args, 'sampling', False)
     force = args.force
     logging = args.logging
+    async_log = logging and getattr(args, 'async_log', False)
+    binary_log = logging and getattr(args, 'log_format', 'text') == 'binary'
+    log_ops = getattr(args, 'log_ops', None)    # None: every op
+    time_ops = getattr(args, 'time_ops', None)
+    at_calls = getattr(args, 'at_calls', False)
+    attr_cache = getattr(args, 'attr_cache', False)
+    buf_ops = getattr(args, 'buf_ops', False)
+    fuse_api = getattr(args, 'fuse_api', 2)
+    lowlevel = getattr(args, 'lowlevel', False)
+    clone_fd = getattr(args, 'clone_fd', False)
+    max_idle_threads = getattr(args, 'max_idle_threads', None)
+    max_threads = getattr(args, 'max_threads', None)
+    # zero-copy ops are only zero-copy if FUSE may splice
+    conn_caps = [(name, fg_name, cap) for name, fg_name, cap in CONN_CAPS
+                 if getattr(args, name, False) or
+                 (buf_ops and name.startswith('splice_'))]
+    conn_limits = [(name, fg_name, getattr(args, name, None) or 0)
+                   for name, fg_name in CONN_LIMITS]
+    cache_timeouts = [(name, fg_name, getattr(args, name, None))
+                      for name, fg_name in CACHE_TIMEOUTS]
+    keep_cache = getattr(args, 'keep_cache', False)
+    passthrough = getattr(args, 'passthrough', False)
+    io_uring = getattr(args, 'io_uring', False)
     my_date = args.my_date
     my_version = args.my_version
     path_to_pkg = args.path_to_pkg    # target package directory
@@ -487,8 +1404,64 @@ def make_fuse_pkg(args):
     prefix = pkg_name + '_'     # XXX FORCES UNDERSCORE
     uc_name = args.uc_name
 
+    # how the package was generated, recorded in v2 data file headers
+    build_flags = ['inst_mode=%s' % inst_mode,
+                   'rec_version=%d' % rec_version]
+    if logging:
+        build_flags.append('logging')
+    if async_log:
+        build_flags.append('async_log')
+    if binary_log:
+        build_flags.append('log_format=binary')
+    if sampling:
+        build_flags.append('sampling')
+    if time_ops is not None:
+        build_flags.append('time_ops=%s' % ','.join(time_ops))
+    if at_calls:
+        build_flags.append('at_calls')
+    if attr_cache:
+        build_flags.append('attr_cache')
+    if buf_ops:
+        build_flags.append('buf_ops')
+    if fuse_api != 2:
+        build_flags.append('fuse_api=%d' % fuse_api)
+    if lowlevel:
+        build_flags.append('lowlevel')
+    if clone_fd:
+        build_flags.append('clone_fd')
+    if max_idle_threads is not None:
+        build_flags.append('max_idle_threads=%d' % max_idle_threads)
+    if max_threads is not None:
+        build_flags.append('max_threads=%d' % max_threads)
+    for name, _, _ in conn_caps:
+        build_flags.append(name)
+    for name, _, value in conn_limits:
+        if value:
+            build_flags.append('%s=%d' % (name, value))
+    for name, _, value in cache_timeouts:
+        if value is not None:
+            build_flags.append('%s=%g' % (name, value))
+    if keep_cache:
+        build_flags.append('keep_cache')
+    if passthrough:
+        build_flags.append('passthrough')
+    if io_uring:
+        build_flags.append('io_uring')
+    flags_text = join_build_flags(build_flags)
+    if instrumenting and rec_version >= 2 and \
+            flags_text != ' '.join(build_flags):
+        print("warning: the build flags are too long for the data file "
+              "header; recording '%s'" % flags_text)
+
     # make sure opCode <-> opName maps are consistent ---------------
-    func_map, op_code_map = FuseFunc.get_func_map(prefix)
+    if lowlevel:
+        func_map, op_code_map = FuseFunc.get_func_map(
+            prefix, PATH_TO_FIRST_LINES_LL)
+    elif fuse_api == 3:
+        func_map, op_code_map = FuseFunc.get_func_map(
+            prefix, PATH_TO_FIRST_LINES_3)
+    else:
+        func_map, op_code_map = FuseFunc.get_func_map(prefix)
     # DEBUG
     if 'lock' in func_map:
         print("lock is in the main map")
@@ -496,7 +1469,15 @@ def make_fuse_pkg(args):
         print("lock is NOT in the main map")
     # END
     inconsistent = False
-    for ndx, name in enumerate(OP_NAMES):
+    # FUSE 3 has no prototypes for FUSE2_ONLY_OPS; the rest keep their order
+    if lowlevel:
+        expected_ops = LL_OP_NAMES
+    elif fuse_api == 3:
+        expected_ops = [
+            name for name in OP_NAMES if name not in FUSE2_ONLY_OPS]
+    else:
+        expected_ops = OP_NAMES
+    for ndx, name in enumerate(expected_ops):
         if name not in op_code_map:
             break
         ndx_from_name = op_code_map[name]
@@ -508,6 +1489,60 @@ def make_fuse_pkg(args):
         print("inconsistent, aborting")
         sys.exit(1)
 
+    # sampling weights are carried in version 2 records and header
+    if instrumenting and sampling and rec_version < 2:
+        print("sampling requires version 2 records (-R 2); aborting")
+        sys.exit(1)
+
+    # fuse_main() in FUSE 2 offers no control over its worker threads
+    if fuse_api < 3 and (clone_fd or max_idle_threads is not None or
+                         max_threads is not None):
+        print("the FUSE loop can be tuned only with --fuse_api 3; aborting")
+        sys.exit(1)
+    for opt_name, count in [('max_idle_threads', max_idle_threads),
+                            ('max_threads', max_threads), ] + [
+                                (name, getattr(args, name, None))
+                                for name, _ in CONN_LIMITS]:
+        if count is not None and count <= 0:
+            print("%s must be a positive integer; aborting" % opt_name)
+            sys.exit(1)
+    if fuse_api == 3 and getattr(args, 'big_writes', False):
+        print("FUSE 3 always allows big writes; drop --big_writes")
+        sys.exit(1)
+    for name, _, value in cache_timeouts:
+        if value is not None and value < 0:
+            print("%s may not be negative; aborting" % name)
+            sys.exit(1)
+    if lowlevel:
+        if fuse_api < 3:
+            print("--lowlevel requires --fuse_api 3; aborting")
+            sys.exit(1)
+        # the attribute cache and the *at calls are keyed by path, and
+        # low-level reads and writes are already zero-copy
+        for opt_name in ['at_calls', 'attr_cache', 'buf_ops', ]:
+            if getattr(args, opt_name, False):
+                print("--%s does not apply with --lowlevel; aborting" %
+                      opt_name)
+                sys.exit(1)
+        # version 1 data files have no header naming the low-level ops
+        if instrumenting and rec_version < 2:
+            print("--lowlevel instrumentation requires version 2 records "
+                  "(-R 2); aborting")
+            sys.exit(1)
+    # backing files are registered with the request, which only the
+    # low-level API hands to the file system
+    if passthrough and not lowlevel:
+        print("--passthrough requires --lowlevel; aborting")
+        sys.exit(1)
+    # low-level reads and writes, like read_buf and write_buf, are
+    # spliced by FUSE rather than made by the file system
+    if io_uring and (lowlevel or buf_ops):
+        print("--io_uring does not apply with --%s; aborting" % (
+            'lowlevel' if lowlevel else 'buf_ops'))
+        sys.exit(1)
+    # the opcodes, and the op names recorded in data file headers
+    op_name_list = LL_OP_NAMES if lowlevel else OP_NAMES
+
     # ===============================================================
     # CREATE DIRECTORIES
     # ===============================================================
@@ -566,8 +1601,13 @@ def make_fuse_pkg(args):
                     'COPYING', 'COPYING.LIB', 'COPYING.AUTOCONF.EXCEPTION',
                     'COPYING.GNUBL', 'README.licenses', ]:
         copy_from_csrc(in_file, in_file in ['autogen.sh', 'build', ])
-    for in_file in ['fuse.h', 'fuse_common.h', 'fuse_opt.h', ]:
-        copy_from_csrc(in_file, False, False)
+    if fuse_api == 2:
+        for in_file in ['fuse.h', 'fuse_common.h', 'fuse_opt.h', ]:
+            copy_from_csrc(in_file, False, False)
+    if attr_cache:
+        # the attribute cache is keyed by SipHash
+        shutil.copyfile(os.path.join('extern', 'majek_siphash.c'),
+                        os.path.join(path_to_pkg, 'src', 'majek_siphash.c'))
 
     # write CHANGES -------------------------------------------------
     chg_file = os.path.join(path_to_pkg, 'CHANGES')
@@ -579,6 +1619,23 @@ def make_fuse_pkg(args):
 
     # write configure.ac --------------------------------------------
     config_file = os.path.join(path_to_pkg, 'configure.ac')
+    if passthrough:
+        # and passthrough in 3.16
+        fuse_check = 'PKG_CHECK_MODULES(FUSE, fuse3 >= 3.16)\n'
+    elif fuse_api == 3:
+        # the session and loop config calls arrived in 3.12
+        fuse_check = 'PKG_CHECK_MODULES(FUSE, fuse3 >= 3.12)\n'
+    else:
+        fuse_check = """\
+PKG_CHECK_MODULES(FUSE, fuse%s)
+FUSE_LIBS="$FUSE_LIBS -lulockmgr"
+""" % (' >= 2.9' if buf_ops else '')
+    if io_uring:
+        fuse_check += """
+# io_uring, if liburing is recent enough; otherwise plain syscalls
+AC_CHECK_HEADERS([liburing.h],
+    [AC_CHECK_LIB([uring], [io_uring_register_files_sparse])])
+"""
     config_test = """#                                               -*- Autoconf -*-
 # Process this file with autoconf to produce a configure script.
 
@@ -599,9 +1656,7 @@ AC_CHECK_HEADERS([fcntl.h limits.h stdlib.h string.h sys/statvfs.h\\
     unistd.h utime.h sys/xattr.h])
 
 # FUSE development environment
-PKG_CHECK_MODULES(FUSE, fuse)
-FUSE_LIBS="$FUSE_LIBS -lulockmgr"
-
+{4:s}
 # Necessary typedefs and structures
 AC_TYPE_MODE_T
 AC_TYPE_OFF_T
@@ -620,11 +1675,11 @@ AC_FUNC_MALLOC
 
 AC_CHECK_FUNCS([fdatasync ftruncate mkdir mkfifo realpath rmdir strerror \\
     utimensat])
-AC_CHECK_FUNCS([posix_fallocate])
+AC_CHECK_FUNCS([fallocate posix_fallocate])
 
 AC_CONFIG_FILES([Makefile src/Makefile])
 AC_OUTPUT
-""".format(ac_prereq, pkg_name, my_date, email_addr)
+""".format(ac_prereq, pkg_name, my_date, email_addr, fuse_check)
     with open(config_file, 'w', 0o644) as file:
         file.write(config_test)
 
@@ -676,24 +1731,28 @@ install-dvi install-info install-ps install-pdf dvi pdf ps info :
     path_to_cmd = os.path.join(path_to_bin, 'mount' + uc_name)
     with open(path_to_cmd, 'w') as file:
         file.write("cd %s\n" % path_to_pkg)
-        file.write("src/%s workdir/rootdir workdir/mountPoint\n" % pkg_name)
+        file.write('src/%s workdir/rootdir workdir/mountPoint "$@"\n' %
+                   pkg_name)
     os.chmod(path_to_cmd, 0o744)
 
     # write bin/umountNAME
     path_to_cmd = os.path.join(path_to_bin, 'umount' + uc_name)
     with open(path_to_cmd, 'w') as file:
         file.write("cd %s\n" % path_to_pkg)
-        file.write("fusermount -uz workdir/mountPoint\n")
+        file.write("%s -uz workdir/mountPoint\n" % (
+            'fusermount3' if fuse_api == 3 else 'fusermount'))
     os.chmod(path_to_cmd, 0o744)
 
     # write bin/blk-31-4k
     path_to_cmd = os.path.join(path_to_bin, 'blk-31-4k')
     content = """echo "blk-31-4k: test size is being set to $1 MB"
 #
+size=$1
+shift                   # any other arguments go to the file system
 cd ~/dev/c/{0:s}
-bin/mount{1:s}
+bin/mount{1:s} "$@"
 cd workdir/mountPoint
-fio --name=global --bs=4k --size=$1m \
+fio --name=global --bs=4k --size=${{size}}m \
 \	--rw=randrw --rwmixread=75 \
 \	--name=job1 --name=job2 --name=job3 --name=job4
 cd ../..
@@ -717,10 +1776,15 @@ bin/umount{1:s}
 #ifndef _FUSE_VERSION_H_
 #define _FUSE_VERSION_H_
 
-#define FUSE_USE_VERSION 26
+#define FUSE_USE_VERSION {0:d}
 
+// for O_PATH, AT_EMPTY_PATH and fallocate(), so before any system header
+#ifndef _GNU_SOURCE
+#define _GNU_SOURCE
 #endif
-"""
+
+#endif
+""".format(312 if fuse_api == 3 else 26)
 
     with open(fuse_version_file, 'w') as file:
         file.write(content)
@@ -729,11 +1793,12 @@ bin/umount{1:s}
     make_am_file = os.path.join(path_to_src, 'Makefile.am')
     content = """
 bin_PROGRAMS = {0:s}
-{1:s}SOURCES = {0:s}.c fuse.h fuse_version.h opcodes.h {0:s}.h util.c\\
-    $(wildcard *.inc)
+{1:s}SOURCES = {0:s}.c {3:s}fuse_version.h opcodes.h {0:s}.h util.c\\
+    {2:s}$(wildcard *.inc)
 AM_CFLAGS = @FUSE_CFLAGS@
 LDADD = @FUSE_LIBS@
-""".format(pkg_name, prefix)
+""".format(pkg_name, prefix, 'majek_siphash.c ' if attr_cache else '',
+           'fuse.h ' if fuse_api == 2 else '')
 
     with open(make_am_file, 'w', 0o644) as file:
         file.write(content)
@@ -798,6 +1863,21 @@ int32_t {0:s}GetULongArg(const char *name, const char *s)
     }}
     return val;
 }}
+
+double {0:s}GetDoubleArg(const char *name, const char *s)
+{{
+    char *end = NULL;
+    double val = strtod(s, &end);
+    if ((end == s) || (*end != 0)) {{
+        fprintf(stderr, "%s must be numeric but is '%s'\\n", name, s);
+        {0:s}Usage();
+    }}
+    if (val < 0) {{
+        fprintf(stderr, "%s may not be negative but is '%s'\\n", name, s);
+        {0:s}Usage();
+    }}
+    return val;
+}}
 int main(int argc, char *argv[])
 {{
     int status = 0;
@@ -822,6 +1902,12 @@ int main(int argc, char *argv[])
     }}
 """.format(pkg_name)                                # BAZ
 
+    if lowlevel:
+        content += """\
+    // the low-level API has no fuse_get_context() to find it with
+    {0:s}PrivateData = myData;
+""".format(prefix)
+
     if logging:
         content += """\
     // Set up logging
@@ -832,13 +1918,13 @@ int main(int argc, char *argv[])
     // Strange warning here "initialization makes pointer from integer
     // without a cast"
     char *whereNow = get_current_dir_name();    // mallocs
-    if (whereNow == NULL) {{
+    if (whereNow == NULL) {
         fprintf(stderr, "get_current_dir_name failed\\n");
         perror("can't get working directory");
         abort();
-    }} else {{
+    } else {
         myData->cwd = whereNow;
-    }}
+    }
 
     // Handle the argument list.  Any arguments whose names begin with "fg"
     // are assumed to be local and are not passed on to fuse.  The last two
@@ -847,62 +1933,154 @@ int main(int argc, char *argv[])
     // (excluding the fg* but including the path to mount point) are
     // passed on to fuse_main.
 
-    static struct option longOptions[] = {{
-        {{"fgBlockSize", 1, NULL, 0}},    // default = 4, times 1024 bytes
-        {{"fgHelp",      0, NULL, 0}},
-        {{"fgJobCount",  1, NULL, 0}},    // default = 4
-        {{"fgMBPerJob",  1, NULL, 0}},
-        {{"fgVerbose",   0, NULL, 0}},
-        {{NULL,          1, NULL, 0 }}    // marks end of list
-    }};
+    static struct option longOptions[] = {
+"""                 # .format(pkg_name, prefix, uc_name)     # FOO
+
+    # local (fg*) command line options, which are not passed to fuse:
+    # name, whether it takes an argument, comment, and C code to run
+    fg_options = [
+        ('fgBlockSize', 1, 'default = 4, times 1024 bytes',
+         'fgBlockSize = %sGetULongArg(longOptions[optNdx].name, optarg);' %
+         pkg_name),
+        ('fgHelp', 0, '', '%sUsage();' % pkg_name),
+        ('fgJobCount', 1, 'default = 4',
+         'fgJobCount = %sGetULongArg(longOptions[optNdx].name, optarg);' %
+         pkg_name),
+        ('fgMBPerJob', 1, '',
+         'fgMBPerJob = %sGetULongArg(longOptions[optNdx].name, optarg);' %
+         pkg_name),
+        ('fgVerbose', 0, '', 'fgVerbose = 1;'),
+    ]
+    if instrumenting and inst_mode in ['mutex', 'thread', 'mmap', ]:
+        fg_options.append(
+            ('fgMaxSlotMB', 1, 'default = 0, meaning no limit',
+             'fgMaxSlotMB = %sGetULongArg(longOptions[optNdx].name, optarg);' %
+             pkg_name))
+    if instrumenting and sampling:
+        fg_options.append(
+            ('fgSampleEvery', 1, 'default = 1, record every call',
+             'fgSampleEvery = %sGetULongArg(longOptions[optNdx].name, optarg);'
+             % pkg_name))
+        fg_options.append(
+            ('fgSamplePerSec', 1, 'default = 0, meaning no limit',
+             'fgSamplePerSec = %sGetULongArg(longOptions[optNdx].name, '
+             'optarg);' % pkg_name))
+    if attr_cache:
+        fg_options.append(
+            ('fgAttrTTL', 1, 'default = 1000 ms',
+             'fgAttrTTL = %sGetULongArg(longOptions[optNdx].name, optarg);' %
+             pkg_name))
+    if io_uring:
+        fg_options.append(
+            ('fgRingDepth', 1, 'default = 8, 0: syscalls',
+             'fgRingDepth = %sGetULongArg(longOptions[optNdx].name, optarg);'
+             % pkg_name))
+    for name, fg_name, _ in CONN_CAPS:
+        if fuse_api == 3 and name == 'big_writes':
+            continue
+        fg_options.append(
+            (fg_name, 0, 'default = on' if fg_name in [
+                cap[1] for cap in conn_caps] else '', '%s = 1;' % fg_name))
+    for name, fg_name, value in conn_limits:
+        fg_options.append(
+            (fg_name, 1, 'default = %d' % value if value else '',
+             '%s = %sGetULongArg(longOptions[optNdx].name, optarg);' % (
+                 fg_name, pkg_name)))
+    for name, fg_name, value in cache_timeouts:
+        fg_options.append(
+            (fg_name, 1, 'default = %g s' % value if value is not None
+             else '',
+             '%s = %sGetDoubleArg(longOptions[optNdx].name, optarg);' % (
+                 fg_name, pkg_name)))
+    if keep_cache:
+        fg_options.append(('fgNoKeepCache', 0, '', 'fgKeepCache = 0;'))
+    if passthrough:
+        fg_options.append(
+            ('fgNoPassthrough', 0, '', 'fgPassthrough = 0;'))
+    fg_options.sort()
+    for fg_name, fg_has_arg, fg_comment, _ in fg_options:
+        line = '        {%-15s %d, NULL, 0},' % ('"%s",' % fg_name, fg_has_arg)
+        if fg_comment:
+            line = '%-47s// %s' % (line, fg_comment)
+        content += line + '\n'
+    content += """\
+        {NULL,           1, NULL, 0},           // marks end of list
+    };
 
     // process the argument list, permuting it so that local fg* arguments
     // are moved towards the front
-    while (1) {{
+    while (1) {
         int optNdx;
         int c = getopt_long(argc, argv, "", longOptions, &optNdx);
         if (c == -1)
             break;
-        switch (optNdx) {{
-        case 0:
-            fgBlockSize = {0:s}GetULongArg(longOptions[optNdx].name, optarg);
-            localArgs += 2;
-            break;
-        case 1:
-            {0:s}Usage();
-            localArgs += 1;
-            break;
-        case 2:
-            fgJobCount = {0:s}GetULongArg(longOptions[optNdx].name, optarg);
-            localArgs += 2;
-            break;
-        case 3:
-            fgMBPerJob = {0:s}GetULongArg(longOptions[optNdx].name, optarg);
-            localArgs += 2;
-            break;
-        case 4:
-            fgVerbose = 1;
-            localArgs += 1;
+        switch (optNdx) {
+"""
+    for ndx, (fg_name, fg_has_arg, _, fg_action) in enumerate(fg_options):
+        content += """\
+        case %d:
+            %s
+            localArgs += %d;
             break;
-        }}
-    }}
+""" % (ndx, fg_action, 1 + fg_has_arg)
+    content += """\
+        }
+    }
     int i;
 
-""".format(pkg_name)        # , prefix, uc_name)     # FOO
+"""
 
     if instrumenting:
         content += """\
     // number of slots in a bucket
     slotsPerBucket = 1024 * fgMBPerJob * fgJobCount / fgBlockSize;
 
+"""
+        if inst_mode in ['mutex', 'thread', ]:
+            content += """\
+    // chunks of slots are allocated as needed, up to any limit
+    if (fgMaxSlotMB > 0) {
+        maxChunks = fgMaxSlotMB * 1024 * 1024 / sizeof(chunk_t);
+        if (maxChunks == 0)
+            maxChunks = 1;
+    }
+
+"""
+        elif inst_mode == 'mmap':
+            content += """\
+    // the data file grows an extent at a time, up to any limit
+    if (fgMaxSlotMB > 0) {
+        maxExtents = fgMaxSlotMB * 1024 * 1024 /
+                                    (EXTENT_SLOTS * sizeof(opData_t));
+        if (maxExtents == 0)
+            maxExtents = 1;
+        else if (maxExtents > MAX_EXTENTS)
+            maxExtents = MAX_EXTENTS;
+    }
+
+"""
+        if inst_mode == 'mutex':
+            content += """\
     buckets         = (bucket_t*)calloc(BUCKET_COUNT, sizeof(bucket_t));
-    buckets[0].ops  = (opData_t*)calloc(slotsPerBucket, sizeof(opData_t));
     status = pthread_mutex_init(&buckets[0].lock, NULL);
     if (status)
         perror("initializing bucket lock");
     assert(status == 0);
 
-    if (fgVerbose) {{
+"""
+        elif inst_mode == 'flush':
+            content += """\
+    // two buckets of fixed size: one fills while the other is written
+    buckets = (bucket_t*)calloc(BUCKET_COUNT, sizeof(bucket_t));
+    assert(buckets != NULL);
+    for (i = 0; i < BUCKET_COUNT; i++) {
+        buckets[i].ops = (opData_t*)calloc(slotsPerBucket, sizeof(opData_t));
+        assert(buckets[i].ops != NULL);
+    }
+
+"""
+        content += """\
+    if (fgVerbose) {
         fprintf(stderr, "fgBlockSize := %ld\\n", fgBlockSize);
         fprintf(stderr, "fgJobCount  := %ld\\n", fgJobCount);
         fprintf(stderr, "fgMBPerJob  := %ld\\n", fgMBPerJob);
@@ -910,12 +2088,29 @@ int main(int argc, char *argv[])
         fprintf(stderr, "  sizeof(opData_t)  %ld\\n",  sizeof(opData_t));
         fprintf(stderr, "  so size of buffer %ld bytes\\n",
             slotsPerBucket * sizeof(opData_t));
+"""
+        if inst_mode in ['mutex', 'thread', ]:
+            content += """\
+        fprintf(stderr, "fgMaxSlotMB := %ld (%ld chunks of %d slots)\\n",
+            fgMaxSlotMB, maxChunks, CHUNK_SLOTS);
+"""
+        elif inst_mode == 'mmap':
+            content += """\
+        fprintf(stderr, "fgMaxSlotMB := %ld (%ld extents of %d slots)\\n",
+            fgMaxSlotMB, maxExtents, EXTENT_SLOTS);
+"""
+        if sampling:
+            content += """\
+        fprintf(stderr, "fgSampleEvery  := %ld\\n", fgSampleEvery);
+        fprintf(stderr, "fgSamplePerSec := %ld\\n", fgSamplePerSec);
+"""
+        content += """\
 
         fprintf(stderr, "\\nafter processing the %d local arguments\\n",
             localArgs);
         for (i = 0; i < argc; i++)
             fprintf(stderr, "  %d: %s\\n", i, argv[i]);
-    }}
+    }
 """                 # .format(pkg_name, prefix, uc_name)     # FOO
 
     content += """\
@@ -942,66 +2137,340 @@ int main(int argc, char *argv[])
     // which doesn't expect to see it.
     //
     myData->rootdir = realpath(argv[argc-2], NULL);
+""".format(pkg_name)                         # BAZ
+
+    if at_calls:
+        content += """\
+    // The *at syscalls are made relative to this.
+    myData->rootfd = open(myData->rootdir, O_PATH | O_DIRECTORY);
+    if (myData->rootfd < 0)
+        {0:s}PerrorAndUsage(myData->rootdir);
+""".format(pkg_name)
+
+    if lowlevel:
+        content += """\
+    // Files are known by inode numbers, the first being the root's.
+    if ({1:s}InodeInit(myData->rootdir) < 0)
+        {0:s}PerrorAndUsage(myData->rootdir);
+""".format(pkg_name, prefix)
+
+    content += """\
     argv[argc-2] = argv[argc-1];
     argv[argc-1] = NULL;
     argc--;
 
-    if (fgVerbose) {{
+    if (fgVerbose) {
         fprintf(stderr, "\\nafter editing argument list\\n");
         for (i = 0; i < argc; i++)
             printf("  %d: %s\\n", i, argv[i]);
-    }}
-
-    status = fuse_main(argc, argv, &{1:s}OpTable, myData);
-    return status;
-}}
-""".format(pkg_name, prefix)                         # BAZ
-
-    path_to_main = os.path.join(path_to_src, 'main.inc')
-    with open(path_to_main, 'w') as file:
-        file.write(content)
-
-    # src/opcodes.h -------------------------------------------------
-    path_to_op_codes = os.path.join(path_to_src, 'opcodes.h')
-    with open(path_to_op_codes, 'w') as file:
-        file.write("/* opcodes.h */\n\n")
-        file.write("#ifndef _OPCODES_H_\n")
-        for ndx, name in enumerate(OP_NAMES):
-            file.write("#define FG_%-14s (%d)\n" % (name.upper(), ndx))
-        file.write("#endif\n")
+    }
 
-    # package header file -------------------------------------------
-    content = """/** {0:s}.h */
+"""                         # .format(pkg_name, prefix)  # BAZ
 
-#ifndef _{1:s}_H_
-#define _{1:s}_H_
+    if attr_cache:
+        content += """\
+    {0:s}AttrInit();
 
-#ifdef linux
-#ifndef _XOPEN_SOURCE
-#define _XOPEN_SOURCE (700)
-#endif
-#endif
+""".format(prefix)
 
-""".format(pkg_name, uc_name)     # FOO
+    # options chosen here or by fg* flags are passed on to FUSE ahead of
+    # those on the command line, which so take precedence
+    content += """\
+    // Options chosen when this file system was generated or by fg* flags
+    // go ahead of the command line, so that any given there take
+    // precedence.
+    struct fuse_args args = FUSE_ARGS_INIT(0, NULL);
+"""
+    if not lowlevel:
+        content += """\
+    char opt[64];
+"""
+    content += """\
+    status = fuse_opt_add_arg(&args, argv[0]);
+"""
+    if clone_fd:
+        content += """\
+    status |= fuse_opt_add_arg(&args, "-oclone_fd");
+"""
+    for opt_name, count in [('max_idle_threads', max_idle_threads),
+                            ('max_threads', max_threads), ]:
+        if count is not None:
+            content += """\
+    status |= fuse_opt_add_arg(&args, "-o%s=%d");
+""" % (opt_name, count)
+    if lowlevel:
+        # FUSE's defaults, given to the kernel with each reply
+        content += """\
+    // The low-level API leaves the cache timeouts to the file system,
+    // which gives them with its replies; unset, they are FUSE's defaults.
+"""
+        for _, fg_name, _ in cache_timeouts:
+            content += """\
+    if (%s < 0)
+        %s = %s;
+""" % (fg_name, fg_name, '0.0' if fg_name == 'fgNegativeTimeout' else '1.0')
+    else:
+        for name, fg_name, _ in cache_timeouts:
+            content += """\
+    if (%s >= 0) {
+        snprintf(opt, sizeof(opt), "-o%s=%%g", %s);
+        status |= fuse_opt_add_arg(&args, opt);
+    }
+""" % (fg_name, name, fg_name)
+    content += """\
+    for (i = 1; i < argc; i++)
+        status |= fuse_opt_add_arg(&args, argv[i]);
+    if (status) {
+        perror("fuse_opt_add_arg failed");
+        abort();
+    }
+    if (fgVerbose) {
+        fprintf(stderr, "\\npassed on to FUSE\\n");
+        for (i = 0; i < args.argc; i++)
+            fprintf(stderr, "  %d: %s\\n", i, args.argv[i]);
+    }
 
-    if instrumenting:
+"""
+    if fuse_api == 2:
+        content += """\
+    status = fuse_main(args.argc, args.argv, &{0:s}OpTable, myData);
+    fuse_opt_free_args(&args);
+    return status;
+}}
+""".format(prefix)                         # BAZ
+    elif lowlevel:
+        # what the low-level examples in libfuse do, with the loop
+        # configured as below
+        content += """\
+    struct fuse_cmdline_opts opts;
+    struct fuse_loop_config *loopConfig = NULL;
+    struct fuse_session *se;
+
+    // clone_fd, max_idle_threads, max_threads, -s, and -f are taken
+    // from the argument list here; the rest are left for
+    // fuse_session_new()
+    if (fuse_parse_cmdline(&args, &opts) != 0)
+        return 1;
+    if (opts.show_help) {{
+        printf("usage:  {0:s} [FUSE, mount, and fg* options] "
+               "rootDir mountPoint\\n\\n");
+        fuse_cmdline_help();
+        fuse_lowlevel_help();
+        goto out1;
+    }} else if (opts.show_version) {{
+        printf("FUSE library version %s\\n", fuse_pkgversion());
+        fuse_lowlevel_version();
+        goto out1;
+    }}
+    if (opts.mountpoint == NULL) {{
+        fprintf(stderr, "no mount point\\n");
+        status = 1;
+        goto out1;
+    }}
+    if (fgVerbose)
+        fprintf(stderr, "clone_fd %d, max_idle_threads %u, "
+                "max_threads %u%s\\n", opts.clone_fd,
+                opts.max_idle_threads, opts.max_threads,
+                opts.singlethread ? ", single-threaded" : "");
+
+    se = fuse_session_new(&args, &{1:s}OpTable, sizeof({1:s}OpTable),
+                                                                myData);
+    if (se == NULL) {{
+        status = 1;
+        goto out1;
+    }}
+    if (fuse_set_signal_handlers(se) != 0) {{
+        status = 1;
+        goto out2;
+    }}
+    if (fuse_session_mount(se, opts.mountpoint) != 0) {{
+        status = 1;
+        goto out3;
+    }}
+    fuse_daemonize(opts.foreground);
+
+    if (opts.singlethread)
+        status = fuse_session_loop(se);
+    else {{
+        loopConfig = fuse_loop_cfg_create();
+        if (loopConfig == NULL) {{
+            status = 1;
+            goto out4;
+        }}
+        fuse_loop_cfg_set_clone_fd(loopConfig, opts.clone_fd);
+        fuse_loop_cfg_set_idle_threads(loopConfig, opts.max_idle_threads);
+        fuse_loop_cfg_set_max_threads(loopConfig, opts.max_threads);
+        status = fuse_session_loop_mt(se, loopConfig);
+        fuse_loop_cfg_destroy(loopConfig);
+    }}
+    if (status)
+        status = 1;
+
+out4:
+    fuse_session_unmount(se);
+out3:
+    fuse_remove_signal_handlers(se);
+out2:
+    fuse_session_destroy(se);
+out1:
+    free(opts.mountpoint);
+    fuse_opt_free_args(&args);
+    return status;
+}}
+""".format(pkg_name, prefix)
+    else:
+        # what fuse_main() does, but with the loop configured here
+        content += """\
+    struct fuse_cmdline_opts opts;
+    struct fuse_loop_config *loopConfig = NULL;
+    struct fuse *fuse;
+    struct fuse_session *se;
+
+    // clone_fd, max_idle_threads, max_threads, -s, and -f are taken
+    // from the argument list here; the rest are left for fuse_new()
+    if (fuse_parse_cmdline(&args, &opts) != 0)
+        return 1;
+    if (opts.show_help) {{
+        printf("usage:  {0:s} [FUSE, mount, and fg* options] "
+               "rootDir mountPoint\\n\\n");
+        fuse_cmdline_help();
+        fuse_lib_help(&args);
+        goto out1;
+    }} else if (opts.show_version) {{
+        printf("FUSE library version %s\\n", fuse_pkgversion());
+        fuse_lowlevel_version();
+        goto out1;
+    }}
+    if (fgVerbose)
+        fprintf(stderr, "clone_fd %d, max_idle_threads %u, "
+                "max_threads %u%s\\n", opts.clone_fd,
+                opts.max_idle_threads, opts.max_threads,
+                opts.singlethread ? ", single-threaded" : "");
+
+    fuse = fuse_new(&args, &{1:s}OpTable, sizeof({1:s}OpTable), myData);
+    if (fuse == NULL) {{
+        status = 1;
+        goto out1;
+    }}
+    if (fuse_mount(fuse, opts.mountpoint) != 0) {{
+        status = 1;
+        goto out2;
+    }}
+    if (fuse_daemonize(opts.foreground) != 0) {{
+        status = 1;
+        goto out3;
+    }}
+    se = fuse_get_session(fuse);
+    if (fuse_set_signal_handlers(se) != 0) {{
+        status = 1;
+        goto out3;
+    }}
+
+    if (opts.singlethread)
+        status = fuse_loop(fuse);
+    else {{
+        loopConfig = fuse_loop_cfg_create();
+        if (loopConfig == NULL) {{
+            status = 1;
+            goto out4;
+        }}
+        fuse_loop_cfg_set_clone_fd(loopConfig, opts.clone_fd);
+        fuse_loop_cfg_set_idle_threads(loopConfig, opts.max_idle_threads);
+        fuse_loop_cfg_set_max_threads(loopConfig, opts.max_threads);
+        status = fuse_loop_mt(fuse, loopConfig);
+        fuse_loop_cfg_destroy(loopConfig);
+    }}
+    if (status)
+        status = 1;
+
+out4:
+    fuse_remove_signal_handlers(se);
+out3:
+    fuse_unmount(fuse);
+out2:
+    fuse_destroy(fuse);
+out1:
+    free(opts.mountpoint);
+    fuse_opt_free_args(&args);
+    return status;
+}}
+""".format(pkg_name, prefix)
+
+    path_to_main = os.path.join(path_to_src, 'main.inc')
+    with open(path_to_main, 'w') as file:
+        file.write(content)
+
+    # src/opcodes.h -------------------------------------------------
+    path_to_op_codes = os.path.join(path_to_src, 'opcodes.h')
+    with open(path_to_op_codes, 'w') as file:
+        file.write("/* opcodes.h */\n\n")
+        file.write("#ifndef _OPCODES_H_\n")
+        for ndx, name in enumerate(op_name_list):
+            file.write("#define FG_%-14s (%d)\n" % (name.upper(), ndx))
+        file.write("#endif\n")
+
+    # package header file -------------------------------------------
+    content = """/** {0:s}.h */
+
+#ifndef _{1:s}_H_
+#define _{1:s}_H_
+
+#ifdef linux
+#ifndef _XOPEN_SOURCE
+#define _XOPEN_SOURCE (700)
+#endif
+#endif
+
+""".format(pkg_name, uc_name)     # FOO
+
+    if at_calls:
+        content += """\
+#ifdef linux
+#ifndef _GNU_SOURCE
+#define _GNU_SOURCE         // for O_PATH
+#endif
+#endif
+
+"""
+
+    if instrumenting or async_log or binary_log or lowlevel or io_uring:
         content += """\
 #include <pthread.h>        // should be first
 """
 
     content += """\
 #include <assert.h>
+"""
+    if lowlevel:
+        content += """\
+#include <dirent.h>
+"""
+    content += """\
 #include <errno.h>
 #include <fcntl.h>
 #include <fuse.h>
+"""
+    if fuse_api == 3:
+        content += """\
+#include <fuse_lowlevel.h>   // for fuse_parse_cmdline()
+"""
+    content += """\
 #include <limits.h>
+#include <stddef.h>         // for offsetof()
 #include <stdio.h>
 #include <stdlib.h>
 #include <string.h>
 #include <sys/file.h>       // for flock()
+#include <sys/mman.h>       // for mmap()
+#include <sys/syscall.h>    // for SYS_gettid
 #include <sys/types.h>
 #include <time.h>
+"""
+    if fuse_api == 2:
+        content += """\
 #include <ulockmgr.h>
+"""
+    content += """\
 #include <unistd.h>
 
 #include "config.h"
@@ -1015,12 +2484,127 @@ struct {0:s}Data {{
     // XXX next line should be generated only if logging capability
     FILE *logfile;
     char *rootdir;
+""".format(pkg_name, prefix)     # FOO
+    if at_calls:
+        content += """\
+    int   rootfd;   // O_PATH fd for rootdir
+"""
+    content += """\
     char *cwd;      // at the beginning of the run
-}};
+};
+
+"""     # .format(pkg_name, prefix, uc_name)     # FOO
+    if lowlevel:
+        content += """\
+extern struct {0:s}Data *{1:s}PrivateData;
+#define {2:s}_DATA ({1:s}PrivateData)
+
+""".format(pkg_name, prefix, uc_name)
+    else:
+        content += """\
+#define {1:s}_DATA ((struct {0:s}Data *) fuse_get_context()->private_data)
+
+""".format(pkg_name, uc_name)     # FOO
+
+    if lowlevel:
+        content += """\
+// low-level API
+extern double fgAttrTimeout;        // seconds, given with each reply
+extern double fgEntryTimeout;
+
+typedef struct {{
+    DIR             *dp;
+    struct dirent   *entry;         // read but not yet returned
+    off_t           offset;         // of the next entry
+}} llDir_t;
+
+int  {0:s}InodeInit  (const char *rootdir);
+int  {0:s}InodeFd    (fuse_ino_t ino);
+int  {0:s}DoLookup   (fuse_ino_t parent, const char *name,
+                                        struct fuse_entry_param *e);
+void {0:s}Forget     (fuse_ino_t ino, uint64_t nlookup);
+int  {0:s}FillDir    (fuse_req_t req, fuse_ino_t ino, char *buf,
+                        size_t size, off_t offset, llDir_t *d, int plus);
+void {0:s}InodeReport(void);
+
+// Name the file open on fd, for syscalls with no form taking an fd.
+static inline void {0:s}ProcPath(char procname[64], int fd)
+{{
+    snprintf(procname, 64, "/proc/self/fd/%d", fd);
+}}
+
+""".format(prefix)
+
+    if at_calls:
+        content += """\
+#ifndef O_PATH
+#define O_PATH O_RDONLY
+#endif
+
+// Given a path relative to the mount point, return it relative to the
+// root directory, for use with the *at syscalls.
+static inline const char *{0:s}RelPath(const char *path)
+{{
+    return path[1] ? path + 1 : ".";
+}}
+
+""".format(prefix)
+
+    if attr_cache:
+        content += """\
+// attribute cache
+extern long fgAttrTTL;              // in milliseconds
+
+typedef struct {{
+    uint64_t    gen;                // attrGen at the miss
+    uint64_t    forgets;            // of the slot at the miss
+}} attrTicket_t;
+
+uint64_t siphash24(const void *src, unsigned long src_sz, const char key[16]);
+void {0:s}AttrInit     (void);
+int  {0:s}AttrGet      (const char *path, struct stat *si,
+                                                attrTicket_t *ticket);
+void {0:s}AttrPut      (const char *path, struct stat *si,
+                                                attrTicket_t *ticket);
+void {0:s}AttrForget   (const char *path);
+void {0:s}AttrForgetAll(void);
+void {0:s}AttrReport   (void);
+
+""".format(prefix)
+
+    if keep_cache:
+        content += """\
+// keep_cache on open
+extern int fgKeepCache;
+
+int  {0:s}KeepCache      (int fd);
+void {0:s}KeepCacheReport(void);
+
+""".format(prefix)
+
+    if io_uring:
+        content += """\
+// read, write and fsync through io_uring
+extern long fgRingDepth;
+
+ssize_t {0:s}RingRead  (int fd, void *buf, size_t size, off_t offset);
+ssize_t {0:s}RingWrite (int fd, const void *buf, size_t size, off_t offset);
+int     {0:s}RingFsync (int fd, int datasync);
+void    {0:s}RingForget(int fd);
+
+""".format(prefix)
+
+    if passthrough:
+        content += """\
+// passthrough to backing files
+extern int fgPassthrough;
 
-#define {2:s}_DATA ((struct {0:s}Data *) fuse_get_context()->private_data)
+int  {0:s}PassthroughOpen   (fuse_req_t req, fuse_ino_t ino,
+                                        struct fuse_file_info *fi);
+void {0:s}PassthroughRelease(fuse_req_t req, fuse_ino_t ino);
+void {0:s}PassthroughReport (void);
 
-""".format(pkg_name, prefix, uc_name)     # FOO
+""".format(prefix)
 
     if logging:
         content += """\
@@ -1029,13 +2613,88 @@ void {0:s}LogConn   (struct fuse_conn_info *conn);
 void {0:s}LogEntry  (const char *fmt, ...);
 void {0:s}LogFI     (struct fuse_file_info *fi);
 void {0:s}LogMsg    (const char *fmt, ...);
+void {0:s}LogFullPath(char fpath[PATH_MAX], const char *path);
 void {0:s}LogStat   (struct stat *si);
 void {0:s}LogstatVFS(struct statvfs *sv);
 FILE *{0:s}OpenLog  (void);
 int  {0:s}FlushLog  (void);
+""".format(prefix)          # pkg_name, prefix, uc_name)     # FOO
+        if async_log:
+            content += """\
+int  {0:s}StartLogWriter(void);
+void {0:s}StopLogWriter (void);
+""".format(prefix)          # pkg_name, prefix, uc_name)     # FOO
+        if binary_log:
+            content += """\
+
+// binary log ------------------------------------------------------
+#define LOG_START       (1)         // begins each run of the file system
+#define LOG_STR         (2)         // payload is an id, then the string
+#define LOG_FMT         (3)         // payload is a format id, then args
+#define LOG_TEXT        (4)         // payload is text
+#define LOG_NO_OP       (0xff)      // opCode when not logging a call
+#define LOG_VERSION     (1)
+#define LOG_HEAD_BYTES  (56)
+
+// Each entry in the log is a head record followed by `more` records
+// which hold the rest of its payload.
+typedef struct {{
+    uint8_t     type;
+    uint8_t     opCode;
+    uint16_t    more;           // records which follow this one
+    uint32_t    len;            // LOG_FMT: args; otherwise bytes
+    char        bytes[LOG_HEAD_BYTES] __attribute__((aligned(8)));
+}} logRec_t;                     // 64 bytes
+
+// the payload of a LOG_START entry
+typedef struct {{
+    char        magic[8];       // "FGBINLOG"
+    uint32_t    version;        // LOG_VERSION
+    uint32_t    recSize;        // sizeof(logRec_t)
+    uint64_t    realSec;        // CLOCK_REALTIME when the log was opened
+    uint32_t    realNsec;
+    uint32_t    pid;
+}} logStart_t;
+
+uint64_t {0:s}Intern(const char *str);
+void {0:s}LogCall   (unsigned opCode, const char *fmt, int nargs, ...);
+void {0:s}LogFormat (unsigned opCode, uint64_t *fmtId, const char *fmt,
+                    int nargs, uint64_t *args);
 """.format(prefix)          # pkg_name, prefix, uc_name)     # FOO
 
     if instrumenting:
+        if rec_version == 1:
+            op_data_t = """\
+// Beware: the standard does not guarantee the order of fields!
+typedef struct o_ {
+    uint32_t    opSec;
+    uint32_t    opNsec;             // may not exceed BILLION
+    uint32_t    lateNsec;           // ns of latency; may not exceed BILLION
+    unsigned    lateSec     :  7;   // sec of latency
+    unsigned    count       : 17;   // number bytes read or written; 128K max
+    unsigned    opCode      :  8;
+} __attribute__((aligned(16), packed)) opData_t;
+"""
+        else:
+            op_data_t = """\
+// Version 2 of the record: no bit fields, and room for the file offset,
+// file handle, and thread of each call.
+typedef struct o_ {
+    uint32_t    opSec;
+    uint32_t    opNsec;             // may not exceed BILLION
+    uint32_t    lateSec;            // sec of latency
+    uint32_t    lateNsec;           // ns of latency; may not exceed BILLION
+    uint64_t    offset;             // in the file, if any
+    uint64_t    fh;                 // file handle, if any
+    uint32_t    count;              // number bytes read or written
+    uint32_t    tid;                // kernel thread ID of the FUSE worker
+    uint16_t    opCode;
+    uint16_t    flags;              // REC_* bits
+    uint32_t    weight;             // calls recorded by this; 0 means 1
+} __attribute__((aligned(16), packed)) opData_t;
+
+#define REC_PASSTHROUGH (0x0001)    // open or create passed through
+"""
         content += """
 // BEGIN INSTRUMENTATION --------------------------------------------
 
@@ -1048,30 +2707,120 @@ extern int  fgVerbose;
 #define BILLION     (1000000000UL)
 #define BUCKET_COUNT (2)
 
-// Beware: the standard does not guarantee the order of fields!
-typedef struct o_ {{
-    uint32_t    opSec;
-    uint32_t    opNsec;             // may not exceed BILLION
-    uint32_t    lateNsec;           // ns of latency; may not exceed BILLION
-    unsigned    lateSec     :  7;   // sec of latency
-    unsigned    count       : 17;   // number bytes read or written; 128K max
-    unsigned    opCode      :  8;
-}} __attribute__((aligned(16), packed)) opData_t;
+{0:s}
+// Slots are handed out from fixed-size chunks which are chained together
+// and never moved, so a slot pointer stays valid until the data is
+// written out.
+#define CHUNK_SLOTS (4096)
+
+typedef struct c_ {{
+    struct c_       *next;          // next chunk in the chain
+    uint32_t        count;          // number of slots in use
+    opData_t        ops[CHUNK_SLOTS];
+}} chunk_t;
 
 typedef struct b_ {{
     uint32_t        count;          // number of slots in use
+    uint32_t        inFlight;       // slots claimed but not yet clocked out
+    int             full;           // waiting to be written to disk
     pthread_mutex_t lock;
     pthread_cond_t  cond;
     opData_t        *ops;           // [BUCKET_SIZE];
+    chunk_t         *head;          // first and last chunks in use
+    chunk_t         *tail;
 }} bucket_t;
 
 extern long     slotsPerBucket;     // number of opData_t
 extern long     maxBucketSize;
 extern bucket_t *buckets;           // [BUCKET_COUNT];
+""".format(op_data_t)   # pkg_name, prefix, uc_name)     # FOO
+
+        if inst_mode == 'thread':
+            content += """
+// Slots owned by a single FUSE worker thread.  Only the owning thread
+// ever touches count or its chunks, so no lock is needed on the hot
+// path.  The buckets are chained together so that they can be merged
+// at destroy.
+typedef struct tb_ {
+    struct tb_      *next;          // next thread's bucket
+    uint32_t        count;          // number of slots in use
+    chunk_t         *head;          // first and last chunks in use
+    chunk_t         *tail;
+} threadBucket_t;
 
+extern threadBucket_t *threadBuckets;   // list head, pushed by CAS
+"""
+        if inst_mode == 'mmap' or rec_version >= 2:
+            content += """
+// The data file begins with this header, padded to HDR_SIZE bytes so
+// that records start on a page boundary.  In mmap mode the count is
+// incremented as each slot is claimed, so the file can be read while it
+// is written.  The version is that of the records which follow.
+#define BUCKET_MAGIC    "FGBUCKET"
+#define HDR_SIZE        (4096)
+#define HDR_CLOSED      (0x01)      // the file was closed cleanly
+#define BUILD_FLAGS_LEN (128)
+#define MAX_OP_NAMES    (64)
+#define OP_NAME_LEN     (16)
+
+typedef struct h_ {
+    char            magic[8];       // BUCKET_MAGIC, not null-terminated
+    uint32_t        version;        // of the records
+    uint32_t        hdrSize;        // offset of the first record
+    uint32_t        recSize;        // sizeof(opData_t)
+    uint32_t        flags;
+    uint64_t        count;          // slots claimed
+    uint64_t        dropped;        // calls not recorded
+"""
+            if rec_version >= 2:
+                content += """\
+    // version 2: enough to interpret the records without this source
+    uint64_t        realSec;        // CLOCK_REALTIME at ...
+    uint32_t        realNsec;
+    uint32_t        opCount;        // number of opNames in use
+    uint64_t        monoSec;        // ... this CLOCK_MONOTONIC time
+    uint32_t        monoNsec;
+    uint32_t        reserved;
+    char            buildFlags[BUILD_FLAGS_LEN];
+    char            opNames[MAX_OP_NAMES][OP_NAME_LEN];
+    uint32_t        sampleEvery;    // fgSampleEvery, if sampling
+    uint32_t        samplePerSec;   // fgSamplePerSec, if sampling
+    uint64_t        opCalls[MAX_OP_NAMES];  // if sampling, all calls made
+"""
+            content += """\
+} bucketHdr_t;
+"""
+        if inst_mode == 'mmap':
+            content += """
+// Records are mapped an extent at a time.  Extents are never remapped,
+// so a slot pointer stays valid until the file is closed.
+#define EXTENT_SLOTS    (1024 * 1024)
+#define MAX_EXTENTS     (4096)
+
+extern long     maxExtents;         // derived from fgMaxSlotMB
+"""
+        if sampling:
+            content += """
+extern long     fgSampleEvery;      // record 1 in N calls of each opcode
+extern long     fgSamplePerSec;     // record at most K calls a second
+extern uint64_t opCalls[MAX_OP_NAMES];  // every call, recorded or not
+"""
+        if inst_mode in ['mutex', 'thread', 'mmap', ]:
+            content += """
+extern long     fgMaxSlotMB;        // cap on memory for slots; 0 = none
+"""
+        if inst_mode in ['mutex', 'thread', ]:
+            content += """\
+extern long     maxChunks;          // derived from fgMaxSlotMB
+extern long     opsDropped;         // calls not recorded because of cap
+"""
+        content += """
 opData_t *{0:s}ClockMeIn(struct timespec *tEntry, unsigned opCode);
-void {0:s}ClockMeOut(struct timespec *tEntry, opData_t *mySlot, size_t count);
+void {0:s}ClockMeOut(struct timespec *tEntry, opData_t *mySlot, size_t count,
+                                            uint64_t offset, uint64_t fh);
 int {0:s}WriteBucket();
+int {0:s}StartBucketWriter();
+int {0:s}MapBucketFile();
 
 // END INSTRUMENTATION ----------------------------------------------
 """.format(prefix)          # pkg_name, prefix, uc_name)     # FOO
@@ -1109,9 +2858,65 @@ long fgBlockSize = 4L;
 long fgJobCount  = 4L;
 long fgMBPerJob  = 512L;
 int  fgVerbose   = 0;
-
+""".format(pkg_name)
+    if instrumenting and inst_mode in ['mutex', 'thread', 'mmap', ]:
+        content += """\
+long fgMaxSlotMB = 0L;         // no limit
+"""
+    if instrumenting and sampling:
+        content += """\
+long fgSampleEvery  = 1L;      // record every call
+long fgSamplePerSec = 0L;      // no limit
+"""
+    if attr_cache:
+        content += """\
+long fgAttrTTL = 1000L;        // ms an attribute cache entry is good for
+"""
+    if io_uring:
+        content += """\
+long fgRingDepth = 8L;         // entries in each thread's io_uring
+"""
+    content += """
+// what init asks of the kernel; 0 leaves it to FUSE
+"""
+    for name, fg_name, _ in CONN_CAPS:
+        if fuse_api == 3 and name == 'big_writes':
+            continue
+        content += 'int  %-21s = %d;\n' % (
+            fg_name, fg_name in [cap[1] for cap in conn_caps])
+    for name, fg_name, value in conn_limits:
+        content += 'long %-21s = %dL;\n' % (fg_name, value)
+    content += """
+// kernel cache timeouts in seconds; negative leaves them to FUSE
+"""
+    for name, fg_name, value in cache_timeouts:
+        content += 'double %-17s = %s;\n' % (
+            fg_name, repr(float(-1 if value is None else value)))
+    if keep_cache:
+        content += """\
+int    fgKeepCache       = 1;  // may open keep the kernel's page cache
+"""
+    if passthrough:
+        content += """\
+int    fgPassthrough     = 1;  // may the kernel read and write files itself
+"""
+    content += """
 long slotsPerBucket;
+"""
+    if lowlevel:
+        content += """
+struct {0:s}Data *{1:s}PrivateData;
+
+///////////////////////////////////////////////////////////
+//
+// Prototypes for all these functions come indirectly from
+// /usr/include/fuse3/fuse_lowlevel.h
 
+""".format(pkg_name, prefix)
+        for name in LL_OP_NAMES:
+            content += '#include "%s.inc"\n' % name
+    else:
+        content += """
 ///////////////////////////////////////////////////////////
 //
 // Prototypes for all these functions, and the C-style comments,
@@ -1129,11 +2934,14 @@ long slotsPerBucket;
 #include "chmod.inc"
 #include "chown.inc"
 #include "truncate.inc"
-
+"""
+        if fuse_api == 2:
+            content += """
 #ifndef HAVE_UTIMENSAT
 #include "utime.inc"
 #endif
-
+"""
+        content += """
 #include "open.inc"
 #include "read.inc"
 #include "write.inc"
@@ -1158,18 +2966,33 @@ long slotsPerBucket;
 #include "destroy.inc"
 #include "access.inc"
 #include "create.inc"
+"""
+        if fuse_api == 2:
+            content += """\
 #include "ftruncate.inc"
 #include "fgetattr.inc"
-
+"""
+        content += """
 #ifdef HAVE_UTIMENSAT
 #include "utimens.inc"
 #endif
+"""
+        if fuse_api == 2:
+            content += """\
 #include "lock.inc"
+"""
+        content += """\
 #include "fallocate.inc"
-
+"""
+        if buf_ops:
+            content += """\
+#include "write_buf.inc"
+#include "read_buf.inc"
+"""
+    content += """
 #include "optable.inc"
 #include "main.inc"
-""".format(pkg_name)
+"""
 
     pkg_c_file = os.path.join(path_to_src, "%s.c" % pkg_name)
     with open(pkg_c_file, 'w') as file:
@@ -1182,14 +3005,14 @@ long slotsPerBucket;
 #include "fuse_version.h"   // make me first
 #include <stdarg.h>
 #include <sys/stat.h>
-#include "{0:s}.h"          // this header file should be last
+#include "{1:s}.h"          // this header file should be last
 
 // Return -errno to caller, conditionally after logging -------------
 
 int {0:s}Error(char *msg)
 {{
     int errCode = -errno;
-""".format(prefix)      # pkg_name, prefix, uc_name)
+""".format(prefix, pkg_name)      # pkg_name, prefix, uc_name)
 
     if logging:
         content += """\
@@ -1206,65 +3029,1287 @@ void {0:s}FullPath(char fpath[PATH_MAX], const char *path)
 {{
     strcpy(fpath, {1:s}_DATA->rootdir);
     strncat(fpath, path, PATH_MAX);
+}}
 """.format(prefix, uc_name)              # pkg_name, prefix, uc_name)
 
     if logging:
         content += """\
+
+// Log the result of FullPath; called from the ops which are logged.
+void {0:s}LogFullPath(char fpath[PATH_MAX], const char *path)
+{{
+""".format(prefix)                      # pkg_name, prefix, uc_name)
+        if binary_log:
+            content += """\
+    static uint64_t fmtId;
+    uint64_t args[] = {{ 0, {0:s}Intern({1:s}_DATA->rootdir),
+                         {0:s}Intern(path), {0:s}Intern(fpath) }};
+    {0:s}LogFormat(LOG_NO_OP, &fmtId,
+        "  FullPath:  rootdir = \\"%s\\", path = \\"%s\\",\\
+        fpath = \\"%s\\"\\n", 3, args);
+""".format(prefix, uc_name)              # pkg_name, prefix, uc_name)
+        else:
+            content += """\
     {0:s}LogMsg("  FullPath:  rootdir = \\"%s\\", path = \\"%s\\",\\
         fpath = \\"%s\\"\\n",
            {1:s}_DATA->rootdir, path, fpath);
 """.format(prefix, uc_name)              # pkg_name, prefix, uc_name)
-
-    content += """\
+        content += """\
 }
 """
 
-    if logging:
-        content2 = """\
-// == LOGGING =======================================================
+    if attr_cache:
+        content += """\
 
-FILE *{1:s}OpenLog()
+// ATTRIBUTE CACHE --------------------------------------------------
+// The results of getattr and fgetattr are kept for fgAttrTTL ms in a
+// table indexed by the SipHash of the path, under a key chosen at
+// startup; the whole hash is kept to tell paths apart.  Ops which change
+// a file's attributes forget its entry, and rename forgets them all,
+// because it moves everything below a directory as well.  A miss hands
+// out a ticket, and what the syscall returns is stored only if nothing
+// has been forgotten in the meantime.
+
+#define ATTR_CACHE_LEN  (4096)          // a power of two
+
+typedef struct {{
+    volatile int    lock;
+    uint64_t        forgets;            // times an entry was forgotten
+    uint64_t        gen;                // attrGen when stored
+    uint64_t        hash;               // of the path
+    uint64_t        expires;            // monotonic ns; 0 if empty
+    struct stat     si;
+}} attrSlot_t;
+
+static attrSlot_t   attrCache[ATTR_CACHE_LEN];
+static char         attrKey[16];        // for SipHash
+static uint64_t     attrTTL;            // ns
+static uint64_t     attrGen;            // bumped by AttrForgetAll
+static uint64_t     attrHits;
+static uint64_t     attrMisses;
+
+static uint64_t {0:s}AttrNow(void)
 {{
-    FILE *logfile;
-
-    // Linux appends are guaranteed to be atomic
-    logfile = fopen("{0:s}.log", "a");
-    if (logfile == NULL) {{
-        perror("logfile");
-        exit(EXIT_FAILURE);
-    }}
-    setvbuf(logfile, NULL, _IOLBF, 0);
-    return logfile;
+    struct timespec t;
+#ifdef CLOCK_MONOTONIC_COARSE
+    clock_gettime(CLOCK_MONOTONIC_COARSE, &t);
+#else
+    clock_gettime(CLOCK_MONOTONIC, &t);
+#endif
+    return t.tv_sec * 1000000000UL + t.tv_nsec;
 }}
 
-int  {1:s}FlushLog  (void)
+// Hash the path and return its slot, locked.
+static attrSlot_t *{0:s}AttrLock(const char *path, uint64_t *hash)
 {{
-    return fflush({2:s}_DATA->logfile);
+    *hash = siphash24(path, strlen(path), attrKey);
+    attrSlot_t *slot = &attrCache[*hash & (ATTR_CACHE_LEN - 1)];
+    while (__sync_lock_test_and_set(&slot->lock, 1))
+        ;
+    return slot;
 }}
 
-void {1:s}LogEntry(const char *format, ...)
+void {0:s}AttrInit(void)
 {{
-    va_list ap;
-    va_start(ap, format);
+    int fd = open("/dev/urandom", O_RDONLY);
+    if ((fd < 0) || (read(fd, attrKey, sizeof(attrKey)) != sizeof(attrKey))) {{
+        uint64_t seed = {0:s}AttrNow() ^ getpid();
+        memcpy(attrKey, &seed, sizeof(seed));
+    }}
+    if (fd >= 0)
+        close(fd);
+    attrTTL = fgAttrTTL * 1000000UL;
+}}
 
-    vfprintf({2:s}_DATA->logfile, format, ap);
+// Copy out the attributes of the path and return 0 if they are cached
+// and current.  Otherwise return -1, filling in the ticket for AttrPut.
+int {0:s}AttrGet(const char *path, struct stat *si, attrTicket_t *ticket)
+{{
+    uint64_t    hash;
+    uint64_t    now  = {0:s}AttrNow();
+    uint64_t    gen  = __atomic_load_n(&attrGen, __ATOMIC_ACQUIRE);
+    attrSlot_t  *slot = {0:s}AttrLock(path, &hash);
+    int         status = -1;
+
+    if ((slot->hash == hash) && (slot->gen == gen) && (slot->expires > now)) {{
+        *si = slot->si;
+        status = 0;
+    }} else {{
+        ticket->gen     = gen;
+        ticket->forgets = slot->forgets;
+    }}
+    __sync_lock_release(&slot->lock);
+    __sync_fetch_and_add(status == 0 ? &attrHits : &attrMisses, 1);
+    return status;
 }}
-void {1:s}LogMsg(const char *format, ...)
+
+// Cache the attributes of the path unless an entry has been forgotten
+// since the ticket was handed out.
+void {0:s}AttrPut(const char *path, struct stat *si, attrTicket_t *ticket)
 {{
-    va_list ap;
-    va_start(ap, format);
+    uint64_t    hash;
+    uint64_t    expires = {0:s}AttrNow() + attrTTL;
+    attrSlot_t  *slot = {0:s}AttrLock(path, &hash);
+
+    if ((slot->forgets == ticket->forgets) &&
+            (__atomic_load_n(&attrGen, __ATOMIC_ACQUIRE) == ticket->gen)) {{
+        slot->gen     = ticket->gen;
+        slot->hash    = hash;
+        slot->expires = expires;
+        slot->si      = *si;
+    }}
+    __sync_lock_release(&slot->lock);
+}}
 
-    vfprintf({2:s}_DATA->logfile, format, ap);
+void {0:s}AttrForget(const char *path)
+{{
+    if (path == NULL)
+        return;
+    uint64_t    hash;
+    attrSlot_t  *slot = {0:s}AttrLock(path, &hash);
+    slot->forgets++;
+    if (slot->hash == hash)
+        slot->expires = 0;
+    __sync_lock_release(&slot->lock);
 }}
 
-static char *msgHeader(char *p, int *maxChar, char *name)
+void {0:s}AttrForgetAll(void)
 {{
-    int n =  snprintf(p, *maxChar, "  %s:\\n", name);
-    *maxChar -= n;
-    return p + n;
+    __atomic_add_fetch(&attrGen, 1, __ATOMIC_RELEASE);
 }}
 
-#define MAX_BUFFER (1024 - 1)
+void {0:s}AttrReport(void)
+{{
+""".format(prefix)
+        if logging:
+            content += """\
+    {0:s}LogMsg("attribute cache: %lu hits, %lu misses\\n",
+""".format(prefix)
+        else:
+            content += """\
+    fprintf(stderr, "attribute cache: %lu hits, %lu misses\\n",
+"""
+        content += """\
+           attrHits, attrMisses);
+}
+"""
+
+    if keep_cache:
+        content += """\
+
+// KEEP CACHE -------------------------------------------------------
+// The size and mtime of each file opened are kept in a table indexed by
+// the low bits of its inode number.  If they are unchanged at the next
+// open the kernel may keep the pages it has cached; otherwise it drops
+// them.  A file evicted from the table by another simply loses its pages.
+
+#define KEEP_CACHE_LEN  (4096)          // a power of two
+
+typedef struct {{
+    volatile int    lock;
+    dev_t           dev;
+    ino_t           ino;
+    off_t           size;
+    struct timespec mtime;
+}} keepSlot_t;
+
+static keepSlot_t   keepCache[KEEP_CACHE_LEN];
+static uint64_t     keepOpens;
+static uint64_t     keepKept;
+
+// Return 1 if the file open on fd has not changed since it was last
+// opened, and remember it as it is now.
+int {0:s}KeepCache(int fd)
+{{
+    struct stat si;
+    int         kept = 0;
+
+    if (fstat(fd, &si) < 0)
+        return 0;
+    keepSlot_t *slot = &keepCache[si.st_ino & (KEEP_CACHE_LEN - 1)];
+    while (__sync_lock_test_and_set(&slot->lock, 1))
+        ;
+    if ((slot->ino == si.st_ino) && (slot->dev == si.st_dev) &&
+            (slot->size == si.st_size) &&
+            (slot->mtime.tv_sec  == si.st_mtim.tv_sec) &&
+            (slot->mtime.tv_nsec == si.st_mtim.tv_nsec)) {{
+        kept = 1;
+    }} else {{
+        slot->dev   = si.st_dev;
+        slot->ino   = si.st_ino;
+        slot->size  = si.st_size;
+        slot->mtime = si.st_mtim;
+    }}
+    __sync_lock_release(&slot->lock);
+    __sync_fetch_and_add(&keepOpens, 1);
+    if (kept)
+        __sync_fetch_and_add(&keepKept, 1);
+    return kept;
+}}
+
+void {0:s}KeepCacheReport(void)
+{{
+""".format(prefix)
+        if logging:
+            content += """\
+    {0:s}LogMsg("keep_cache: kept on %lu of %lu opens\\n",
+""".format(prefix)
+        else:
+            content += """\
+    fprintf(stderr, "keep_cache: kept on %lu of %lu opens\\n",
+"""
+        content += """\
+           keepKept, keepOpens);
+}
+"""
+
+    if io_uring:
+        if logging:
+            ring_msg = '{0:s}LogMsg('.format(prefix)
+        else:
+            ring_msg = 'fprintf(stderr, '
+        content += """\
+
+// IO_URING ---------------------------------------------------------
+// read, write and fsync are made through an io_uring belonging to the
+// FUSE worker thread, set up with fgRingDepth entries when the thread
+// first needs it and torn down when the thread exits.  A worker carries
+// one request at a time, so each is submitted and waited for with a
+// single io_uring_enter().  Files are registered with the ring at the
+// index of their fd, sparing the kernel an fd lookup per call.  As an fd
+// is reused once released, each has a generation, counted up as it is
+// released, and a ring holding an older one registers the fd again.
+// Without liburing, with fgRingDepth 0, or if io_uring cannot be set up,
+// the plain syscalls are made instead.
+
+#ifdef HAVE_LIBURING
+#include <liburing.h>
+
+#define RING_FILES  (1024)      // fds registered; others are passed as is
+
+typedef struct {{
+    struct io_uring ring;
+    int             fixed;              // files may be registered
+    uint32_t        gen[RING_FILES];    // each fd's as registered, + 1
+}} ring_t;
+
+static uint32_t         fdGen[RING_FILES];
+static pthread_key_t    ringKey;
+static pthread_once_t   ringOnce = PTHREAD_ONCE_INIT;
+static int              ringKeyMade;
+static int              ringBroken;     // io_uring cannot be set up
+
+static void ringFree(void *arg)
+{{
+    ring_t *r = arg;
+
+    io_uring_queue_exit(&r->ring);      // unregistering its files
+    free(r);
+}}
+
+static void ringKeyInit(void)
+{{
+    ringKeyMade = pthread_key_create(&ringKey, ringFree) == 0;
+}}
+
+// Return the calling thread's ring, or NULL if it is to use syscalls.
+static ring_t *ringGet(void)
+{{
+    ring_t  *r;
+    int     status;
+
+    if ((fgRingDepth <= 0) || ringBroken)
+        return NULL;
+    pthread_once(&ringOnce, ringKeyInit);
+    if (!ringKeyMade)
+        return NULL;
+    r = pthread_getspecific(ringKey);
+    if (r == NULL) {{
+        if ((r = calloc(1, sizeof(ring_t))) == NULL)
+            return NULL;
+        status = io_uring_queue_init(fgRingDepth, &r->ring, 0);
+        if (status < 0) {{
+            // io_uring may be disabled, or denied to the process
+            free(r);
+            if (__sync_bool_compare_and_swap(&ringBroken, 0, 1))
+                {1:s}"io_uring: %s; using syscalls\\n",
+                                                    strerror(-status));
+            return NULL;
+        }}
+        // from Linux 5.19; before that fds are passed as they are
+        r->fixed = io_uring_register_files_sparse(&r->ring, RING_FILES) == 0;
+        pthread_setspecific(ringKey, r);
+    }}
+    return r;
+}}
+
+// Return an sqe of r for fd, with IOSQE_FIXED_FILE set in *flags if fd
+// is registered.
+static struct io_uring_sqe *ringSqe(ring_t *r, int fd, unsigned *flags)
+{{
+    uint32_t gen;
+
+    *flags = 0;
+    if (r->fixed && (fd >= 0) && (fd < RING_FILES)) {{
+        gen = __atomic_load_n(&fdGen[fd], __ATOMIC_ACQUIRE) + 1;
+        if ((r->gen[fd] == gen) ||
+                (io_uring_register_files_update(&r->ring, fd, &fd, 1) == 1)) {{
+            r->gen[fd] = gen;
+            *flags     = IOSQE_FIXED_FILE;  // fd is the index
+        }}
+    }}
+    return io_uring_get_sqe(&r->ring);  // never NULL: one is in flight
+}}
+
+// Submit what was prepared in r and wait for it.  Return its result,
+// or -1 setting errno, as the syscall would.
+static ssize_t ringWait(ring_t *r)
+{{
+    struct io_uring_cqe *cqe;
+    ssize_t             status;
+
+    do
+        status = io_uring_submit_and_wait(&r->ring, 1);
+    while (status == -EINTR);
+    if (status >= 0)
+        do
+            status = io_uring_wait_cqe(&r->ring, &cqe);
+        while (status == -EINTR);
+    if (status >= 0) {{
+        status = cqe->res;
+        io_uring_cqe_seen(&r->ring, cqe);
+    }}
+    if (status < 0) {{
+        errno  = -status;
+        status = -1;
+    }}
+    return status;
+}}
+
+ssize_t {0:s}RingRead(int fd, void *buf, size_t size, off_t offset)
+{{
+    ring_t              *r = ringGet();
+    struct io_uring_sqe *sqe;
+    unsigned            flags;
+
+    if (r == NULL)
+        return pread(fd, buf, size, offset);
+    sqe = ringSqe(r, fd, &flags);
+    io_uring_prep_read(sqe, fd, buf, size, offset);
+    io_uring_sqe_set_flags(sqe, flags);
+    return ringWait(r);
+}}
+
+ssize_t {0:s}RingWrite(int fd, const void *buf, size_t size, off_t offset)
+{{
+    ring_t              *r = ringGet();
+    struct io_uring_sqe *sqe;
+    unsigned            flags;
+
+    if (r == NULL)
+        return pwrite(fd, buf, size, offset);
+    sqe = ringSqe(r, fd, &flags);
+    io_uring_prep_write(sqe, fd, buf, size, offset);
+    io_uring_sqe_set_flags(sqe, flags);
+    return ringWait(r);
+}}
+
+int {0:s}RingFsync(int fd, int datasync)
+{{
+    ring_t              *r = ringGet();
+    struct io_uring_sqe *sqe;
+    unsigned            flags;
+
+    if (r == NULL)
+        return datasync ? fdatasync(fd) : fsync(fd);
+    sqe = ringSqe(r, fd, &flags);
+    io_uring_prep_fsync(sqe, fd, datasync ? IORING_FSYNC_DATASYNC : 0);
+    io_uring_sqe_set_flags(sqe, flags);
+    return ringWait(r);
+}}
+
+// fd is about to be closed.  This thread's ring lets go of the file at
+// once; the others hold it until they next use fd, or exit.
+void {0:s}RingForget(int fd)
+{{
+    ring_t  *r;
+    int     none = -1;
+
+    if ((fd < 0) || (fd >= RING_FILES))
+        return;
+    __atomic_add_fetch(&fdGen[fd], 1, __ATOMIC_RELEASE);
+    pthread_once(&ringOnce, ringKeyInit);
+    if (ringKeyMade && ((r = pthread_getspecific(ringKey)) != NULL) &&
+            r->fixed && (r->gen[fd] != 0)) {{
+        io_uring_register_files_update(&r->ring, fd, &none, 1);
+        r->gen[fd] = 0;
+    }}
+}}
+
+#else   // no liburing
+
+ssize_t {0:s}RingRead(int fd, void *buf, size_t size, off_t offset)
+{{
+    return pread(fd, buf, size, offset);
+}}
+
+ssize_t {0:s}RingWrite(int fd, const void *buf, size_t size, off_t offset)
+{{
+    return pwrite(fd, buf, size, offset);
+}}
+
+int {0:s}RingFsync(int fd, int datasync)
+{{
+#ifdef HAVE_FDATASYNC
+    if (datasync)
+        return fdatasync(fd);
+#endif
+    return fsync(fd);
+}}
+
+void {0:s}RingForget(int fd)
+{{
+}}
+#endif
+""".format(prefix, ring_msg)
+
+    if lowlevel:
+        content += """\
+
+// INODE TABLE ------------------------------------------------------
+// The low-level API knows files by the inode numbers the file system
+// gives them.  Each here is the address of an llInode_t holding an
+// O_PATH fd for the file, so that ops need neither paths nor searches.
+// The llInode_t are also kept in a table hashed on device and inode
+// number, so that a file has only one however it is reached.  The kernel
+// forgets its lookups of a file when it drops the inode; once it has
+// forgotten them all the llInode_t is closed and freed.  The root is
+// never freed.
+
+#define INODE_BUCKETS   (4096)          // a power of two
+
+typedef struct llInode_ {{
+    struct llInode_ *next;              // in the hash chain
+    int             fd;                 // O_PATH
+    dev_t           dev;
+    ino_t           ino;
+    uint64_t        nlookup;            // lookups not yet forgotten
+{1:s}}} llInode_t;
+
+static llInode_t        rootInode;
+static llInode_t        *inodes[INODE_BUCKETS];
+static pthread_mutex_t  inodeLock = PTHREAD_MUTEX_INITIALIZER;
+static uint64_t         inodeCount;     // in the table
+static uint64_t         inodeMax;       // most ever in the table
+
+static inline llInode_t *{0:s}Inode(fuse_ino_t ino)
+{{
+    return ino == FUSE_ROOT_ID ? &rootInode : (llInode_t *) (uintptr_t) ino;
+}}
+
+static inline unsigned {0:s}InodeHash(dev_t dev, ino_t ino)
+{{
+    return (ino ^ dev) & (INODE_BUCKETS - 1);
+}}
+
+// Open the root directory.  Return 0 or -1, setting errno.
+int {0:s}InodeInit(const char *rootdir)
+{{
+    struct stat si;
+
+    rootInode.fd = open(rootdir, O_PATH | O_DIRECTORY);
+    if ((rootInode.fd < 0) || (fstat(rootInode.fd, &si) < 0))
+        return -1;
+    rootInode.dev     = si.st_dev;
+    rootInode.ino     = si.st_ino;
+    rootInode.nlookup = 1;
+    inodes[{0:s}InodeHash(si.st_dev, si.st_ino)] = &rootInode;
+    return 0;
+}}
+
+int {0:s}InodeFd(fuse_ino_t ino)
+{{
+    return {0:s}Inode(ino)->fd;
+}}
+
+// Look up name in the directory parent, filling in e, and count the
+// lookup.  Return 0 or -errno.
+int {0:s}DoLookup(fuse_ino_t parent, const char *name,
+                                        struct fuse_entry_param *e)
+{{
+    llInode_t   *inode;
+    unsigned    h;
+    int         fd;
+    int         status;
+
+    memset(e, 0, sizeof(*e));
+    e->attr_timeout  = fgAttrTimeout;
+    e->entry_timeout = fgEntryTimeout;
+
+    fd = openat({0:s}InodeFd(parent), name, O_PATH | O_NOFOLLOW);
+    if (fd < 0)
+        return {0:s}Error("{0:s}lookup openat");
+    if (fstatat(fd, "", &e->attr, AT_EMPTY_PATH | AT_SYMLINK_NOFOLLOW) < 0) {{
+        status = {0:s}Error("{0:s}lookup fstatat");
+        close(fd);
+        return status;
+    }}
+
+    h = {0:s}InodeHash(e->attr.st_dev, e->attr.st_ino);
+    pthread_mutex_lock(&inodeLock);
+    for (inode = inodes[h]; inode != NULL; inode = inode->next)
+        if ((inode->ino == e->attr.st_ino) && (inode->dev == e->attr.st_dev))
+            break;
+    if (inode != NULL) {{
+        inode->nlookup++;
+    }} else if ((inode = calloc(1, sizeof(llInode_t))) != NULL) {{
+        inode->fd      = fd;
+        inode->dev     = e->attr.st_dev;
+        inode->ino     = e->attr.st_ino;
+        inode->nlookup = 1;
+        inode->next    = inodes[h];
+        inodes[h]      = inode;
+        fd             = -1;
+        if (++inodeCount > inodeMax)
+            inodeMax = inodeCount;
+    }}
+    pthread_mutex_unlock(&inodeLock);
+    if (fd >= 0)
+        close(fd);          // the file was known already, or calloc failed
+    if (inode == NULL) {{
+        errno = ENOMEM;
+        return {0:s}Error("{0:s}lookup calloc");
+    }}
+    e->ino = (inode == &rootInode) ? FUSE_ROOT_ID : (uintptr_t) inode;
+    return 0;
+}}
+
+// The kernel has dropped nlookup of its lookups of ino.
+void {0:s}Forget(fuse_ino_t ino, uint64_t nlookup)
+{{
+    llInode_t   *inode = {0:s}Inode(ino);
+    llInode_t   **prev;
+
+    if (inode == &rootInode)
+        return;
+    pthread_mutex_lock(&inodeLock);
+    assert(inode->nlookup >= nlookup);
+    inode->nlookup -= nlookup;
+    if (inode->nlookup == 0) {{
+        prev = &inodes[{0:s}InodeHash(inode->dev, inode->ino)];
+        while (*prev != inode)
+            prev = &(*prev)->next;
+        *prev = inode->next;
+        inodeCount--;
+    }} else
+        inode = NULL;
+    pthread_mutex_unlock(&inodeLock);
+    if (inode != NULL) {{
+        close(inode->fd);
+        free(inode);
+    }}
+}}
+
+// Fill buf with as many of the entries of the directory ino, open as d,
+// as fit, starting at offset.  With plus each is looked up as well.
+// Return the number of bytes used or -errno.
+int {0:s}FillDir(fuse_req_t req, fuse_ino_t ino, char *buf, size_t size,
+                                        off_t offset, llDir_t *d, int plus)
+{{
+    size_t  used = 0;
+    int     status = 0;
+
+    // the kernel may start over, or come back for an entry with no room
+    if (offset != d->offset) {{
+        seekdir(d->dp, offset);
+        d->entry  = NULL;
+        d->offset = offset;
+    }}
+    while (1) {{
+        struct fuse_entry_param e;
+        const char  *name;
+        off_t       nextOffset;
+        size_t      entSize;
+
+        if (d->entry == NULL) {{
+            errno = 0;
+            d->entry = readdir(d->dp);
+            if (d->entry == NULL) {{
+                if (errno != 0)
+                    status = {0:s}Error("{0:s}readdir readdir");
+                break;
+            }}
+        }}
+        name       = d->entry->d_name;
+        nextOffset = d->entry->d_off;
+        memset(&e, 0, sizeof(e));
+        e.attr.st_ino  = d->entry->d_ino;
+        e.attr.st_mode = d->entry->d_type << 12;
+        if (plus) {{
+            // . and .. are not looked up; an ino of 0 tells the kernel so
+            if ((strcmp(name, ".") != 0) && (strcmp(name, "..") != 0)) {{
+                status = {0:s}DoLookup(ino, name, &e);
+                if (status < 0)
+                    break;
+            }}
+            entSize = fuse_add_direntry_plus(req, buf + used, size - used,
+                                             name, &e, nextOffset);
+        }} else
+            entSize = fuse_add_direntry(req, buf + used, size - used,
+                                        name, &e.attr, nextOffset);
+        if (entSize > size - used) {{
+            // no room: the entry is kept for the next call
+            if (e.ino != 0)
+                {0:s}Forget(e.ino, 1);
+            break;
+        }}
+        used     += entSize;
+        d->entry  = NULL;
+        d->offset = nextOffset;
+    }}
+    // an error after some entries is met again by the next call
+    if ((status < 0) && (used == 0))
+        return status;
+    return used;
+}}
+
+void {0:s}InodeReport(void)
+{{
+""".format(prefix, """\
+    int             backingId;          // passed through if not 0
+    uint64_t        nbacking;           // opens sharing it
+""" if passthrough else '')
+        if logging:
+            content += """\
+    {0:s}LogMsg("inode table: %lu inodes, at most %lu\\n",
+""".format(prefix)
+        else:
+            content += """\
+    fprintf(stderr, "inode table: %lu inodes, at most %lu\\n",
+"""
+        content += """\
+           inodeCount, inodeMax);
+}
+"""
+
+    if passthrough:
+        if logging:
+            pt_report = '{0:s}LogMsg('.format(prefix)
+        else:
+            pt_report = 'fprintf(stderr, '
+        content += """\
+
+// PASSTHROUGH ------------------------------------------------------
+// From Linux 6.9 an open file may be backed by a file opened here, which
+// the kernel then reads and writes itself, so that those requests never
+// reach the file system.  The kernel allows a file only one backing file
+// at a time, so the opens of a file share one, registered when it is
+// first opened and given up when the last of them is released.  Failing
+// to register one, usually for want of CAP_SYS_ADMIN, turns passthrough
+// off: what the kernel does not pass through comes here as before.
+
+static uint64_t ptOpens;
+static uint64_t ptPassed;
+
+// Pass the file ino, just opened as fi, through to a backing file if
+// possible.  Return 1 if it was, setting fi->backing_id, or 0.
+int {0:s}PassthroughOpen(fuse_req_t req, fuse_ino_t ino,
+                                        struct fuse_file_info *fi)
+{{
+    llInode_t   *inode = {0:s}Inode(ino);
+    char        procname[64];
+    struct stat si;
+    int         fd;
+
+    pthread_mutex_lock(&inodeLock);
+    if ((inode->backingId == 0) && fgPassthrough &&
+            (fstat(fi->fh, &si) == 0) && S_ISREG(si.st_mode)) {{
+        // later opens may write even if this one does not
+        {0:s}ProcPath(procname, inode->fd);
+        fd = open(procname, O_RDWR);
+        inode->backingId = fuse_passthrough_open(req,
+                                            fd < 0 ? (int) fi->fh : fd);
+        if (inode->backingId <= 0) {{
+            inode->backingId = 0;
+            fgPassthrough    = 0;
+            {1:s}"passthrough: %s; turned off\\n",
+                                                    strerror(errno));
+        }}
+        if (fd >= 0)
+            close(fd);              // the kernel holds its own reference
+    }}
+    if (inode->backingId != 0) {{
+        inode->nbacking++;
+        fi->backing_id = inode->backingId;
+        fi->keep_cache = 0;         // pages are cached for the backing file
+        ptPassed++;
+    }}
+    ptOpens++;
+    pthread_mutex_unlock(&inodeLock);
+    return fi->backing_id != 0;
+}}
+
+// An open of ino is released.  While the file has a backing file all of
+// its opens are passed through, so the last of them gives it up.
+void {0:s}PassthroughRelease(fuse_req_t req, fuse_ino_t ino)
+{{
+    llInode_t   *inode = {0:s}Inode(ino);
+
+    pthread_mutex_lock(&inodeLock);
+    if ((inode->nbacking > 0) && (--inode->nbacking == 0)) {{
+        fuse_passthrough_close(req, inode->backingId);
+        inode->backingId = 0;
+    }}
+    pthread_mutex_unlock(&inodeLock);
+}}
+
+void {0:s}PassthroughReport(void)
+{{
+    {1:s}"passthrough: passed through %lu of %lu opens\\n",
+           ptPassed, ptOpens);
+}}
+""".format(prefix, pt_report)
+
+    if logging:
+        # the log's name and buffering depend on its format and on
+        # whether it is written in the background
+        if async_log:
+            log_buffering = '_IOFBF, LOG_BUF_SIZE'
+        elif binary_log:
+            log_buffering = '_IOFBF, 0'
+        else:
+            log_buffering = '_IOLBF, 0'
+        open_log = """\
+FILE *{1:s}OpenLog()
+{{
+    FILE *logfile;
+
+    // Linux appends are guaranteed to be atomic
+    logfile = fopen("{0:s}", "a");
+    if (logfile == NULL) {{
+        perror("logfile");
+        exit(EXIT_FAILURE);
+    }}
+    setvbuf(logfile, NULL, {2:s});
+""".format(pkg_name + ('.blog' if binary_log else '.log'), prefix,
+           log_buffering)
+        if binary_log:
+            open_log += """\
+
+    // every run of the file system begins with a LOG_START entry
+    logRec_t        rec;
+    logStart_t      *start = (logStart_t*)rec.bytes;
+    struct timespec t;
+    memset(&rec, 0, sizeof(rec));
+    rec.type   = LOG_START;
+    rec.opCode = LOG_NO_OP;
+    rec.len    = sizeof(logStart_t);
+    memcpy(start->magic, "FGBINLOG", sizeof(start->magic));
+    start->version  = LOG_VERSION;
+    start->recSize  = sizeof(logRec_t);
+    clock_gettime(CLOCK_REALTIME, &t);
+    start->realSec  = t.tv_sec;
+    start->realNsec = t.tv_nsec;
+    start->pid      = getpid();
+    fwrite(&rec, sizeof(rec), 1, logfile);
+"""
+        open_log += """\
+    return logfile;
+}
+
+"""
+
+    if logging and not async_log:
+        content2 = """\
+// == LOGGING =======================================================
+
+{2:s}int  {0:s}FlushLog  (void)
+{{
+    return fflush({1:s}_DATA->logfile);
+}}
+
+""".format(prefix, uc_name, open_log)
+        if binary_log:
+            content2 += """\
+// A single fwrite() is not interleaved with those of other threads.
+static void {0:s}LogBytes(const void *bytes, size_t n)
+{{
+    fwrite(bytes, 1, n, {1:s}_DATA->logfile);
+}}
+
+""".format(prefix, uc_name)
+        else:
+            content2 += """\
+void {0:s}LogEntry(const char *format, ...)
+{{
+    va_list ap;
+    va_start(ap, format);
+
+    vfprintf({1:s}_DATA->logfile, format, ap);
+}}
+void {0:s}LogMsg(const char *format, ...)
+{{
+    va_list ap;
+    va_start(ap, format);
+
+    vfprintf({1:s}_DATA->logfile, format, ap);
+}}
+
+""".format(prefix, uc_name)
+    elif logging:
+        content2 = """\
+// == LOGGING =======================================================
+
+// Each thread formats log messages into a buffer of its own.  When a
+// buffer fills, or holds messages from an earlier second, it is queued
+// for a background writer which writes it in one block.  If the queue
+// is full the buffer's messages are dropped and counted instead, so no
+// FUSE request ever waits on the log file.  Until the writer starts in
+// init, and after it stops in destroy, messages are written directly.
+
+#define LOG_BUF_SIZE    (64 * 1024)
+#define LOG_QUEUE_LEN   (64)        // full buffers waiting to be written
+
+typedef struct lb_ {{
+    struct lb_      *next;          // on the free list
+    size_t          used;           // bytes of data
+    long            lines;          // messages in data
+    time_t          since;          // when the first was added
+    char            data[LOG_BUF_SIZE];
+}} logBuf_t;
+
+typedef struct lt_ {{
+    struct lt_      *next;          // every thread which has logged
+    logBuf_t        *buf;           // this thread's current buffer
+}} logThread_t;
+
+static FILE            *asyncLog;           // set when the writer starts
+static int             logRunning;
+static int             stopLogWriter;
+static long            logDropped;         // messages
+static pthread_t       logWriterThread;
+static pthread_mutex_t logLock = PTHREAD_MUTEX_INITIALIZER;
+static pthread_cond_t  logCond = PTHREAD_COND_INITIALIZER;  // to writer
+static logBuf_t        *logQueue[LOG_QUEUE_LEN];
+static int             logHead;             // next to be written
+static int             logQueued;           // number waiting
+static logBuf_t        *freeLogBufs;
+static logThread_t     *logThreads;
+
+// the calling thread's buffer, created on first use
+static __thread logThread_t *myLogThread;
+
+{1:s}// Called with logLock held.
+static logBuf_t *{0:s}NewLogBuf(void)
+{{
+    logBuf_t *b = freeLogBufs;
+    if (b != NULL) {{
+        freeLogBufs = b->next;
+    }} else {{
+        b = (logBuf_t*)malloc(sizeof(logBuf_t));
+        assert(b != NULL);
+    }}
+    b->used  = 0;
+    b->lines = 0;
+    return b;
+}}
+
+// Queue a thread's buffer for the writer and give the thread an empty
+// one, or if the queue is full drop its contents.  Called with logLock
+// held.
+static void {0:s}QueueLogBuf(logThread_t *lt)
+{{
+    logBuf_t *b = lt->buf;
+    if (b->used == 0)
+        return;
+    if (logQueued < LOG_QUEUE_LEN) {{
+        logQueue[(logHead + logQueued++) % LOG_QUEUE_LEN] = b;
+        lt->buf = {0:s}NewLogBuf();
+        pthread_cond_signal(&logCond);
+    }} else {{
+        logDropped += b->lines;
+        b->used  = 0;
+        b->lines = 0;
+    }}
+}}
+
+static logThread_t *{0:s}MyLogThread(void)
+{{
+    logThread_t *lt = myLogThread;
+    if (lt == NULL) {{
+        lt = (logThread_t*)calloc(1, sizeof(logThread_t));
+        assert(lt != NULL);
+        pthread_mutex_lock(&logLock);
+        lt->buf    = {0:s}NewLogBuf();
+        lt->next   = logThreads;
+        logThreads = lt;
+        pthread_mutex_unlock(&logLock);
+        myLogThread = lt;
+    }}
+    return lt;
+}}
+
+""".format(prefix, open_log)
+        if binary_log:
+            content2 += """\
+// Binary log entries are never split between buffers.
+static void {0:s}LogBytes(const void *bytes, size_t n)
+{{
+    if (!logRunning) {{
+        fwrite(bytes, 1, n, {1:s}_DATA->logfile);
+        return;
+    }}
+    logThread_t *lt  = {0:s}MyLogThread();
+    logBuf_t    *b   = lt->buf;
+    time_t      now  = time(NULL);
+    if (n > LOG_BUF_SIZE - b->used) {{
+        pthread_mutex_lock(&logLock);
+        {0:s}QueueLogBuf(lt);
+        pthread_mutex_unlock(&logLock);
+        b = lt->buf;
+    }}
+    if (b->used == 0)
+        b->since = now;
+    memcpy(b->data + b->used, bytes, n);
+    b->used += n;
+    b->lines++;
+    if ((b->used == LOG_BUF_SIZE) || (b->since != now)) {{
+        pthread_mutex_lock(&logLock);
+        {0:s}QueueLogBuf(lt);
+        pthread_mutex_unlock(&logLock);
+    }}
+}}
+
+""".format(prefix, uc_name)
+        else:
+            content2 += """\
+static void {0:s}LogV(const char *format, va_list ap)
+{{
+    if (!logRunning) {{
+        vfprintf({1:s}_DATA->logfile, format, ap);
+        return;
+    }}
+    logThread_t *lt  = {0:s}MyLogThread();
+    logBuf_t    *b   = lt->buf;
+    time_t      now  = time(NULL);
+    size_t      room = LOG_BUF_SIZE - b->used;
+    va_list aq;
+    va_copy(aq, ap);
+    int n = vsnprintf(b->data + b->used, room, format, ap);
+    if ((n >= 0) && ((size_t)n >= room) && (b->used > 0)) {{
+        // no room: queue what there is and start an empty buffer
+        pthread_mutex_lock(&logLock);
+        {0:s}QueueLogBuf(lt);
+        pthread_mutex_unlock(&logLock);
+        b = lt->buf;
+        n = vsnprintf(b->data, LOG_BUF_SIZE, format, aq);
+    }}
+    va_end(aq);
+    if (n < 0)
+        return;
+    if (n >= LOG_BUF_SIZE - b->used)
+        n = LOG_BUF_SIZE - 1 - b->used;       // truncated
+    if (b->used == 0)
+        b->since = now;
+    b->used += n;
+    b->lines++;
+    if ((b->used >= LOG_BUF_SIZE - 1) || (b->since != now)) {{
+        pthread_mutex_lock(&logLock);
+        {0:s}QueueLogBuf(lt);
+        pthread_mutex_unlock(&logLock);
+    }}
+}}
+
+""".format(prefix, uc_name)
+        content2 += """\
+// Queue the calling thread's messages; this never waits for the write.
+int  {0:s}FlushLog  (void)
+{{
+    if (!logRunning)
+        return fflush({1:s}_DATA->logfile);
+    logThread_t *lt = {0:s}MyLogThread();
+    pthread_mutex_lock(&logLock);
+    {0:s}QueueLogBuf(lt);
+    pthread_mutex_unlock(&logLock);
+    return 0;
+}}
+
+""".format(prefix, uc_name)
+        if not binary_log:
+            content2 += """\
+void {0:s}LogEntry(const char *format, ...)
+{{
+    va_list ap;
+    va_start(ap, format);
+    {0:s}LogV(format, ap);
+    va_end(ap);
+}}
+void {0:s}LogMsg(const char *format, ...)
+{{
+    va_list ap;
+    va_start(ap, format);
+    {0:s}LogV(format, ap);
+    va_end(ap);
+}}
+
+""".format(prefix)
+        content2 += """\
+// Runs in the background, never in a FUSE request thread, so it must
+// not use the FUSE context.
+static void *{0:s}LogWriter(void *arg)
+{{
+    pthread_mutex_lock(&logLock);
+    while (1) {{
+        if (logQueued > 0) {{
+            logBuf_t *b = logQueue[logHead];
+            logHead = (logHead + 1) % LOG_QUEUE_LEN;
+            int more = --logQueued;
+            pthread_mutex_unlock(&logLock);
+
+            fwrite(b->data, 1, b->used, asyncLog);
+            if (more == 0)
+                fflush(asyncLog);
+
+            pthread_mutex_lock(&logLock);
+            b->next     = freeLogBufs;
+            freeLogBufs = b;
+        }} else if (stopLogWriter) {{
+            break;
+        }} else {{
+            pthread_cond_wait(&logCond, &logLock);
+        }}
+    }}
+    pthread_mutex_unlock(&logLock);
+    return NULL;
+}}
+
+// Called from init, after which messages go through the writer.
+int {0:s}StartLogWriter(void)
+{{
+    fflush({1:s}_DATA->logfile);
+    asyncLog = {1:s}_DATA->logfile;
+    int status = pthread_create(&logWriterThread, NULL, {0:s}LogWriter, NULL);
+    if (status == 0)
+        logRunning = 1;
+    return -status;
+}}
+
+// Called from destroy: drain the queue, stop the writer, and then write
+// what remains in each thread's buffer.  No requests are being served.
+void {0:s}StopLogWriter(void)
+{{
+    if (!logRunning)
+        return;
+    pthread_mutex_lock(&logLock);
+    stopLogWriter = 1;
+    pthread_cond_signal(&logCond);
+    pthread_mutex_unlock(&logLock);
+    pthread_join(logWriterThread, NULL);
+    logRunning = 0;
+
+    logThread_t *lt;
+    for (lt = logThreads; lt != NULL; lt = lt->next)
+        fwrite(lt->buf->data, 1, lt->buf->used, asyncLog);
+    if (logDropped > 0)
+        {0:s}LogMsg("%ld log messages dropped\\n", logDropped);
+    fflush(asyncLog);
+}}
+
+""".format(prefix, uc_name)
+
+    if binary_log:
+        content2 += """\
+// == BINARY LOG ====================================================
+
+// Strings are logged once, as LOG_STR entries, and after that referred
+// to by id.  An id stands for one string only, but a string which drops
+// out of the cache is logged again under a new id.
+
+#define STR_CACHE_SIZE  (1024)
+#define LOG_MAX_ARGS    (32)
+#define LOG_TEXT_MAX    (1024 - 1)
+
+typedef struct {{
+    char            *str;
+    uint64_t        id;
+}} strSlot_t;
+
+static strSlot_t       strCache[STR_CACHE_SIZE];
+static pthread_mutex_t strLock = PTHREAD_MUTEX_INITIALIZER;
+static uint64_t        lastStrId;
+
+// Write an entry: a head record, then as many more as the payload needs.
+static void {0:s}LogPut(unsigned type, unsigned opCode, uint32_t len,
+                        const void *payload, size_t bytes)
+{{
+    size_t more = 0;
+    if (bytes > LOG_HEAD_BYTES)
+        more = (bytes - LOG_HEAD_BYTES + sizeof(logRec_t) - 1)
+                                                    / sizeof(logRec_t);
+    logRec_t recs[1 + more];
+    memset(recs, 0, sizeof(recs));
+    recs[0].type   = type;
+    recs[0].opCode = opCode;
+    recs[0].more   = more;
+    recs[0].len    = len;
+    memcpy((char*)recs + offsetof(logRec_t, bytes), payload, bytes);
+    {0:s}LogBytes(recs, sizeof(recs));
+}}
+
+// Log a string under a new id.
+static uint64_t {0:s}LogStr(const char *str)
+{{
+    char     payload[sizeof(uint64_t) + PATH_MAX];
+    size_t   len = strnlen(str, PATH_MAX);
+    uint64_t id  = __sync_add_and_fetch(&lastStrId, 1);
+    memcpy(payload, &id, sizeof(id));
+    memcpy(payload + sizeof(id), str, len);
+    {0:s}LogPut(LOG_STR, LOG_NO_OP, len, payload, sizeof(id) + len);
+    return id;
+}}
+
+// Return the id of a string, first logging it unless it has been
+// logged recently.  NULL has id 0.
+uint64_t {0:s}Intern(const char *str)
+{{
+    if (str == NULL)
+        return 0;
+    uint32_t   hash = 2166136261u;          // FNV-1a
+    const char *p;
+    for (p = str; *p != 0; p++)
+        hash = (hash ^ (uint8_t)*p) * 16777619u;
+    strSlot_t  *slot = &strCache[hash % STR_CACHE_SIZE];
+    uint64_t   id;
+
+    pthread_mutex_lock(&strLock);
+    if ((slot->str != NULL) && (strcmp(slot->str, str) == 0)) {{
+        id = slot->id;
+        pthread_mutex_unlock(&strLock);
+        return id;
+    }}
+    pthread_mutex_unlock(&strLock);
+
+    // log it without holding the lock
+    id = {0:s}LogStr(str);
+    char *copy = strdup(str);
+    pthread_mutex_lock(&strLock);
+    free(slot->str);
+    slot->str = copy;
+    slot->id  = id;
+    pthread_mutex_unlock(&strLock);
+    return id;
+}}
+
+// Log a constant format and its args; args[0] is set to the id of the
+// format.  *fmtId caches that id, logging the format on first use.
+void {0:s}LogFormat(unsigned opCode, uint64_t *fmtId, const char *fmt,
+                    int nargs, uint64_t *args)
+{{
+    uint64_t id = __atomic_load_n(fmtId, __ATOMIC_RELAXED);
+    if (id == 0) {{
+        id = {0:s}LogStr(fmt);
+        if (!__sync_bool_compare_and_swap(fmtId, 0, id))
+            id = *fmtId;
+    }}
+    args[0] = id;
+    {0:s}LogPut(LOG_FMT, opCode, nargs, args, (1 + nargs) * sizeof(uint64_t));
+}}
+
+// Log a FUSE call: the format text logs would use and its args, each
+// passed as a uint64_t.
+void {0:s}LogCall(unsigned opCode, const char *fmt, int nargs, ...)
+{{
+    static uint64_t fmtIds[LOG_NO_OP];
+    uint64_t args[1 + LOG_MAX_ARGS];
+    va_list ap;
+    int i;
+
+    if (nargs > LOG_MAX_ARGS)
+        nargs = LOG_MAX_ARGS;
+    va_start(ap, nargs);
+    for (i = 1; i <= nargs; i++)
+        args[i] = va_arg(ap, uint64_t);
+    va_end(ap);
+    {0:s}LogFormat(opCode, &fmtIds[opCode % LOG_NO_OP], fmt, nargs, args);
+}}
+
+// Other messages are logged as text.
+static void {0:s}LogText(const char *format, va_list ap)
+{{
+    char buffer[LOG_TEXT_MAX + 1];
+    int  n = vsnprintf(buffer, sizeof(buffer), format, ap);
+    if (n < 0)
+        return;
+    if (n > LOG_TEXT_MAX)
+        n = LOG_TEXT_MAX;
+    {0:s}LogPut(LOG_TEXT, LOG_NO_OP, n, buffer, n);
+}}
+
+void {0:s}LogEntry(const char *format, ...)
+{{
+    va_list ap;
+    va_start(ap, format);
+    {0:s}LogText(format, ap);
+    va_end(ap);
+}}
+void {0:s}LogMsg(const char *format, ...)
+{{
+    va_list ap;
+    va_start(ap, format);
+    {0:s}LogText(format, ap);
+    va_end(ap);
+}}
+
+""".format(prefix)
+
+        # dump structures field by field, rendered as LogMsg would
+        for func, s_type, s_name, comment, fields in LOG_STRUCTS:
+            vals = []
+            lines = ['"  %s:\\n"' % s_name]
+            for kind, s_ptr, field in fields:
+                if fuse_api == 3 and (s_ptr, field) in FUSE2_ONLY_FIELDS:
+                    continue
+                if s_ptr == 'DATA':
+                    s_ptr = '((struct %sData *)%s->private_data)' % (
+                        pkg_name, s_name)
+                if kind in LOG_FIELD_KINDS:
+                    line, cast = LOG_FIELD_KINDS[kind]
+                    lines.append('"%s"' % (line % ('  %s  ' % field)))
+                    vals.append('(uint64_t)%s%s->%s' % (cast, s_ptr, field))
+                else:
+                    lines.append('"   %-20s = %s\\n"' % (
+                        ' %s  ' % field, kind))
+                    if kind == '%s':
+                        vals.append('%sIntern(%s->%s)' % (
+                            prefix, s_ptr, field))
+                    else:
+                        vals.append('(uint64_t)%s->%s' % (s_ptr, field))
+            content2 += """\
+// {0:s}
+void {1:s}{2:s}({3:s} *{4:s})
+{{
+    static uint64_t fmtId;
+    uint64_t args[] = {{ 0,
+        {5:s} }};
+    {1:s}LogFormat(LOG_NO_OP, &fmtId,
+        {6:s},
+        {7:d}, args);
+}}
+
+""".format(
+                comment, prefix, func, s_type, s_name,
+                ',\n        '.join(vals), '\n        '.join(lines), len(vals))
+
+    if logging and not binary_log:
+        content2 += """\
+static char *msgHeader(char *p, int *maxChar, char *name)
+{{
+    int n =  snprintf(p, *maxChar, "  %s:\\n", name);
+    *maxChar -= n;
+    return p + n;
+}}
+
+#define MAX_BUFFER (1024 - 1)
 
 // log the name and value of a particular field of the structure s
 #define ADD_FIELD(s, field, fmt) \\
@@ -1331,8 +4376,7 @@ void {1:s}LogConn(struct fuse_conn_info *conn)
     p = msgHeader(p, &bytesLeft, "conn");
     ADD_INT_FIELD(conn, proto_major);
     ADD_INT_FIELD(conn, proto_minor);
-    ADD_INT_FIELD(conn, async_read);
-    ADD_INT_FIELD(conn, max_write);
+{2:s}    ADD_INT_FIELD(conn, max_write);
     ADD_INT_FIELD(conn, max_readahead);
     ADD_ULONG_FIELD(conn, capable);
     ADD_ULONG_FIELD(conn, want);
@@ -1352,8 +4396,7 @@ void {1:s}LogFI (struct fuse_file_info *fi)
 
     p = msgHeader(p, &bytesLeft, "fi");
     ADD_ULONG_FIELD(fi, flags);
-    ADD_ULL_FIELD(fi, fh_old);
-    ADD_INT_FIELD(fi, writepage);
+{3:s}    ADD_INT_FIELD(fi, writepage);
     ADD_INT_FIELD(fi, direct_io);
     ADD_INT_FIELD(fi, keep_cache);
     ADD_INT_FIELD(fi, flush);
@@ -1361,7 +4404,7 @@ void {1:s}LogFI (struct fuse_file_info *fi)
     ADD_INT_FIELD(fi, flock_release);
     ADD_ULL_FIELD(fi, fh);
     ADD_ULL_FIELD(fi, lock_owner);
-
+{4:s}
     {1:s}LogMsg(buffer);
 }};
 
@@ -1414,7 +4457,11 @@ void {1:s}LogStatVFS(struct statvfs *sv)
 
     {1:s}LogMsg(buffer);
 }}
-""".format(pkg_name, prefix, uc_name)
+""".format(pkg_name, prefix,
+           '    ADD_INT_FIELD(conn, async_read);\n' if fuse_api == 2 else '',
+           '    ADD_ULL_FIELD(fi, fh_old);\n' if fuse_api == 2 else '',
+           '    ADD_INT_FIELD(fi, backing_id);\n' if passthrough else '')
+    if logging:
         content += content2
 
     content3 = ''
@@ -1423,51 +4470,330 @@ void {1:s}LogStatVFS(struct statvfs *sv)
 
 // == INSTRUMENTATION ===============================================
 
+"""
+        if inst_mode in ['mutex', 'thread', ]:
+            content3 += """\
+static long chunkCount;         // chunks allocated, by all threads
+long        maxChunks;          // 0 means no limit
+long        opsDropped;
+
+// Allocate an empty chunk of slots and append it to the chain, or
+// return NULL if that would exceed the cap on memory.  This costs the
+// same however many slots are in use, and nothing already handed out
+// is ever moved.
+static chunk_t *{0:s}AddChunk(chunk_t **head, chunk_t **tail)
+{{
+    long n = __sync_add_and_fetch(&chunkCount, 1);
+    if ((maxChunks > 0) && (n > maxChunks)) {{
+        __sync_sub_and_fetch(&chunkCount, 1);
+        return NULL;
+    }}
+    chunk_t *c = (chunk_t*)calloc(1, sizeof(chunk_t));
+    assert(c != NULL);
+    if (*tail == NULL)
+        *head = c;
+    else
+        (*tail)->next = c;
+    *tail = c;
+    return c;
+}}
+
+""".format(prefix)      # pkg_name, prefix, uc_name)
+
+        if inst_mode == 'mutex':
+            content3 += """\
 // calloc BUCKET_COUNT of these
 bucket_t *buckets;
 
-opData_t *{0:s}ClockMeIn(struct timespec *tEntry, unsigned opcode)
+static opData_t *{0:s}ClaimSlot(unsigned opcode)
 {{
-    int status = clock_gettime(CLOCK_MONOTONIC, tEntry);
-    assert(status == 0);
+    int status;
     bucket_t *myBucket = &buckets[0];   // should be bktNdx
-    int doubled = 0;
+    opData_t *mySlot   = NULL;
+    int grew = 0;
 
     status = pthread_mutex_lock(&myBucket->lock);
     assert(status == 0);
-    int myCount = myBucket->count++;
-    if(myCount >= slotsPerBucket) {{
-        opData_t *p;
-        slotsPerBucket *= 2;
-        doubled++;
-        p = realloc(buckets[0].ops,
-                slotsPerBucket*sizeof(opData_t));
-        assert(p != NULL);
-        buckets[0].ops = p;
+    chunk_t *c = myBucket->tail;
+    if ((c == NULL) || (c->count >= CHUNK_SLOTS)) {{
+        c = {0:s}AddChunk(&myBucket->head, &myBucket->tail);
+        grew++;
+    }}
+    if (c != NULL) {{
+        mySlot = &c->ops[c->count++];
+        myBucket->count++;
+    }} else {{
+        opsDropped++;
     }}
     status = pthread_mutex_unlock(&myBucket->lock);
 
 """.format(prefix)      # pkg_name, prefix, uc_name)
 
-        if logging:
+            if logging:
+                content3 += """\
+    // DEBUG
+    if (grew && (c != NULL)) {{
+        {0:s}LogMsg("slot chunk %ld allocated\\n", chunkCount);
+        {0:s}FlushLog();
+    }}
+    // END
+""".format(prefix)          # pkg_name, prefix, uc_name)
+
             content3 += """\
+    assert(status == 0);
+    if (mySlot != NULL)
+        mySlot->opCode = opcode;
+    return mySlot;
+}
+"""
+        elif inst_mode == 'thread':
+            content3 += """\
+threadBucket_t *threadBuckets;
+
+// the calling thread's slots, created on first use
+static __thread threadBucket_t *myThreadBucket;
+
+static threadBucket_t *{0:s}NewThreadBucket(void)
+{{
+    threadBucket_t *tb = (threadBucket_t*)calloc(1, sizeof(threadBucket_t));
+    assert(tb != NULL);
+
+    // push onto the list of all thread buckets without taking a lock
+    do {{
+        tb->next = threadBuckets;
+    }} while (!__sync_bool_compare_and_swap(&threadBuckets, tb->next, tb));
+    return tb;
+}}
+
+static opData_t *{0:s}ClaimSlot(unsigned opcode)
+{{
+    threadBucket_t *myBucket = myThreadBucket;
+    int grew = 0;
+
+    if (myBucket == NULL)
+        myBucket = myThreadBucket = {0:s}NewThreadBucket();
+    chunk_t *c = myBucket->tail;
+    if ((c == NULL) || (c->count >= CHUNK_SLOTS)) {{
+        c = {0:s}AddChunk(&myBucket->head, &myBucket->tail);
+        grew++;
+    }}
+    if (c == NULL) {{
+        __sync_add_and_fetch(&opsDropped, 1);
+        return NULL;
+    }}
+
+""".format(prefix)      # pkg_name, prefix, uc_name)
+
+            if logging:
+                content3 += """\
     // DEBUG
-    if (doubled) {{
-        {0:s}LogMsg("slotsPerBucket doubled to %d\\n", slotsPerBucket);
+    if (grew) {{
+        {0:s}LogMsg("slot chunk %ld allocated\\n", chunkCount);
         {0:s}FlushLog();
     }}
     // END
 """.format(prefix)          # pkg_name, prefix, uc_name)
 
-        content3 += """\
+            content3 += """\
+    opData_t *mySlot = &c->ops[c->count++];
+    myBucket->count++;
+    mySlot->opCode = opcode;
+    return mySlot;
+}
+"""
+
+        elif inst_mode == 'flush':
+            content3 += """\
+// calloc BUCKET_COUNT of these
+bucket_t *buckets;
+
+// Buckets are filled in turn.  When the active bucket fills it is
+// marked full and handed to the writer thread, which appends it to the
+// data file once every slot in it has been clocked out.
+static int             activeNdx;          // bucket being filled
+static int             stopWriter;         // set at destroy
+static FILE            *bucketFile;
+static size_t          bucketsWritten;     // number of full buckets
+static size_t          opsWritten;
+static pthread_t       writerThread;
+static pthread_mutex_t flushLock = PTHREAD_MUTEX_INITIALIZER;
+static pthread_cond_t  flushCond = PTHREAD_COND_INITIALIZER;  // to writer
+static pthread_cond_t  doneCond  = PTHREAD_COND_INITIALIZER;  // from writer
+"""
+            if rec_version >= 2:
+                content3 += """\
+static bucketHdr_t     fileHdr;            // rewritten after each bucket
+"""
+            content3 += """
+
+static opData_t *{0:s}ClaimSlot(unsigned opcode)
+{{
+    int status = pthread_mutex_lock(&flushLock);
     assert(status == 0);
-    opData_t *mySlot = &myBucket->ops[myCount];
+    bucket_t *myBucket = &buckets[activeNdx];
+    while (myBucket->count >= slotsPerBucket) {{
+        bucket_t *other = &buckets[1 - activeNdx];
+        if (other->full) {{
+            // the writer has fallen behind; wait rather than grow
+            pthread_cond_wait(&doneCond, &flushLock);
+        }} else {{
+            myBucket->full = 1;
+            activeNdx = 1 - activeNdx;
+            pthread_cond_signal(&flushCond);
+        }}
+        myBucket = &buckets[activeNdx];
+    }}
+    opData_t *mySlot = &myBucket->ops[myBucket->count++];
+    __sync_add_and_fetch(&myBucket->inFlight, 1);
+    status = pthread_mutex_unlock(&flushLock);
+    assert(status == 0);
+
+    mySlot->opCode = opcode;
+    return mySlot;
+}}
+""".format(prefix)      # pkg_name, prefix, uc_name)
+
+        elif inst_mode == 'mmap':
+            content3 += """\
+// The data file is mapped, and the header's count is the index of the
+// next free slot.  Records reach the file as they are written, so they
+// survive a crash or a lazy unmount.
+long                        maxExtents = MAX_EXTENTS;
+static int                  bucketFd   = -1;
+static bucketHdr_t          *bucketHdr;
+static opData_t * volatile  extents[MAX_EXTENTS];
+static pthread_mutex_t      extentLock = PTHREAD_MUTEX_INITIALIZER;
+
+// Extend the file and map extent e, unless another thread already has.
+// Space is allocated rather than left sparse so that a full disk makes
+// this fail instead of raising SIGBUS on a later store.
+static opData_t *{0:s}MapExtent(long e)
+{{
+    size_t len   = EXTENT_SLOTS * sizeof(opData_t);
+    off_t  where = HDR_SIZE + (off_t)e * len;
+
+    pthread_mutex_lock(&extentLock);
+    opData_t *p = extents[e];
+    if ((p == NULL) && (posix_fallocate(bucketFd, where, len) == 0)) {{
+        p = mmap(NULL, len, PROT_READ | PROT_WRITE, MAP_SHARED,
+                bucketFd, where);
+        if (p == MAP_FAILED) {{
+            p = NULL;
+        }} else {{
+            __sync_synchronize();
+            extents[e] = p;
+        }}
+    }}
+    pthread_mutex_unlock(&extentLock);
+    return p;
+}}
+
+static opData_t *{0:s}ClaimSlot(unsigned opcode)
+{{
+    bucketHdr_t *hdr = bucketHdr;
+    if (hdr == NULL)                // file not open yet, or closed
+        return NULL;
+
+    uint64_t n    = __sync_fetch_and_add(&hdr->count, 1);
+    long     e    = n / EXTENT_SLOTS;
+    opData_t *ext = NULL;
+    if (e < maxExtents) {{
+        ext = extents[e];
+        if (ext == NULL)
+            ext = {0:s}MapExtent(e);
+        // halfway through an extent, map the next one ahead of need
+        if ((n % EXTENT_SLOTS == EXTENT_SLOTS / 2) && (e + 1 < maxExtents))
+            {0:s}MapExtent(e + 1);
+    }}
+    if (ext == NULL) {{
+        __sync_add_and_fetch(&hdr->dropped, 1);
+        return NULL;
+    }}
+    opData_t *mySlot = &ext[n % EXTENT_SLOTS];
     mySlot->opCode = opcode;
     return mySlot;
 }}
+""".format(prefix)      # pkg_name, prefix, uc_name)
+
+        if sampling:
+            content3 += """\
+
+// Every call is counted, but only some are timed and recorded.  The
+// weight of a recorded call is the number of calls of its opcode since
+// the last one recorded, itself included.
+uint64_t        opCalls[MAX_OP_NAMES];
+static uint64_t lastSampled[MAX_OP_NAMES];
+static uint64_t rateSec;            // the second being rate limited
+static long     rateCount;          // calls recorded in that second
+
+// Return the weight of the call if it is to be recorded, or 0.
+static inline uint32_t {0:s}Sample(unsigned opcode)
+{{
+    uint64_t n = __sync_add_and_fetch(&opCalls[opcode], 1);
+    if ((fgSampleEvery > 1) && (n % fgSampleEvery != 0))
+        return 0;
+    if (fgSamplePerSec > 0) {{
+        // a coarse clock is enough for this, and much cheaper
+        struct timespec now;
+        clock_gettime(CLOCK_MONOTONIC_COARSE, &now);
+        uint64_t sec = rateSec;
+        if (((uint64_t)now.tv_sec != sec) &&
+                __sync_bool_compare_and_swap(&rateSec, sec, now.tv_sec))
+            __sync_lock_test_and_set(&rateCount, 0);
+        if (__sync_add_and_fetch(&rateCount, 1) > fgSamplePerSec)
+            return 0;
+    }}
+    uint64_t last = __sync_lock_test_and_set(&lastSampled[opcode], n);
+    return (n > last) ? n - last : 1;
+}}
+""".format(prefix)          # pkg_name, prefix, uc_name)
+
+        content3 += """\
+
+opData_t *{0:s}ClockMeIn(struct timespec *tEntry, unsigned opcode)
+{{
+""".format(prefix)          # pkg_name, prefix, uc_name)
+        if sampling:
+            content3 += """\
+    uint32_t weight = {0:s}Sample(opcode);
+    if (weight == 0)                // counted, but not recorded
+        return NULL;
+""".format(prefix)          # pkg_name, prefix, uc_name)
+        content3 += """\
+    int status = clock_gettime(CLOCK_MONOTONIC, tEntry);
+    assert(status == 0);
+    opData_t *mySlot = {0:s}ClaimSlot(opcode);
+""".format(prefix)          # pkg_name, prefix, uc_name)
+        if sampling:
+            content3 += """\
+    if (mySlot != NULL)
+        mySlot->weight = weight;
+"""
+        if passthrough:
+            content3 += """\
+    if (mySlot != NULL)
+        mySlot->flags  = 0;        // slots are reused
+"""
+        content3 += """\
+    return mySlot;
+}
+"""
+
+        if rec_version >= 2:
+            content3 += """\
+
+// the calling thread's kernel thread ID, looked up on first use
+static __thread uint32_t myTid;
+"""
+
+        content3 += """\
 
-void {0:s}ClockMeOut(struct timespec *tEntry, opData_t *mySlot, size_t count)
+void {0:s}ClockMeOut(struct timespec *tEntry, opData_t *mySlot, size_t count,
+                                            uint64_t offset, uint64_t fh)
 {{
+    if (mySlot == NULL)             // the call was not recorded
+        return;
+
     struct timespec tExit;
     long inSec  = tEntry->tv_sec;
     long inNsec = tEntry->tv_nsec;
@@ -1487,61 +4813,458 @@ void {0:s}ClockMeOut(struct timespec *tEntry, opData_t *mySlot, size_t count)
     mySlot->lateNsec = lateNsec;
     mySlot->lateSec  = lateSec;
     mySlot->count    = count;
+""".format(prefix)          # pkg_name, prefix, uc_name)
+
+        if rec_version >= 2:
+            content3 += """\
+    mySlot->offset   = offset;
+    mySlot->fh       = fh;
+    if (myTid == 0)
+        myTid = syscall(SYS_gettid);
+    mySlot->tid      = myTid;
+"""
+
+        if inst_mode == 'flush':
+            content3 += """\
+
+    // the last slot out of a full bucket releases it to the writer
+    int b = (mySlot >= buckets[1].ops) &&
+            (mySlot <  buckets[1].ops + slotsPerBucket);
+    if ((__sync_sub_and_fetch(&buckets[b].inFlight, 1) == 0) &&
+            buckets[b].full) {
+        pthread_mutex_lock(&flushLock);
+        pthread_cond_signal(&flushCond);
+        pthread_mutex_unlock(&flushLock);
+    }
+"""
+
+        content3 += """\
 }}
 
-int {0:s}WriteBucket()
+// Set fullPath to cwd/tmp/bucket-CCYYMMDD-HHMMSS
+static void {0:s}BucketPath(char fullPath[PATH_MAX])
 {{
     time_t now         = time(NULL);
     struct tm *when    = localtime(&now);
-    char fullPath[PATH_MAX];
     strcpy(fullPath, {1:s}_DATA->cwd);
     strncat(fullPath, "/tmp/", PATH_MAX);
     char *p = fullPath + strlen(fullPath);
     snprintf(p, PATH_MAX, "/bucket-%04d%02d%02d-%02d%02d%02d",
         when->tm_year + 1900, when->tm_mon + 1, when->tm_mday,
         when->tm_hour, when->tm_min, when->tm_sec);
+}}
 
 """.format(prefix, uc_name)          # pkg_name, prefix, uc_name)
 
-        if logging:
+        if inst_mode == 'mmap' or rec_version >= 2:
+            content3 += """\
+// Fill in a zeroed data file header.
+static void {0:s}InitHeader(bucketHdr_t *hdr)
+{{
+    memcpy(hdr->magic, BUCKET_MAGIC, sizeof(hdr->magic));
+    hdr->version = {1:d};
+    hdr->hdrSize = HDR_SIZE;
+    hdr->recSize = sizeof(opData_t);
+""".format(prefix, rec_version)
+
+            if rec_version >= 2:
+                content3 += """\
+
+    // the monotonic clock times calls; this relates it to the wall clock
+    struct timespec real, mono;
+    clock_gettime(CLOCK_REALTIME,  &real);
+    clock_gettime(CLOCK_MONOTONIC, &mono);
+    hdr->realSec  = real.tv_sec;
+    hdr->realNsec = real.tv_nsec;
+    hdr->monoSec  = mono.tv_sec;
+    hdr->monoNsec = mono.tv_nsec;
+    memcpy(hdr->buildFlags, "{0:s}", {1:d});
+
+    static const char *opNames[] = {{
+""".format(flags_text, len(flags_text) + 1)
+                for name in op_name_list:
+                    content3 += '        "%s",\n' % name
+                content3 += """\
+    };
+    int i;
+    hdr->opCount = sizeof(opNames) / sizeof(opNames[0]);
+    for (i = 0; (i < hdr->opCount) && (i < MAX_OP_NAMES); i++)
+        strncpy(hdr->opNames[i], opNames[i], OP_NAME_LEN - 1);
+"""
+                if sampling:
+                    content3 += """\
+    hdr->sampleEvery  = fgSampleEvery;
+    hdr->samplePerSec = fgSamplePerSec;
+"""
+            content3 += """\
+}
+
+"""
+
+        if inst_mode == 'flush':
+            content3 += """\
+// Append a full bucket to the data file once nothing is writing to it.
+// Called with flushLock held.
+static void {0:s}FlushBucket(bucket_t *b)
+{{
+    while (b->inFlight > 0)
+        pthread_cond_wait(&flushCond, &flushLock);
+    pthread_mutex_unlock(&flushLock);
+
+    size_t written = fwrite(b->ops, sizeof(opData_t), b->count, bucketFile);
+    fflush(bucketFile);
+""".format(prefix)          # pkg_name, prefix, uc_name)
+            if rec_version >= 2:
+                content3 += """\
+    fileHdr.count = opsWritten + written;
+"""
+            if sampling:
+                content3 += """\
+    memcpy(fileHdr.opCalls, opCalls, sizeof(fileHdr.opCalls));
+"""
+            if rec_version >= 2:
+                content3 += """\
+    pwrite(fileno(bucketFile), &fileHdr, sizeof(fileHdr), 0);
+"""
+            content3 += """\
+
+    pthread_mutex_lock(&flushLock);
+    opsWritten += written;
+    bucketsWritten++;
+    b->count = 0;
+    b->full  = 0;
+    pthread_cond_broadcast(&doneCond);
+}}
+
+// Runs in the background, never in a FUSE request thread, so it must
+// not use the FUSE context.
+static void *{0:s}BucketWriter(void *arg)
+{{
+    pthread_mutex_lock(&flushLock);
+    while (1) {{
+        bucket_t *other = &buckets[1 - activeNdx];
+        if (other->full) {{
+            {0:s}FlushBucket(other);
+        }} else if (stopWriter) {{
+            bucket_t *active = &buckets[activeNdx];
+            if (active->count > 0)
+                {0:s}FlushBucket(active);
+            break;
+        }} else {{
+            pthread_cond_wait(&flushCond, &flushLock);
+        }}
+    }}
+    pthread_mutex_unlock(&flushLock);
+    return NULL;
+}}
+
+// Called from init: open the data file and start the writer thread.
+int {0:s}StartBucketWriter()
+{{
+    char fullPath[PATH_MAX];
+    {0:s}BucketPath(fullPath);
+""".format(prefix)          # pkg_name, prefix, uc_name)
+
+            if logging:
+                content3 += """\
+    {0:s}LogMsg("data file is %s\\n", fullPath);
+""".format(prefix)          # pkg_name, prefix, uc_name)
+
+            content3 += """\
+    bucketFile = fopen(fullPath, "w+");
+"""
+            if rec_version >= 2:
+                content3 += """\
+    if (bucketFile != NULL) {{
+        {0:s}InitHeader(&fileHdr);
+        fwrite(&fileHdr, sizeof(fileHdr), 1, bucketFile);
+        fseek(bucketFile, HDR_SIZE, SEEK_SET);
+    }}
+""".format(prefix)          # pkg_name, prefix, uc_name)
+            content3 += """\
+    if (bucketFile == NULL) {
+        int myErr = errno;
+"""
+            if logging:
+                content3 += """\
+        {0:s}LogMsg("errno %d (%s); failed to open %s\\n",
+                myErr, strerror(myErr), fullPath);
+""".format(prefix)          # pkg_name, prefix, uc_name)
+
+            content3 += """\
+        return -myErr;
+    }}
+    return -pthread_create(&writerThread, NULL, {0:s}BucketWriter, NULL);
+}}
+
+// Called from destroy: write out whatever remains and stop the writer.
+int {0:s}WriteBucket()
+{{
+    if (bucketFile == NULL)
+        return -EBADF;
+    pthread_mutex_lock(&flushLock);
+    stopWriter = 1;
+    pthread_cond_signal(&flushCond);
+    pthread_mutex_unlock(&flushLock);
+    pthread_join(writerThread, NULL);
+""".format(prefix)          # pkg_name, prefix, uc_name)
+
+            if logging:
+                content3 += """\
+    {0:s}LogMsg("wrote %lu items in %lu buckets\\n",
+            opsWritten, bucketsWritten);
+""".format(prefix)          # pkg_name, prefix, uc_name)
+
+            content3 += """\
+"""
+            if rec_version >= 2:
+                content3 += """\
+    fileHdr.count  = opsWritten;
+    fileHdr.flags |= HDR_CLOSED;
+"""
+            if sampling:
+                content3 += """\
+    memcpy(fileHdr.opCalls, opCalls, sizeof(fileHdr.opCalls));
+"""
+            if rec_version >= 2:
+                content3 += """\
+    pwrite(fileno(bucketFile), &fileHdr, sizeof(fileHdr), 0);
+"""
+            content3 += """\
+    fclose(bucketFile);
+    bucketFile = NULL;
+    return 0;
+}
+"""
+        elif inst_mode == 'mmap':
+            content3 += """\
+// Called from init: create the data file, write its header, and map the
+// first extent.  No calls are recorded before this.
+int {0:s}MapBucketFile()
+{{
+    char fullPath[PATH_MAX];
+    {0:s}BucketPath(fullPath);
+""".format(prefix)          # pkg_name, prefix, uc_name)
+
+            if logging:
+                content3 += """\
+    {0:s}LogMsg("data file is %s\\n", fullPath);
+""".format(prefix)          # pkg_name, prefix, uc_name)
+
+            content3 += """\
+    int myErr = 0;
+    int fd = open(fullPath, O_RDWR | O_CREAT | O_TRUNC, 0644);
+    if (fd < 0)
+        myErr = errno;
+    else
+        myErr = posix_fallocate(fd, 0, HDR_SIZE);
+    bucketHdr_t *hdr = MAP_FAILED;
+    if (myErr == 0) {
+        hdr = mmap(NULL, HDR_SIZE, PROT_READ | PROT_WRITE, MAP_SHARED, fd, 0);
+        if (hdr == MAP_FAILED)
+            myErr = errno;
+    }
+    if (myErr != 0) {
+"""
+            if logging:
+                content3 += """\
+        {0:s}LogMsg("errno %d (%s); failed to map %s\\n",
+                myErr, strerror(myErr), fullPath);
+""".format(prefix)          # pkg_name, prefix, uc_name)
+
+            content3 += """\
+        if (fd >= 0)
+            close(fd);
+        return -myErr;
+    }}
+    {0:s}InitHeader(hdr);
+    bucketFd     = fd;
+    {0:s}MapExtent(0);
+    __sync_synchronize();
+    bucketHdr    = hdr;             // start recording
+    return 0;
+}}
+
+// Called from destroy: stop recording, mark the header closed, and
+// trim the unused end of the last extent.
+int {0:s}WriteBucket()
+{{
+    bucketHdr_t *hdr = bucketHdr;
+    if (hdr == NULL)
+        return -EBADF;
+    bucketHdr = NULL;
+
+    long     e;
+    uint64_t mapped = 0;
+    for (e = 0; e < MAX_EXTENTS; e++) {{
+        if (extents[e] != NULL) {{
+            munmap(extents[e], EXTENT_SLOTS * sizeof(opData_t));
+            extents[e] = NULL;
+            mapped = (e + 1) * (uint64_t)EXTENT_SLOTS;
+        }}
+    }}
+    if (hdr->count > mapped)
+        hdr->count = mapped;
+    hdr->flags |= HDR_CLOSED;
+""".format(prefix)          # pkg_name, prefix, uc_name)
+            if sampling:
+                content3 += """\
+    memcpy(hdr->opCalls, opCalls, sizeof(hdr->opCalls));
+"""
             content3 += """\
+    uint64_t count   = hdr->count;
+    uint64_t dropped = hdr->dropped;
+    msync(hdr, HDR_SIZE, MS_SYNC);
+    munmap(hdr, HDR_SIZE);
+
+    int status = ftruncate(bucketFd, HDR_SIZE + count * sizeof(opData_t));
+    int myErr  = (status == 0) ? 0 : errno;
+    close(bucketFd);
+    bucketFd = -1;
+"""
+
+            if logging:
+                content3 += """\
+    {0:s}LogMsg("%lu items in data file, %lu calls dropped\\n",
+            count, dropped);
+""".format(prefix)          # pkg_name, prefix, uc_name)
+
+            content3 += """\
+    if (dropped > 0)
+        fprintf(stderr, "%lu calls not recorded: fgMaxSlotMB is %ld\\n",
+                dropped, fgMaxSlotMB);
+    return -myErr;
+}
+"""
+        else:
+            content3 += """\
+int {0:s}WriteBucket()
+{{
+    char fullPath[PATH_MAX];
+    {0:s}BucketPath(fullPath);
+
+""".format(prefix)          # pkg_name, prefix, uc_name)
+
+            if logging:
+                content3 += """\
     // DEBUG
     {0:s}LogMsg("data file is %s\\n", fullPath);
     // END
 
 """.format(prefix)              # pkg_name, prefix, uc_name)
 
-        content3 += """\
+            content3 += """\
     // any 'b' has no effect in Linux
     FILE *f = fopen(fullPath, "w+");
-    if (f != NULL) {{
-        size_t written = fwrite(
-                buckets[0].ops, sizeof(opData_t), buckets[0].count, f);
-"""         # .format(pkg_name, prefix, uc_name)
-
-        if logging:
-            content3 += """\
-        {0:s}LogMsg("wrote %lu bytes, %lu items, to %s\\n",
-                written, buckets[0].count, fullPath);
+    if (f != NULL) {
+"""
+            if inst_mode == 'mutex':
+                content3 += """\
+        size_t count   = buckets[0].count;
+        size_t written = 0;
+"""
+            elif inst_mode == 'thread':
+                content3 += """\
+        size_t count   = 0;
+        size_t written = 0;
+        int    nThreads = 0;
+        int    i;
+        threadBucket_t *tb;
+        for (tb = threadBuckets; tb != NULL; tb = tb->next) {
+            count += tb->count;
+            nThreads++;
+        }
+"""
+            if rec_version >= 2:
+                content3 += """\
+        bucketHdr_t hdr;
+        memset(&hdr, 0, sizeof(hdr));
+        {0:s}InitHeader(&hdr);
+        hdr.count   = count;
+        hdr.dropped = opsDropped;
+        hdr.flags   = HDR_CLOSED;
+""".format(prefix)          # pkg_name, prefix, uc_name)
+                if sampling:
+                    content3 += """\
+        memcpy(hdr.opCalls, opCalls, sizeof(hdr.opCalls));
+"""
+                content3 += """\
+        fwrite(&hdr, sizeof(hdr), 1, f);
+        fseek(f, HDR_SIZE, SEEK_SET);
+"""
+            if inst_mode == 'mutex':
+                content3 += """\
+        chunk_t *c;
+        for (c = buckets[0].head; c != NULL; c = c->next)
+            written += fwrite(c->ops, sizeof(opData_t), c->count, f);
+"""
+            elif inst_mode == 'thread':
+                content3 += """\
+        // Each thread's slots are already in time order, so a k-way
+        // merge on the time of the call yields a time-ordered file.
+        chunk_t  **cur  = calloc(nThreads + 1, sizeof(chunk_t *));
+        uint32_t *next  = calloc(nThreads + 1, sizeof(uint32_t));
+        assert(cur != NULL && next != NULL);
+        for (i = 0, tb = threadBuckets; tb != NULL; tb = tb->next, i++)
+            cur[i] = tb->head;
+        while (1) {
+            int       best   = -1;
+            opData_t *bestOp = NULL;
+            for (i = 0; i < nThreads; i++) {
+                if ((cur[i] != NULL) && (next[i] >= cur[i]->count)) {
+                    cur[i]  = cur[i]->next;
+                    next[i] = 0;
+                }
+                if ((cur[i] == NULL) || (next[i] >= cur[i]->count))
+                    continue;
+                opData_t *op = &cur[i]->ops[next[i]];
+                if ((best < 0) || (op->opSec < bestOp->opSec) ||
+                        ((op->opSec == bestOp->opSec) &&
+                         (op->opNsec < bestOp->opNsec))) {
+                    best   = i;
+                    bestOp = op;
+                }
+            }
+            if (best < 0)
+                break;
+            written += fwrite(bestOp, sizeof(opData_t), 1, f);
+            next[best]++;
+        }
+        free(next);
+        free(cur);
+"""
+            if logging:
+                content3 += """\
+        {0:s}LogMsg("wrote %lu items of %lu to %s\\n",
+                written, count, fullPath);
+        {0:s}LogMsg("%ld calls dropped, %ld chunks of %d slots\\n",
+                opsDropped, chunkCount, CHUNK_SLOTS);
 """.format(prefix)  # pkg_name, prefix, uc_name)
+            content3 += """\
+        if (opsDropped > 0)
+            fprintf(stderr, "%ld calls not recorded: fgMaxSlotMB is %ld\\n",
+                    opsDropped, fgMaxSlotMB);
+"""
 
-        content3 += """\
+            content3 += """\
         fflush(f);
         fclose(f);
-    }} else {{
+        return (written == count) ? 0 : -EIO;
+    } else {
         int myErr = errno;
-"""             # .format(pkg_name, prefix, uc_name)
+"""
 
-        if logging:
-            content3 += """\
-        {0:s}LogMsg("errno %d (%s); failed to open %s\\n", " +\
-myErr, strerror(myErr), p);
+            if logging:
+                content3 += """\
+        {0:s}LogMsg("errno %d (%s); failed to open %s\\n",
+                myErr, strerror(myErr), fullPath);
 """.format(prefix)  # pkg_name, prefix, uc_name)
 
-        content3 += """\
-    }}
-}}
-"""             # .format(pkg_name, prefix, uc_name)
+            content3 += """\
+        return -myErr;
+    }
+}
+"""
     content += content3
 
     util_c_file = os.path.join(path_to_src, "util.c")
@@ -1549,6 +5272,13 @@ myErr, strerror(myErr), p);
         file.write(content)
 
     # generate .inc files -------------------------------------------
+    if lowlevel:
+        make_ll_incs(path_to_src, prefix, func_map, logging=logging,
+                     binary_log=binary_log, log_ops=log_ops,
+                     instrumenting=instrumenting, time_ops=time_ops,
+                     inst_mode=inst_mode, async_log=async_log,
+                     keep_cache=keep_cache, passthrough=passthrough)
+        return
 
     # optable.inc -----------------------------------------
     content = """/** optable.inc */
@@ -1556,7 +5286,12 @@ myErr, strerror(myErr), p);
 struct fuse_operations {0:s}OpTable = {{
     .getattr      = {0:s}getattr,
     .readlink     = {0:s}readlink,
+""".format(prefix)
+    if fuse_api == 2:
+        content += """\
     .getdir       = NULL,
+"""
+    content += """\
     .mknod        = {0:s}mknod,
     .mkdir        = {0:s}mkdir,
     .unlink       = {0:s}unlink,
@@ -1567,9 +5302,14 @@ struct fuse_operations {0:s}OpTable = {{
     .chmod        = {0:s}chmod,
     .chown        = {0:s}chown,
     .truncate     = {0:s}truncate,
+""".format(prefix)
+    if fuse_api == 2:
+        content += """\
 #ifndef HAVE_UTIMENSAT
     .utime        = {0:s}utime,
 #endif
+""".format(prefix)
+    content += """\
     .open         = {0:s}open,
     .read         = {0:s}read,
     .write        = {0:s}write,
@@ -1592,6 +5332,9 @@ struct fuse_operations {0:s}OpTable = {{
     .init         = {0:s}init,
     .destroy      = {0:s}destroy,
     .access       = {0:s}access,
+""".format(prefix)
+    if fuse_api == 2:
+        content += """\
     .create       = {0:s}create,
     .ftruncate    = {0:s}ftruncate,
     .fgetattr     = {0:s}fgetattr
@@ -1601,12 +5344,29 @@ struct fuse_operations {0:s}OpTable = {{
 #endif
 
     , .lock         = {0:s}lock
+""".format(prefix)
+    else:
+        content += """\
+    .create       = {0:s}create
 
+#ifdef HAVE_UTIMENSAT
+    , .utimens      = {0:s}utimens
+#endif
+""".format(prefix)
+    content += """
 #ifdef HAVE_POSIX_FALLOCATE
     , .fallocate    = {0:s}fallocate
 #endif
-}};
 """.format(prefix)
+    if buf_ops:
+        content += """\
+
+    , .write_buf    = {0:s}write_buf
+    , .read_buf     = {0:s}read_buf
+""".format(prefix)
+    content += """\
+};
+"""
     op_table_file = os.path.join(
         path_to_pkg, os.path.join(
             'src', 'optable.inc'))
@@ -1626,6 +5386,10 @@ struct fuse_operations {0:s}OpTable = {{
         attrs = op_attrs[name]
         if (attrs & DEPRECATED) or (attrs & NOT_IMPLEMENTED):
             continue
+        if name in ['write_buf', 'read_buf', ] and not buf_ops:
+            continue
+        if fuse_api == 3 and name in FUSE2_ONLY_OPS:
+            continue
         if name not in func_map:   # names at end are not yet implemented
             # DEBUG
             print("%s is NOT IN funcMap" % name)
@@ -1633,6 +5397,12 @@ struct fuse_operations {0:s}OpTable = {{
             break
         f_map = func_map[name]    # FuseFunc for this name
         op_code = "FG_%s" % name.upper()
+        # ops left out of --log_ops or --time_ops get no such code at all
+        op_logging = logging and (log_ops is None or name in log_ops)
+        op_timing = instrumenting and (time_ops is None or name in time_ops)
+        # paths are resolved relative to the root directory fd
+        at_call = at_calls and name in AT_CALL_MAP
+        cache_attrs = attr_cache and name in ['getattr', 'fgetattr', ]
         path_to_inc = os.path.join(src_dir, "%s.inc" % name)
         strings = []
         strings.append("/** %s.inc */\n" % (name))
@@ -1647,7 +5417,7 @@ struct fuse_operations {0:s}OpTable = {{
         strings.append("static %s\n{" % f_map.first_line())
 
         # -- instrumenation ---------------------------
-        if instrumenting:
+        if op_timing:
             content = """    struct timespec tEntry;
     opData_t *myData = {0:s}ClockMeIn(&tEntry, {1:s});
 """.format(prefix, op_code)  # name, prefix, op_code)
@@ -1655,26 +5425,85 @@ struct fuse_operations {0:s}OpTable = {{
         # -- variable declarations --------------------
         if attrs & RETURNS_STATUS:
             strings.append('    int status = 0;')
-        if (attrs & SYSCALL_RET_FD) or name == 'fallocate':
+        if (attrs & SYSCALL_RET_FD) or name == 'fallocate' or \
+                (at_call and name in ['opendir', 'truncate', ]):
             strings.append('    int fd;')
-        if attrs & (FULL_PATH | DOUBLE_FULL_PATH):
-            strings.append('    char fpath[PATH_MAX];')
-        if attrs & DOUBLE_FULL_PATH:
-            strings.append('    char fnewpath[PATH_MAX];')
-        if attrs & HAS_LINK_FILE:
-            strings.append('    char flink[PATH_MAX];')
+        if at_call and name == 'truncate':
+            strings.append('    char procname[64];')
+        if at_call:
+            strings.append('    int rootfd = %s_DATA->rootfd;' % uc_name)
+            if attrs & (FULL_PATH | DOUBLE_FULL_PATH):
+                strings.append(
+                    '    const char *rpath = %sRelPath(path);' % prefix)
+            if attrs & DOUBLE_FULL_PATH:
+                strings.append(
+                    '    const char *rnewpath = %sRelPath(newpath);' % prefix)
+            if attrs & HAS_LINK_FILE:
+                strings.append(
+                    '    const char *rlink = %sRelPath(link);' % prefix)
+        else:
+            if attrs & (FULL_PATH | DOUBLE_FULL_PATH):
+                strings.append('    char fpath[PATH_MAX];')
+            if attrs & DOUBLE_FULL_PATH:
+                strings.append('    char fnewpath[PATH_MAX];')
+            if attrs & HAS_LINK_FILE:
+                strings.append('    char flink[PATH_MAX];')
 
         if name in ['opendir', 'readdir']:
             strings.append('    DIR *dp;')
             if name == 'readdir':
                 strings.append('    struct dirent *entry;')
-        elif name == 'listxattr':
+                strings.append('    struct stat si;')
+                if fuse_api == 3:
+                    strings.append('    enum fuse_fill_dir_flags fill;')
+        elif name == 'listxattr' and op_logging:
+            # used only to log the attributes returned
             strings.append('    char *ptr;')
+        elif name == 'write_buf':
+            strings.append('    size_t size = fuse_buf_size(buf);')
+            strings.append(
+                '    struct fuse_bufvec dst = FUSE_BUFVEC_INIT(size);')
+        elif name == 'read_buf':
+            strings.append('    struct fuse_bufvec *src;')
+        if cache_attrs:
+            strings.append('    attrTicket_t ticket;')
 
         strings.append("")
 
         # -- log on entry -----------------------------
-        if logging:
+        if op_logging and binary_log and name == 'init':
+            strings.append(
+                "    %sLogCall(%s, \"\\n%sinit()\\n\", 0);" %
+                (prefix, op_code, prefix))
+            strings.append('    %sLogConn(conn);' % prefix)
+            strings.append(
+                '    %sLogContext(fuse_get_context());' % prefix)
+        elif op_logging and binary_log:
+            # the format text logs would use, and the args as uint64_t
+            if attrs & DOUBLE_FULL_PATH:
+                fmt = '\\n%s%s(path=\\"%%s\\", newpath=\\"%%s\\")\\n' % (
+                    prefix, name)
+                log_args = ['%sIntern(path)' % prefix,
+                            '%sIntern(newpath)' % prefix]
+            else:
+                pats = []
+                log_args = []
+                for param in f_map.params:
+                    p_type, p_name = param
+                    pat = log_entry_pat(name, p_name)
+                    pats.append('%s=%s' % (p_name, pat))
+                    if pat == '\\"%s\\"':
+                        log_args.append('%sIntern(%s)' % (prefix, p_name))
+                    elif '*' in p_type or '[' in p_name:
+                        log_args.append('(uint64_t)(uintptr_t)%s' %
+                                        p_name.split('[')[0])
+                    else:
+                        log_args.append('(uint64_t)%s' % p_name)
+                fmt = '\\n%s%s(%s)\\n' % (prefix, name, ', '.join(pats))
+            strings.append('    %sLogCall(%s, "%s", %d,' % (
+                prefix, op_code, fmt, len(log_args)))
+            strings.append('             %s);' % ', '.join(log_args))
+        elif op_logging:
             if name == 'init':
                 strings.append(
                     "    %sLogEntry(\"\\n%sinit()\\n\");" %
@@ -1698,20 +5527,7 @@ struct fuse_operations {0:s}OpTable = {{
                         if ndx > 0:
                             log_e.append(', ')
                         p_name = param[1]
-                        if p_name == 'size':
-                            if name in ['read', 'write', ]:
-                                pat = '%lld'
-                            else:
-                                pat = '%d'
-                        elif p_name == 'value':
-                            if name in ['getxattr', ]:
-                                pat = '0x%08x'
-                            else:
-                                pat = '\\"%s\\"'
-                        elif p_name in LOG_ENTRY_PAT_MAP:
-                            pat = LOG_ENTRY_PAT_MAP[p_name]
-                        else:
-                            pat = 'UNKNOWN PAT FOR \'%s\'' % p_name
+                        pat = log_entry_pat(name, p_name)
                         log_e.append('%s=%s' % (p_name, pat))
                     log_e.append(")\\n\",")
                     strings.append(''.join(log_e))
@@ -1729,43 +5545,145 @@ struct fuse_operations {0:s}OpTable = {{
         if name == 'readdir':
             strings.append('    dp = (DIR *) (uintptr_t) fi->fh;')
 
-        if logging and name != 'opendir' and name != 'readdir' and \
+        if op_logging and name != 'opendir' and name != 'readdir' and \
                 attrs & LOGGING_FI and not attrs & SET_FH_FROM_FD:
             strings.append('    %sLogFI(fi);' % prefix)
 
         # -- set up absolute paths ------------------------
-        if attrs & FULL_PATH:
-            strings.append("    %sFullPath(fpath, path);" % prefix)
-        if attrs & DOUBLE_FULL_PATH:
-            strings.append("    %sFullPath(fnewpath, newpath);" % prefix)
-        if attrs & HAS_LINK_FILE:
-            strings.append("    %sFullPath(flink, link);" % prefix)
+        # with an attribute cache, paths through the syscall are taken
+        # on a miss only
+        cache_mark = len(strings)
+        full_paths = []
+        if not at_call:
+            if attrs & FULL_PATH:
+                full_paths.append(('fpath', 'path'))
+            if attrs & DOUBLE_FULL_PATH:
+                full_paths.append(('fnewpath', 'newpath'))
+            if attrs & HAS_LINK_FILE:
+                full_paths.append(('flink', 'link'))
+        for f_path, path in full_paths:
+            strings.append("    %sFullPath(%s, %s);" % (prefix, f_path, path))
+            if op_logging:
+                strings.append("    %sLogFullPath(%s, %s);" % (
+                    prefix, f_path, path))
         strings.append("")
 
         # -- SYS CALL -------------------------------------
 
+        call_mark = len(strings)
         sys_call = OP_CALL_MAP[name][0]
+        if at_call:
+            sys_call, at_args = AT_CALL_MAP[name]
+        if io_uring and name in ['read', 'write', 'fsync', ]:
+            sys_call = '%sRing%s' % (prefix, name.capitalize())
+        elif io_uring and name == 'release':
+            # so that no ring goes on using the file once fh is reused
+            strings.append('    %sRingForget(fi->fh);' % prefix)
         if sys_call == '':
-            if name != 'init':
+            if name == 'destroy' and (attr_cache or keep_cache):
+                if attr_cache:
+                    strings.append("    %sAttrReport();" % prefix)
+                if keep_cache:
+                    strings.append("    %sKeepCacheReport();" % prefix)
+            elif name == 'init':
+                strings += conn_init_lines(prefix, fuse_api, op_logging)
+            else:
                 strings.append("    // CURRENTLY A NO-OP\n")
         else:
-            if name == 'fallocate':
+            if name == 'write_buf':
+                # data spliced from the FUSE device goes straight to the file
+                strings.append("""\
+    dst.buf[0].flags = FUSE_BUF_IS_FD | FUSE_BUF_FD_SEEK;
+    dst.buf[0].fd    = fi->fh;
+    dst.buf[0].pos   = offset;
+    status = fuse_buf_copy(&dst, buf, FUSE_BUF_SPLICE_NONBLOCK);
+    if (status < 0) {{
+        errno  = -status;
+        status = {0:s}Error("{0:s}write_buf fuse_buf_copy");
+    }}
+""".format(prefix))
+            elif name == 'read_buf':
+                # FUSE reads the file itself, splicing it to the device
+                strings.append("""\
+    src = malloc(sizeof(struct fuse_bufvec));
+    if (src == NULL) {{
+        status = {0:s}Error("{0:s}read_buf malloc");
+    }} else {{
+        *src = FUSE_BUFVEC_INIT(size);
+        src->buf[0].flags = FUSE_BUF_IS_FD | FUSE_BUF_FD_SEEK;
+        src->buf[0].fd    = fi->fh;
+        src->buf[0].pos   = offset;
+        *bufp = src;
+    }}
+""".format(prefix))
+            elif name == 'rename' and fuse_api == 3:
+                # RENAME_EXCHANGE and RENAME_NOREPLACE are not passed on
+                if at_call:
+                    call = '%s(%s)' % (sys_call, at_args)
+                else:
+                    call = '%s(fpath, fnewpath)' % sys_call
+                strings.append("""\
+    if (flags) {
+        status = -1;
+        errno  = EINVAL;
+    } else
+        status = %s;""" % call)
+            elif at_call and at_args is not None:
+                if attrs & SYSCALL_RET_FD:
+                    strings.append("    fd = %s(%s);" % (sys_call, at_args))
+                else:
+                    strings.append("    status = %s(%s);" % (
+                        sys_call, at_args))
+            elif at_call and name == 'truncate':
+                # opening a FIFO for writing would block, and opening a
+                # device has side effects; truncate() by the /proc name of
+                # an O_PATH fd fails where truncate() by path would
+                strings.append("""\
+    fd = openat(rootfd, rpath, O_PATH);
+    if (fd == -1) {
+        status = -1;
+    } else {
+        snprintf(procname, 64, "/proc/self/fd/%d", fd);
+        status = truncate(procname, newsize);
+        close(fd);
+    }""")
+            elif name == 'fallocate':
+                # O_NONBLOCK so that opening a FIFO fails rather than blocks
+                if at_call:
+                    open_call = 'openat(rootfd, rpath, O_WRONLY | O_NONBLOCK)'
+                else:
+                    open_call = 'open(fpath, O_WRONLY | O_NONBLOCK)'
+                # the file is opened only if FUSE has no handle for it
                 strings.append("""
-    if (mode) {
+    if (fi != NULL)
+        fd = fi->fh;
+    else
+        fd = %s;
+    if (fd == -1) {
         status = -1;
-        errno  = EOPNOTSUPP;
     } else {
-        fd = open(fpath, O_WRONLY);
-        if (fd == -1) {
+#ifdef HAVE_FALLOCATE
+        // mode may punch a hole or keep the size
+        status = fallocate(fd, mode, offset, len);
+#else
+        // posix_fallocate() returns the error number, not setting errno
+        if (mode) {
+            status = -1;
+            errno  = EOPNOTSUPP;
+        } else if ((status = posix_fallocate(fd, offset, len)) != 0) {
+            errno  = status;
             status = -1;
-        } else {
-            status = posix_fallocate(fd, offset, len);
-            close(fd);
         }
+#endif
+        if (fi == NULL)
+            close(fd);
     }
-""")
+""" % open_call)
             elif name == 'flock':
                 strings.append('    status = flock(fi->fh, op);')
+            elif name == 'fsync' and io_uring:
+                strings.append(
+                    '    status = %s(fi->fh, datasync);' % sys_call)
             elif name == 'fsync':
                 strings.append(
                     """    // freebsd
@@ -1782,59 +5700,92 @@ struct fuse_operations {0:s}OpTable = {{
                     '&fi->lock_owner, sizeof(fi->lock_owner));')
 
             elif name == 'mknod':
+                if at_call:
+                    at_ = 'at'
+                    where = 'rootfd, rpath'
+                else:
+                    at_ = ''
+                    where = 'fpath'
                 # in python format specs {} must be doubled :-(
                 strings.append(
 
                     """    // ATTRIBUTION
     if (S_ISREG(mode)) {{
-        status = open(fpath, O_CREAT | O_EXCL | O_WRONLY, mode);
+        status = open{1:s}({2:s}, O_CREAT | O_EXCL | O_WRONLY, mode);
         if (status < 0)
-            status = {0:s}Error(\"{0:s}mknod open\");
+            status = {0:s}Error(\"{0:s}mknod open{1:s}\");
         else {{
             status = close(status);
             if (status < 0)
                 status = {0:s}Error(\"{0:s}mknod close\");
         }}
     }} else if (S_ISFIFO(mode)) {{
-        status = mkfifo(fpath, mode);
+        status = mkfifo{1:s}({2:s}, mode);
         if (status < 0)
-            status = {0:s}Error(\"{0:s}mknod mkfifo\");
+            status = {0:s}Error(\"{0:s}mknod mkfifo{1:s}\");
     }} else {{
-        status = mknod(fpath, mode, dev);
+        status = mknod{1:s}({2:s}, mode, dev);
         if (status < 0)
-            status = {0:s}Error(\"{0:s}mknod mknod\");
-    }}""".format(prefix))  # name, prefix) )
+            status = {0:s}Error(\"{0:s}mknod mknod{1:s}\");
+    }}""".format(prefix, at_, where))  # name, prefix) )
 
             elif name == 'open':
                 strings.append("    fd = %s(fpath, fi->flags);" % sys_call)
             elif name == 'readdir':
+                # Each entry is given to filler with the offset of the
+                # next, so that a listing too big for the buffer is
+                # resumed from there by the next call, and with what
+                # the entry itself says of the file's type.
                 content = """
-    entry = readdir(dp);
-    if (entry == 0) {{
-        status = {0:s}Error("{0:s}readdir readdir");
-        return status;
-    }}
-    do {{
-""".format(prefix)  # name, prefix)                     # BLIP
-                if logging:
+    // the kernel passes back the offset given with the last entry it took
+    if (telldir(dp) != offset)
+        seekdir(dp, offset);
+    errno = 0;
+    while ((entry = readdir(dp)) != NULL) {{
+"""
+                if op_logging:
                     content += """\
         {0:s}LogMsg("calling filler(%s)\\n", entry->d_name);
-""".format(prefix)          # name, prefix)                         # BLIP
-
-                content += """\
-        if (filler(buf, entry->d_name, NULL, 0) != 0) {{
-"""                         # .format(name, prefix)                     # BLIP
-                if logging:
+"""
+                if fuse_api == 3:
+                    # READDIRPLUS: the attributes go to the kernel with
+                    # the names, sparing a getattr per entry
                     content += """\
-            {0:s}LogMsg("    ERROR {0:s}readdir filler:  buffer full");
-""".format(prefix)              # name, prefix)
-
+        if ((flags & FUSE_READDIR_PLUS) && (fstatat(dirfd(dp),
+                    entry->d_name, &si, AT_SYMLINK_NOFOLLOW) == 0)) {{
+            fill = FUSE_FILL_DIR_PLUS;
+        }} else {{
+            memset(&si, 0, sizeof(si));
+            si.st_ino  = entry->d_ino;
+            si.st_mode = entry->d_type << 12;   // DTTOIF()
+            fill = 0;
+        }}
+        if (filler(buf, entry->d_name, &si, telldir(dp), fill) != 0)"""
+                else:
+                    content += """\
+        memset(&si, 0, sizeof(si));
+        si.st_ino  = entry->d_ino;
+        si.st_mode = entry->d_type << 12;       // DTTOIF()
+        if (filler(buf, entry->d_name, &si, telldir(dp)) != 0)"""
+                # when it is full the kernel asks again from there
+                if op_logging:
+                    content += """ {{
+            {0:s}LogMsg("    buffer full; resuming at %s\\n",
+                                                    entry->d_name);
+            break;
+        }}
+"""
+                else:
+                    content += """
+            break;
+"""
                 content += """\
-            return -ENOMEM;
-        }
-    } while ((entry = readdir(dp)) != NULL);
+        errno = 0;
+    }}
+    if ((entry == NULL) && (errno != 0))
+        status = {0:s}Error("{0:s}readdir readdir");
 """
-                strings.append(content)
+                strings.append(content.format(prefix))
 
             elif name == 'readlink':
                 strings.append("    status=readlink(fpath, link, size - 1);")
@@ -1858,17 +5809,31 @@ struct fuse_operations {0:s}OpTable = {{
                             strings.append(
                                 '    // FreeBSD special case; ATTRIBUTION')
                             strings.append('    if (!strcmp(path, "/")) {')
-                            strings.append('        char fpath[PATH_MAX];')
-                            strings.append("        " +
-                                           " %sFullPath(fpath, path);" %
-                                           prefix)
-                            strings.append("        status=lstat(fpath%s);" % (
-                                f_map.other_args()))
+                            if at_calls:
+                                strings.append(
+                                    '        status = fstatat(%s_DATA->rootfd,'
+                                    ' ".", statbuf,\n'
+                                    '                         '
+                                    'AT_SYMLINK_NOFOLLOW);' % uc_name)
+                            else:
+                                strings.append(
+                                    '        char fpath[PATH_MAX];')
+                                strings.append("        " +
+                                               " %sFullPath(fpath, path);" %
+                                               prefix)
+                                if op_logging:
+                                    strings.append(
+                                        "         %sLogFullPath(fpath, path);"
+                                        % prefix)
+                                strings.append(
+                                    "        status=lstat(fpath%s);" % (
+                                        f_map.other_args()))
                             strings.append('        if (status < 0)')
                             strings.append(
                                 "            status" +
-                                " = %sError(\"%sfgetattr lstat\");" % (
-                                    prefix, prefix))
+                                " = %sError(\"%sfgetattr %s\");" % (
+                                    prefix, prefix,
+                                    'fstatat' if at_calls else 'lstat'))
                             strings.append('    } else {')
                             strings.append("        status = %s(fi->fh%s);" % (
                                 sys_call, f_map.other_args()))
@@ -1878,6 +5843,13 @@ struct fuse_operations {0:s}OpTable = {{
                                 " %sError(\"%sfgetattr fstat\");" %
                                 (prefix, prefix))
                             strings.append('    }')
+                        elif name == 'opendir' and at_call:
+                            strings.append("""\
+    fd = openat(rootfd, rpath, O_RDONLY | O_DIRECTORY);
+    if (fd < 0)
+        dp = NULL;
+    else if ((dp = fdopendir(fd)) == NULL)
+        close(fd);""")
                         elif name == 'opendir':
                             strings.append('    dp = opendir(fpath);')
                         else:
@@ -1887,6 +5859,24 @@ struct fuse_operations {0:s}OpTable = {{
                         strings.append("    status = %s(fpath%s);" % (
                             (sys_call, f_map.other_args())))
 
+        if fuse_api == 3 and name in FH_CALL_MAP:
+            # FUSE 3 passes the open file, if there is one, to these
+            call = '\n'.join(strings[call_mark:]).strip('\n')
+            if '\n' in call:
+                call = call.replace('\n', '\n    ')
+                strings[call_mark:] = [
+                    '    if (fi != NULL) {',
+                    '        status = %s;' % FH_CALL_MAP[name],
+                    '    } else {',
+                    '    ' + call,
+                    '    }']
+            else:
+                strings[call_mark:] = [
+                    '    if (fi != NULL)',
+                    '        status = %s;' % FH_CALL_MAP[name],
+                    '    else',
+                    '    ' + call]
+
         # -- check for error status -----------------------
         if name == 'opendir':
             strings.append('    if (dp == NULL)')
@@ -1904,12 +5894,31 @@ struct fuse_operations {0:s}OpTable = {{
                 strings.append('        link[status] = \'\\0\';')
                 strings.append('        status = 0;')
                 strings.append('    }')
-        if logging and name in ['getxattr', ]:
+        if cache_attrs:
+            body = '\n'.join(strings[cache_mark:]).strip('\n').rstrip()
+            strings[cache_mark:] = [
+                '    status = %sAttrGet(path, statbuf, &ticket);' % prefix,
+                '    if (status < 0) {',
+                '\n'.join(('    ' + line) if line else line
+                          for line in body.split('\n')),
+                '        if (status == 0)',
+                '            %sAttrPut(path, statbuf, &ticket);' % prefix,
+                '    }',
+                '']
+        if attr_cache and name in ATTR_FORGET_OPS:
+            strings.append('    %sAttrForget(path);' % prefix)
+        elif attr_cache and name == 'open':
+            strings.append('    if (fi->flags & O_TRUNC)')
+            strings.append('        %sAttrForget(path);' % prefix)
+        elif attr_cache and name == 'rename':
+            strings.append('    %sAttrForgetAll();' % prefix)
+
+        if op_logging and name in ['getxattr', ]:
             strings.append('    else')
             start = '        %sLogMsg(' % prefix
             strings.append(start + '"    value=\\"%s\\"\\n", value);')
 
-        if logging and name == 'listxattr':
+        if op_logging and name == 'listxattr':
             start = '    %sLogMsg("    ' % prefix
             strings.append(
                 start + 'returned attributes (length %d):\\n", status);')
@@ -1919,7 +5928,7 @@ struct fuse_operations {0:s}OpTable = {{
             strings.append(start + '("    \\"%s\\"\\n", ptr);')
 
         # -- logging stat -----------------------------
-        if logging:
+        if op_logging:
             if attrs & LOGGING_STAT:
                 strings.append(
                     "    %sLogStat(%s);\n" %
@@ -1931,28 +5940,50 @@ struct fuse_operations {0:s}OpTable = {{
 
         if attrs & SET_FH_FROM_FD:
             strings.append('    fi->fh = fd;')
-            if logging:
+            if keep_cache and name == 'open':
+                strings.append('    if (fgKeepCache && (fd >= 0))')
+                strings.append(
+                    '        fi->keep_cache = %sKeepCache(fd);' % prefix)
+            if op_logging:
                 strings.append('    %sLogFI(fi);' % prefix)
         elif name == 'opendir':
             strings.append('    fi->fh = (intptr_t) dp;')
-            if logging:
+            if op_logging:
                 strings.append('    %sLogFI(fi);' % prefix)
-        elif logging and name == 'readdir':
+        elif op_logging and name == 'readdir':
             strings.append('    %sLogFI(fi);' % prefix)
 
         # -- instrumentation at exit ------------------
-        if instrumenting:
-            if name in ['readlink', 'read', 'write',
+        if op_timing:
+            if name in ['readlink', 'read', 'write', 'read_buf', 'write_buf',
                         'setxattr', 'getxattr', 'listxattr', ]:
-                strings.append(
-                    '    %sClockMeOut(&tEntry, myData, size);' %
-                    prefix)
+                count_arg = 'size'
             else:
-                strings.append(
-                    '    %sClockMeOut(&tEntry, myData, %s);' %
-                    (prefix, 0))
+                count_arg = '0'
+            offset_arg = 'offset' if 'offset' in f_map.p2t_map else '0'
+            fh_arg = 'fi->fh' if 'fi' in f_map.p2t_map else '0'
+            if fuse_api == 3 and name in ['chmod', 'chown', 'getattr',
+                                          'truncate', 'utimens', ]:
+                # FUSE 3 passes these a NULL fi unless the file is open
+                fh_arg = '(fi ? fi->fh : 0)'
+            elif name == 'fallocate':
+                # which opens the file itself if fi is NULL
+                fh_arg = '(fi ? fi->fh : 0)'
+            strings.append(
+                '    %sClockMeOut(&tEntry, myData, %s, %s, %s);' %
+                (prefix, count_arg, offset_arg, fh_arg))
+        if instrumenting:
             if name == 'destroy':
                 strings.append('\n    %sWriteBucket();' % prefix)
+            elif name == 'init' and inst_mode == 'flush':
+                strings.append('\n    %sStartBucketWriter();' % prefix)
+            elif name == 'init' and inst_mode == 'mmap':
+                strings.append('\n    %sMapBucketFile();' % prefix)
+        if async_log:
+            if name == 'init':
+                strings.append('\n    %sStartLogWriter();' % prefix)
+            elif name == 'destroy':
+                strings.append('\n    %sStopLogWriter();' % prefix)
 
         # -- return -----------------------------------
         if attrs & RETURNS_STATUS:
@@ -0,0 +1,157 @@
+# fusegen/binlog.py
+
+""" Read the binary logs written by fuseGenned file systems. """
+
+import re
+import struct
+from collections import namedtuple
+
+__all__ = ['LOG_MAGIC', 'LOG_REC_SIZE',
+           'LOG_START', 'LOG_STR', 'LOG_FMT', 'LOG_TEXT', 'LOG_NO_OP',
+           'LogRecord', 'LogRun',
+           'c_format', 'read_log', 'read_records', ]
+
+# Each entry in the log is a 64-byte head record followed by zero or more
+# 64-byte records which continue its payload.
+LOG_MAGIC = b'FGBINLOG'
+LOG_REC_SIZE = 64
+LOG_HEAD_FORMAT = '<BBHI'           # type, opCode, more, len
+LOG_HEAD_SIZE = struct.calcsize(LOG_HEAD_FORMAT)
+# the start entry: magic, version, recSize, realSec, realNsec, pid
+LOG_START_FORMAT = '<8sIIQII'
+
+# entry types
+LOG_START = 1           # begins each run of the file system
+LOG_STR = 2             # payload is an id, then the string
+LOG_FMT = 3             # payload is a format id, then len args
+LOG_TEXT = 4            # payload is text
+LOG_NO_OP = 0xff        # op_code of entries which do not log a call
+
+# A decoded entry.  length is the number of args in a LOG_FMT entry and
+# otherwise the number of bytes in the payload which are meaningful.
+LogRecord = namedtuple('LogRecord', ['type', 'op_code', 'length', 'payload'])
+
+# a printf conversion specification
+C_CONV_RE = re.compile(
+    r'%([-#0 +]*)(\d*)(?:\.(\d+))?(hh|h|ll|l|z|j)?([diouxXcs%])')
+C_LENGTH_BITS = {None: 32, 'hh': 8, 'h': 16, 'l': 64, 'll': 64,
+                 'z': 64, 'j': 64, }
+
+
+def c_format(fmt, args, strings=None):
+    """
+    Render fmt as the C library's printf() would, given its args as
+    unsigned 64-bit integers.  Each %s arg is the id of a string in
+    strings.
+    """
+    if strings is None:
+        strings = {}
+    args = iter(args)
+
+    def convert(match):
+        """ Render a single conversion. """
+        flags, width, precision, length, conv = match.groups()
+        if conv == '%':
+            return '%'
+        value = next(args, 0)
+        if conv == 's':
+            if value == 0:
+                value = '(null)'
+            else:
+                value = strings.get(value, '<string %d>' % value)
+        elif conv == 'c':
+            value = chr(value & 0xff)
+        else:
+            bits = C_LENGTH_BITS[length]
+            value &= (1 << bits) - 1
+            if conv in 'di' and value >> (bits - 1):
+                value -= 1 << bits
+            if conv in 'iu':
+                conv = 'd'
+        spec = '%' + flags + width
+        if precision is not None:
+            spec += '.' + precision
+        return (spec + conv) % value
+
+    return C_CONV_RE.sub(convert, fmt)
+
+
+class LogRun(object):
+    """ The entries logged by one run of the file system. """
+
+    def __init__(self, version=0, real_sec=0, real_nsec=0, pid=0):
+        self.version = version      # 0 if the LOG_START entry is missing
+        self.real_sec = real_sec    # when the log was opened
+        self.real_nsec = real_nsec
+        self.pid = pid
+        self.strings = {}           # id => string, including formats
+        self.records = []           # LogRecords other than LOG_STR
+
+    def lines(self):
+        """
+        Render each entry as the text log would have it.  Strings may be
+        logged after entries which refer to them, so this is done only
+        once the whole run has been read.
+        """
+        for rec in self.records:
+            if rec.type == LOG_FMT:
+                vals = struct.unpack_from('<%dQ' % (rec.length + 1),
+                                          rec.payload)
+                fmt_id, args = vals[0], vals[1:]
+                fmt = self.strings.get(fmt_id)
+                if fmt is None:
+                    yield '<format %d>%s\n' % (
+                        fmt_id, ''.join(' 0x%x' % arg for arg in args))
+                else:
+                    yield c_format(fmt, args, self.strings)
+            elif rec.type == LOG_TEXT:
+                yield rec.payload[:rec.length].decode('utf-8', 'replace')
+
+
+def read_records(data):
+    """
+    Yield each entry in data, a binary log, as a LogRecord.  An entry
+    cut short at the end of the data, as in a log still being written, is
+    ignored.
+    """
+    offset = 0
+    while offset + LOG_REC_SIZE <= len(data):
+        rtype, op_code, more, length = struct.unpack_from(
+            LOG_HEAD_FORMAT, data, offset)
+        end = offset + (1 + more) * LOG_REC_SIZE
+        if end > len(data):
+            break
+        yield LogRecord(rtype, op_code, length,
+                        data[offset + LOG_HEAD_SIZE:end])
+        offset = end
+
+
+def read_log(path):
+    """
+    Read the binary log at path.  Return a list of LogRuns, one for each
+    time the file system appended to the log.
+    """
+    with open(path, 'rb') as file:
+        data = file.read()
+
+    runs = []
+    run = None
+    for rec in read_records(data):
+        if rec.type == LOG_START:
+            magic, version, rec_size, real_sec, real_nsec, pid = \
+                struct.unpack_from(LOG_START_FORMAT, rec.payload)
+            if magic != LOG_MAGIC or rec_size != LOG_REC_SIZE:
+                raise ValueError("%s: not a fuseGen binary log" % path)
+            run = LogRun(version, real_sec, real_nsec, pid)
+            runs.append(run)
+            continue
+        if run is None:
+            run = LogRun()
+            runs.append(run)
+        if rec.type == LOG_STR:
+            str_id, = struct.unpack_from('<Q', rec.payload)
+            run.strings[str_id] = rec.payload[8:8 + rec.length].decode(
+                'utf-8', 'replace')
+        else:
+            run.records.append(rec)
+    return runs
@@ -0,0 +1,343 @@
+# fusegen/bucket.py
+
+""" Read the statistics files written by fuseGenned file systems. """
+
+import os
+import struct
+from collections import namedtuple
+
+from fusegen import OP_NAMES
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__all__ = ['BUCKET_MAGIC', 'CHUNK_RECS', 'HDR_CLOSED', 'REC_PASSTHROUGH',
+           'REC_SIZE', 'REC_SIZES', 'BucketHeader', 'OpRecord',
+           'check_header', 'count_ops', 'decode', 'decode_array',
+           'decode_v2', 'iter_bucket', 'open_bucket', 'overlapping',
+           'read_bucket', 'read_bucket_array', 'read_header', ]
+
+# Files written in mmap mode or with version 2 records begin with a
+# header; the others are bare arrays of version 1 records.
+BUCKET_MAGIC = b'FGBUCKET'
+HDR_CLOSED = 0x01           # set when the file system closed the file
+# the header: magic, version, hdrSize, recSize, flags, count, dropped
+HDR_FORMAT = '<8sIIIIQQ'
+# what version 2 adds to it: realSec, realNsec, opCount, monoSec,
+# monoNsec, reserved, buildFlags, opNames, sampleEvery, samplePerSec,
+# opCalls
+HDR_V2_FORMAT = '<QIIQII128s1024sII64Q'
+OP_NAME_LEN = 16
+
+REC_SIZE = 16               # sizeof(opData_t), version 1
+REC_V2_FORMAT = '<IIIIQQIIHHI'
+REC_SIZES = {1: REC_SIZE, 2: struct.calcsize(REC_V2_FORMAT), }
+REC_PASSTHROUGH = 0x0001    # an open or create the kernel passed through
+
+CHUNK_RECS = 65536          # records decoded at a time when streaming
+
+# A decoded record.  offset, fh, and tid are None in version 1 records.
+# weight is the number of calls the record stands for: 1 unless the file
+# system was sampling.  flags are REC_* bits, always 0 in version 1.
+OpRecord = namedtuple('OpRecord', ['sec', 'nsec', 'late_sec', 'late_n_sec',
+                                   'byte_count', 'op_code',
+                                   'offset', 'fh', 'tid', 'weight', 'flags'])
+
+if numpy is not None:
+    # Records as they lie on disk.  The last word of a version 1 record
+    # holds the lateSec and count bitfields and the opcode.
+    REC_DTYPES = {
+        1: numpy.dtype([('sec', '<u4'), ('nsec', '<u4'),
+                        ('late_n_sec', '<u4'), ('bits', '<u4'), ]),
+        2: numpy.dtype([('sec', '<u4'), ('nsec', '<u4'),
+                        ('late_sec', '<u4'), ('late_n_sec', '<u4'),
+                        ('offset', '<u8'), ('fh', '<u8'),
+                        ('byte_count', '<u4'), ('tid', '<u4'),
+                        ('op_code', '<u2'), ('flags', '<u2'),
+                        ('weight', '<u4'), ]),
+    }
+    # Decoded records, with the fields of an OpRecord; offset, fh, and tid
+    # are 0 in version 1 records.
+    OP_DTYPE = numpy.dtype([('sec', '<u4'), ('nsec', '<u4'),
+                            ('late_sec', '<u4'), ('late_n_sec', '<u4'),
+                            ('byte_count', '<u4'), ('op_code', '<u2'),
+                            ('offset', '<u8'), ('fh', '<u8'),
+                            ('tid', '<u4'), ('weight', '<u4'),
+                            ('flags', '<u2'), ])
+
+
+class BucketHeader(object):
+    """ The header of a statistics file, or a stand-in for one. """
+
+    def __init__(self, version=0, hdr_size=0, rec_size=REC_SIZE,
+                 flags=HDR_CLOSED, count=0, dropped=0):
+        self.version = version
+        self.hdr_size = hdr_size
+        self.rec_size = rec_size
+        self.flags = flags
+        self.count = count
+        self.dropped = dropped
+
+        # version 2 only
+        self.real_sec = 0
+        self.real_nsec = 0
+        self.mono_sec = 0
+        self.mono_nsec = 0
+        self.build_flags = ''
+        self.op_names = list(OP_NAMES)
+        self.sample_every = 0
+        self.sample_per_sec = 0
+        self.op_calls = None    # exact calls per opcode, if sampling
+
+    @property
+    def closed(self):
+        """ Whether the file system had finished writing the file. """
+        return bool(self.flags & HDR_CLOSED)
+
+    @property
+    def sampled(self):
+        """ Whether some calls went unrecorded by design. """
+        return self.sample_every > 1 or self.sample_per_sec > 0
+
+    @property
+    def rec_version(self):
+        """ The layout of the records; files without a header hold v1. """
+        return self.version if self.version else 1
+
+    @property
+    def real_offset(self):
+        """
+        The ns to add to a CLOCK_MONOTONIC time from a record to get ns
+        since the epoch, or None if the file does not relate the clocks.
+        """
+        if self.real_sec == 0:
+            return None
+        return (self.real_sec - self.mono_sec) * 1000000000 + \
+            self.real_nsec - self.mono_nsec
+
+    def to_realtime(self, sec, nsec):
+        """
+        Convert a CLOCK_MONOTONIC time from a record to seconds since the
+        epoch, or return None if the file does not relate the clocks.
+        """
+        if self.real_sec == 0:
+            return None
+        return (self.real_sec + sec - self.mono_sec) + \
+            (self.real_nsec + nsec - self.mono_nsec) / 1e9
+
+
+def read_header(data):
+    """
+    Return the BucketHeader at the front of data, or None if data does
+    not begin with one.
+    """
+    hdr_len = struct.calcsize(HDR_FORMAT)
+    if len(data) < hdr_len or data[:len(BUCKET_MAGIC)] != BUCKET_MAGIC:
+        return None
+    _, version, hdr_size, rec_size, flags, count, dropped = \
+        struct.unpack_from(HDR_FORMAT, data)
+    header = BucketHeader(version, hdr_size, rec_size, flags, count, dropped)
+
+    if version >= 2:
+        fields = struct.unpack_from(HDR_V2_FORMAT, data, hdr_len)
+        (header.real_sec, header.real_nsec, op_count,
+         header.mono_sec, header.mono_nsec, _,
+         build_flags, op_names,
+         header.sample_every, header.sample_per_sec) = fields[:10]
+        if any(fields[10:]):
+            header.op_calls = list(fields[10:10 + op_count])
+        header.build_flags = build_flags.split(b'\0')[0].decode('ascii')
+        header.op_names = []
+        for ndx in range(op_count):
+            name = op_names[ndx * OP_NAME_LEN:(ndx + 1) * OP_NAME_LEN]
+            header.op_names.append(name.split(b'\0')[0].decode('ascii'))
+    return header
+
+
+def decode(chunk):
+    """ Unpack one 16-byte version 1 record into an OpRecord. """
+    sec, nsec, late_n_sec, byte0, byte1, byte2, op_code = \
+        struct.unpack('IIIBBBB', chunk)
+    late_sec = 0x7f & byte0             # low-order 7 bits
+    low_bit = (byte0 >> 7) & 1          # high-order bit from that byte
+    higher_bits = (byte1 + (byte2 << 8)) << 1
+    byte_count = higher_bits | low_bit
+
+    return OpRecord(sec, nsec, late_sec, late_n_sec, byte_count, op_code,
+                    None, None, None, 1, 0)
+
+
+def decode_v2(chunk):
+    """ Unpack one version 2 record into an OpRecord. """
+    sec, nsec, late_sec, late_n_sec, offset, fh, byte_count, tid, \
+        op_code, flags, weight = struct.unpack(REC_V2_FORMAT, chunk)
+    return OpRecord(sec, nsec, late_sec, late_n_sec, byte_count, op_code,
+                    offset, fh, tid, max(weight, 1), flags)
+
+
+def check_header(path, data, file_size):
+    """
+    Return the header of the statistics file at path, which begins with
+    data and is file_size bytes long, and the number of records to read.
+    """
+    header = read_header(data)
+    if header is None:
+        header = BucketHeader(count=file_size // REC_SIZE)
+    if header.rec_size != REC_SIZES.get(header.rec_version):
+        raise ValueError("%s: unexpected record size %d for version %d" % (
+            path, header.rec_size, header.rec_version))
+
+    # the count may run ahead of the data on disk, or in a file still
+    # being written be zero
+    count = (file_size - header.hdr_size) // header.rec_size
+    if header.closed or header.count > 0:
+        count = min(count, header.count)
+    return header, max(count, 0)
+
+
+def open_bucket(path):
+    """
+    Read just the header of the statistics file at path.  Return the
+    header and the number of record slots to read.
+    """
+    hdr_len = struct.calcsize(HDR_FORMAT) + struct.calcsize(HDR_V2_FORMAT)
+    with open(path, 'rb') as file:
+        file_size = os.fstat(file.fileno()).st_size
+        return check_header(path, file.read(hdr_len), file_size)
+
+
+def iter_bucket(path, header, start, stop, arrays=False,
+                chunk_recs=CHUNK_RECS):
+    """
+    Decode record slots start up to stop of the statistics file at path,
+    whose header is header, chunk_recs slots at a time.  Yield each chunk
+    as a list of OpRecords or, if arrays is set, as an array of OP_DTYPE.
+    The file is read from the first slot wanted, and only a chunk at a
+    time is held in memory.
+
+    Slots which have been claimed but not yet filled in are skipped: the
+    time of the call is set when the call completes, so it is zero until
+    then.
+    """
+    if arrays and numpy is None:
+        raise ImportError("decoding a bucket into arrays needs numpy")
+    decoder = decode if header.rec_version == 1 else decode_v2
+    rec_size = header.rec_size
+    with open(path, 'rb') as file:
+        file.seek(header.hdr_size + start * rec_size)
+        for first in range(start, stop, chunk_recs):
+            count = min(chunk_recs, stop - first)
+            if arrays:
+                raw = numpy.fromfile(file, REC_DTYPES[header.rec_version],
+                                     count)
+                yield decode_array(raw, header.rec_version)
+                continue
+            data = file.read(count * rec_size)
+            ops = []
+            for begin in range(0, len(data) - rec_size + 1, rec_size):
+                op_ = decoder(data[begin:begin + rec_size])
+                if op_.sec == 0 and op_.nsec == 0:
+                    continue
+                ops.append(op_)
+            yield ops
+
+
+def decode_array(raw, rec_version):
+    """
+    Decode an array of records as they lie on disk into an array of
+    OP_DTYPE, a column at a time, dropping unfilled slots.
+    """
+    raw = raw[(raw['sec'] != 0) | (raw['nsec'] != 0)]
+    ops = numpy.zeros(len(raw), OP_DTYPE)
+    for name in ('sec', 'nsec', 'late_n_sec'):
+        ops[name] = raw[name]
+    if rec_version == 1:
+        bits = raw['bits']
+        ops['late_sec'] = bits & 0x7f               # low-order 7 bits
+        ops['byte_count'] = (bits >> 7) & 0x1ffff   # the next 17
+        ops['op_code'] = bits >> 24                 # the high-order byte
+        ops['weight'] = 1
+    else:
+        for name in ('late_sec', 'byte_count', 'op_code',
+                     'offset', 'fh', 'tid', 'flags'):
+            ops[name] = raw[name]
+        ops['weight'] = numpy.maximum(raw['weight'], 1)
+    return ops
+
+
+def read_bucket(path):
+    """
+    Read the statistics file at path, which may still be being written.
+    Return its header and a list of OpRecords, skipping unfilled slots.
+    """
+    header, count = open_bucket(path)
+    ops = []
+    for chunk in iter_bucket(path, header, 0, count):
+        ops.extend(chunk)
+    return header, ops
+
+
+def read_bucket_array(path):
+    """
+    Read the statistics file at path as read_bucket() does, but return
+    the records as a NumPy array of OP_DTYPE.  Requires NumPy.
+    """
+    if numpy is None:
+        raise ImportError("reading a bucket into an array needs numpy")
+    header, count = open_bucket(path)
+    chunks = list(iter_bucket(path, header, 0, count, arrays=True))
+    if not chunks:
+        return header, numpy.zeros(0, OP_DTYPE)
+    return header, numpy.concatenate(chunks)
+
+
+def count_ops(ops, op_count):
+    """
+    Given records from a statistics file, as a list of
+    OpRecords or an array, return two lists indexed by opcode: how many
+    records there are of each opcode, and how many calls they stand for.
+    """
+    if numpy is not None and isinstance(ops, numpy.ndarray):
+        recorded = numpy.bincount(ops['op_code'], minlength=op_count)
+        calls = numpy.bincount(ops['op_code'], minlength=op_count,
+                               weights=ops['weight'])
+        return recorded.tolist(), calls.astype(numpy.int64).tolist()
+
+    recorded = [0] * op_count
+    calls = [0] * op_count
+    for op_ in ops:
+        recorded[op_.op_code] += 1
+        calls[op_.op_code] += op_.weight
+    return recorded, calls
+
+
+def overlapping(ops, last=None):
+    """
+    Given records as a list of OpRecords or an array, return for each
+    whether it began in the same second as the one before, but before
+    that one finished: a sign that calls were running concurrently.
+    last, if not None, is the record before the first, as a tuple in
+    OpRecord order.
+    """
+    if numpy is not None and isinstance(ops, numpy.ndarray):
+        sec, nsec = ops['sec'], ops['nsec']
+        late_n_sec = ops['late_n_sec'].astype(numpy.int64)
+        overlaps = numpy.zeros(len(ops), bool)
+        overlaps[1:] = (sec[1:] == sec[:-1]) & \
+            (nsec[1:] < nsec[:-1] + late_n_sec[:-1])
+        if last is not None and len(ops):
+            overlaps[0] = sec[0] == last[0] and nsec[0] < last[1] + last[3]
+        return overlaps.tolist()
+
+    overlaps = []
+    last_sec = last_n_sec = last_late_n_sec = 0
+    if last is not None:
+        last_sec, last_n_sec, last_late_n_sec = last[0], last[1], last[3]
+    for op_ in ops:
+        overlaps.append(op_.sec == last_sec and
+                        op_.nsec < last_n_sec + last_late_n_sec)
+        last_sec, last_n_sec, last_late_n_sec = \
+            op_.sec, op_.nsec, op_.late_n_sec
+    return overlaps
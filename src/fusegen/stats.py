@@ -0,0 +1,410 @@
+# fusegen/stats.py
+
+""" Summarize the calls recorded in fuseGenned statistics files. """
+
+from itertools import groupby
+from operator import itemgetter
+
+from fusegen.bucket import iter_bucket, numpy
+
+__all__ = ['BILLION', 'HIST_BUCKETS', 'PERCENTILES', 'OpStats', 'TimeSeries',
+           'format_ns', 'hist_bucket', 'hist_floor', 'summarize', ]
+
+BILLION = 1000000000
+
+# Latencies are counted in a log-linear histogram: each power of two is
+# split into 2**SUB_BITS buckets, so a bucket is at most 1/32 of the
+# latencies it holds wide.  Latencies below 2**(SUB_BITS + 1) ns have a
+# bucket each.
+SUB_BITS = 5
+SUB_BUCKETS = 1 << SUB_BITS
+HIST_BUCKETS = (65 - SUB_BITS) * SUB_BUCKETS    # any 64-bit latency
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+def hist_bucket(nsec):
+    """ Return the index of the histogram bucket for a latency in ns. """
+    shift = max(nsec.bit_length() - SUB_BITS - 1, 0)
+    return shift * SUB_BUCKETS + (nsec >> shift)
+
+
+def hist_floor(ndx):
+    """ Return the least latency in ns that falls in bucket ndx. """
+    if ndx < 2 * SUB_BUCKETS:
+        return ndx
+    shift = ndx // SUB_BUCKETS - 1
+    return (SUB_BUCKETS + ndx % SUB_BUCKETS) << shift
+
+
+def format_ns(nsec):
+    """ Render a time in ns with a unit that suits it. """
+    for unit, scale in (('s', BILLION), ('ms', 1000000), ('us', 1000)):
+        if nsec >= scale:
+            return "%.3g %s" % (nsec / scale, unit)
+    return "%d ns" % nsec
+
+
+class OpStats(object):
+    """
+    Calls, latencies, and bytes by opcode, accumulated from records a
+    chunk at a time.  Counts are weighted by the calls each record stands
+    for.  offset is added to the time of each call, as in TimeSeries, so
+    that the spans of files on different clocks can be merged.
+    """
+
+    def __init__(self, op_count, offset=0):
+        self.op_count = op_count
+        self.offset = offset
+        self.recorded = [0] * op_count
+        self.calls = [0] * op_count
+        self.total_ns = [0] * op_count
+        self.max_ns = [0] * op_count
+        self.byte_count = [0] * op_count
+        self.hist = [[0] * HIST_BUCKETS for _ in range(op_count)]
+        self.first_ns = None            # when the earliest call began
+        self.last_ns = None             # when the latest call ended
+
+    def add(self, ops):
+        """ Add records given as a list of OpRecords or an array. """
+        if numpy is not None and isinstance(ops, numpy.ndarray):
+            self._add_array(ops)
+            return
+        for op_ in ops:
+            op_code, weight = op_.op_code, op_.weight
+            late_ns = op_.late_sec * BILLION + op_.late_n_sec
+            begin = op_.sec * BILLION + op_.nsec + self.offset
+            self.recorded[op_code] += 1
+            self.calls[op_code] += weight
+            self.total_ns[op_code] += late_ns * weight
+            self.max_ns[op_code] = max(self.max_ns[op_code], late_ns)
+            self.byte_count[op_code] += op_.byte_count * weight
+            self.hist[op_code][hist_bucket(late_ns)] += weight
+            self._add_span(begin, begin + late_ns)
+
+    def _add_array(self, ops):
+        """ Add an array of records, a column at a time. """
+        if len(ops) == 0:
+            return
+        op_code = ops['op_code'].astype(numpy.int64)
+        weight = ops['weight'].astype(numpy.int64)
+        late_ns = ops['late_sec'].astype(numpy.int64) * BILLION + \
+            ops['late_n_sec']
+        begin = ops['sec'].astype(numpy.int64) * BILLION + ops['nsec'] + \
+            self.offset
+
+        # the bucket index of each latency, as hist_bucket() computes it;
+        # frexp() gives the bit length of the latency as its exponent
+        bits = numpy.frexp(late_ns.astype(numpy.float64))[1]
+        shift = numpy.maximum(bits - SUB_BITS - 1, 0)
+        ndx = shift * SUB_BUCKETS + (late_ns >> shift)
+
+        sums = {}
+        for name, values in (('recorded', numpy.ones_like(weight)),
+                             ('calls', weight),
+                             ('total_ns', late_ns * weight),
+                             ('byte_count', ops['byte_count'] * weight)):
+            sums[name] = numpy.zeros(self.op_count, numpy.int64)
+            numpy.add.at(sums[name], op_code, values)
+        maxes = numpy.zeros(self.op_count, numpy.int64)
+        numpy.maximum.at(maxes, op_code, late_ns)
+        hist = numpy.zeros(self.op_count * HIST_BUCKETS, numpy.int64)
+        numpy.add.at(hist, op_code * HIST_BUCKETS + ndx, weight)
+
+        for code in numpy.flatnonzero(sums['recorded']).tolist():
+            for name, values in sums.items():
+                getattr(self, name)[code] += int(values[code])
+            self.max_ns[code] = max(self.max_ns[code], int(maxes[code]))
+            counts = hist[code * HIST_BUCKETS:(code + 1) * HIST_BUCKETS]
+            op_hist = self.hist[code]
+            for bucket in numpy.flatnonzero(counts).tolist():
+                op_hist[bucket] += int(counts[bucket])
+        self._add_span(int(begin.min()), int((begin + late_ns).max()))
+
+    def _add_span(self, begin, end):
+        """ Widen the span of time the calls cover. """
+        if self.first_ns is None or begin < self.first_ns:
+            self.first_ns = begin
+        if self.last_ns is None or end > self.last_ns:
+            self.last_ns = end
+
+    def merge(self, other):
+        """ Add the counts from another OpStats. """
+        for code in range(self.op_count):
+            self.recorded[code] += other.recorded[code]
+            self.calls[code] += other.calls[code]
+            self.total_ns[code] += other.total_ns[code]
+            self.max_ns[code] = max(self.max_ns[code], other.max_ns[code])
+            self.byte_count[code] += other.byte_count[code]
+            op_hist = self.hist[code]
+            for bucket, count in enumerate(other.hist[code]):
+                op_hist[bucket] += count
+        if other.first_ns is not None:
+            self._add_span(other.first_ns, other.last_ns)
+
+    @property
+    def span_ns(self):
+        """ The ns from the start of the first call to the end of the last. """
+        if self.first_ns is None:
+            return 0
+        return self.last_ns - self.first_ns
+
+    def mean_ns(self, op_code):
+        """ The mean latency of calls of op_code, in ns. """
+        if self.calls[op_code] == 0:
+            return 0
+        return self.total_ns[op_code] / self.calls[op_code]
+
+    def percentile(self, op_code, pct):
+        """
+        Return a latency in ns which pct percent of calls of op_code did
+        not exceed: the top of the histogram bucket the percentile falls
+        in, or the greatest latency if that is less.
+        """
+        wanted = self.calls[op_code] * pct / 100.0
+        seen = 0
+        for ndx, count in enumerate(self.hist[op_code]):
+            seen += count
+            if count and seen >= wanted:
+                return min(hist_floor(ndx + 1) - 1, self.max_ns[op_code])
+        return self.max_ns[op_code]
+
+    def histogram(self, op_code):
+        """
+        Return the calls of op_code by powers of two of latency, as a
+        list of (least ns, calls) from the least power with any calls to
+        the greatest.
+        """
+        by_power = [0] * 65
+        for ndx, count in enumerate(self.hist[op_code]):
+            if count:
+                by_power[hist_floor(ndx).bit_length()] += count
+        used = [power for power, count in enumerate(by_power) if count]
+        if not used:
+            return []
+        return [((1 << power) >> 1, by_power[power])
+                for power in range(used[0], used[-1] + 1)]
+
+
+class TimeSeries(object):
+    """
+    Calls, bytes, and latency by opcode in windows of window_ns, and how
+    many calls were in flight, accumulated from records a chunk at a
+    time.  A call is counted in the window in which it began.  Windows
+    are numbered from origin, by default the start of the first call
+    added.  offset is added to the time of each call, to put calls from
+    several files on one clock.
+    """
+
+    def __init__(self, op_count, window_ns, origin=None, offset=0):
+        self.op_count = op_count
+        self.window_ns = window_ns
+        self.origin = origin
+        self.offset = offset
+        self.by_op = {}         # (window, op_code) -> [calls, bytes, ns]
+        self.busy_ns = {}       # window -> ns spent in calls, summed
+        self.spans = []         # (begins, ends) of calls, a chunk each
+        self._peaks = None
+
+    def window(self, nsec):
+        """ Return the number of the window holding time nsec. """
+        return (nsec - self.origin) // self.window_ns
+
+    def add(self, ops):
+        """ Add records given as a list of OpRecords or an array. """
+        self._peaks = None
+        if numpy is not None and isinstance(ops, numpy.ndarray):
+            self._add_array(ops)
+            return
+        begins, ends = [], []
+        for op_ in ops:
+            weight = op_.weight
+            late_ns = op_.late_sec * BILLION + op_.late_n_sec
+            begin = op_.sec * BILLION + op_.nsec + self.offset
+            if self.origin is None:
+                self.origin = begin
+            sums = self.by_op.setdefault(
+                (self.window(begin), op_.op_code), [0, 0, 0])
+            sums[0] += weight
+            sums[1] += op_.byte_count * weight
+            sums[2] += late_ns * weight
+            if late_ns:
+                self._add_busy(begin, begin + late_ns, weight)
+                begins.append(begin)
+                ends.append(begin + late_ns)
+        self.spans.append((begins, ends))
+
+    def _add_array(self, ops):
+        """ Add an array of records, a column at a time. """
+        if len(ops) == 0:
+            return
+        op_code = ops['op_code'].astype(numpy.int64)
+        weight = ops['weight'].astype(numpy.int64)
+        late_ns = ops['late_sec'].astype(numpy.int64) * BILLION + \
+            ops['late_n_sec']
+        begin = ops['sec'].astype(numpy.int64) * BILLION + ops['nsec'] + \
+            self.offset
+        if self.origin is None:
+            self.origin = int(begin[0])
+
+        # sums by window and opcode
+        first = self.window(begin)
+        keys, inverse = numpy.unique(first * self.op_count + op_code,
+                                     return_inverse=True)
+        columns = []
+        for values in (weight, ops['byte_count'] * weight,
+                       late_ns * weight):
+            sums = numpy.zeros(len(keys), numpy.int64)
+            numpy.add.at(sums, inverse, values)
+            columns.append(sums.tolist())
+        for key, calls, count, nsec in zip(keys.tolist(), *columns):
+            sums = self.by_op.setdefault(divmod(key, self.op_count),
+                                         [0, 0, 0])
+            sums[0] += calls
+            sums[1] += count
+            sums[2] += nsec
+        timed = late_ns > 0
+        begin, late_ns = begin[timed], late_ns[timed]
+        first, weight = first[timed], weight[timed]
+
+        # time in flight, by window; few calls span windows
+        end = begin + late_ns
+        last = self.window(end - 1)
+        within = first == last
+        wins, inverse = numpy.unique(first[within], return_inverse=True)
+        busy = numpy.zeros(len(wins), numpy.int64)
+        numpy.add.at(busy, inverse, late_ns[within] * weight[within])
+        for win, nsec in zip(wins.tolist(), busy.tolist()):
+            self.busy_ns[win] = self.busy_ns.get(win, 0) + nsec
+        for ndx in numpy.flatnonzero(~within).tolist():
+            self._add_busy(int(begin[ndx]), int(end[ndx]), int(weight[ndx]))
+        self.spans.append((begin, end))
+
+    def _add_busy(self, begin, end, weight):
+        """ Add a call from begin up to end to the windows it spans. """
+        for win in range(self.window(begin), self.window(end - 1) + 1):
+            win_begin = self.origin + win * self.window_ns
+            overlap = min(end, win_begin + self.window_ns) - \
+                max(begin, win_begin)
+            self.busy_ns[win] = self.busy_ns.get(win, 0) + overlap * weight
+
+    def merge(self, other):
+        """ Add the windows of another TimeSeries with the same origin. """
+        self._peaks = None
+        for key, sums in other.by_op.items():
+            mine = self.by_op.setdefault(key, [0, 0, 0])
+            for ndx in range(3):
+                mine[ndx] += sums[ndx]
+        for win, nsec in other.busy_ns.items():
+            self.busy_ns[win] = self.busy_ns.get(win, 0) + nsec
+        self.spans.extend(other.spans)
+
+    def windows(self):
+        """
+        Return the numbers of the windows from the first in which a call
+        began to the last, including any in which none did.
+        """
+        used = [win for win, _ in self.by_op]
+        if not used:
+            return range(0)
+        return range(min(used), max(used) + 1)
+
+    def sums(self, win, op_code):
+        """ Return calls, bytes, and ns of latency of op_code in win. """
+        return tuple(self.by_op.get((win, op_code), (0, 0, 0)))
+
+    def mean_in_flight(self, win):
+        """ The mean number of calls in flight during window win. """
+        return self.busy_ns.get(win, 0) / self.window_ns
+
+    def peak_in_flight(self, win):
+        """
+        The most calls in flight at once during window win.  Unlike the
+        other figures this counts records, not weighted calls.
+        """
+        if self._peaks is None:
+            self._peaks = self._sweep()
+        return self._peaks.get(win, 0)
+
+    def _sweep(self):
+        """
+        Sweep over the starts and ends of the calls in time order, and
+        return the most calls in flight at once in each window.  A call
+        is in flight from its start up to, but not including, its end.
+        """
+        if self.origin is None:
+            return {}
+        # Only the level after the last event at a given time is real: a
+        # call ending just as another starts does not overlap it.  A
+        # window's peak counts the level it opens with unless an event
+        # falls on its first nanosecond, and a window with no events
+        # stays at that level throughout.
+        peaks, closing = {}, {}
+        if numpy is not None:
+            begins = [numpy.asarray(b, numpy.int64) for b, _ in self.spans]
+            ends = [numpy.asarray(e, numpy.int64) for _, e in self.spans]
+            times = numpy.concatenate(
+                begins + ends + [numpy.zeros(0, numpy.int64)])
+            steps = numpy.ones(len(times), numpy.int64)
+            steps[sum(len(b) for b in begins):] = -1
+            order = numpy.lexsort((steps, times))
+            times = times[order]
+            levels = numpy.cumsum(steps[order])
+            final = numpy.append(times[1:] != times[:-1], True)
+            times, levels = times[final], levels[final]
+            wins = self.window(times)
+            if len(wins):
+                # the times in each window are a run in the sorted order
+                starts = numpy.concatenate(
+                    ([0], numpy.flatnonzero(numpy.diff(wins)) + 1))
+                opening = numpy.concatenate(([0], levels[starts[1:] - 1]))
+                late = self.window(times[starts] - 1) == wins[starts]
+                highs = numpy.maximum.reduceat(levels, starts)
+                highs[late] = numpy.maximum(highs[late], opening[late])
+                lasts = levels[numpy.append(starts[1:], len(levels)) - 1]
+                run_wins = wins[starts].tolist()
+                peaks = dict(zip(run_wins, highs.tolist()))
+                closing = dict(zip(run_wins, lasts.tolist()))
+        else:
+            events = sorted([(t, 1) for b, _ in self.spans for t in b] +
+                            [(t, -1) for _, e in self.spans for t in e])
+            level = 0
+            for when, group in groupby(events, key=itemgetter(0)):
+                opening = level
+                level += sum(step for _, step in group)
+                win = self.window(when)
+                if win not in peaks:
+                    late = self.window(when - 1) == win
+                    peaks[win] = opening if late else level
+                peaks[win] = max(peaks[win], level)
+                closing[win] = level
+        level = 0
+        for win in self.windows():
+            if win in closing:
+                level = closing[win]
+            else:
+                peaks[win] = level
+        return peaks
+
+
+def summarize(job):
+    """
+    Decode records start up to stop of a statistics file, and return an
+    OpStats of them and, if window_ns is not 0, a TimeSeries.  The
+    arguments come as one tuple,
+
+        (path, header, start, stop, arrays, window_ns, origin, offset)
+
+    so that files can be handed to Pool.map(); see iter_bucket() and
+    TimeSeries for what they mean.
+    """
+    path, header, start, stop, arrays, window_ns, origin, offset = job
+    stats = OpStats(len(header.op_names), offset)
+    series = None
+    if window_ns:
+        series = TimeSeries(len(header.op_names), window_ns, origin, offset)
+    for chunk in iter_bucket(path, header, start, stop, arrays):
+        stats.add(chunk)
+        if series is not None:
+            series.add(chunk)
+    return stats, series
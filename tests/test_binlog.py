@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+
+# fusegen/test_binlog.py
+
+""" Test reading fuseGenned binary logs. """
+
+import os
+import struct
+import tempfile
+import unittest
+
+from fusegen.binlog import (LOG_FMT, LOG_MAGIC, LOG_NO_OP, LOG_REC_SIZE,
+                            LOG_START, LOG_STR, LOG_TEXT,
+                            c_format, read_log)
+
+
+def pack_entry(rtype, op_code, length, payload):
+    """ Pack an entry as a head record and as many more as it needs. """
+    spill = max(len(payload) - (LOG_REC_SIZE - 8), 0)
+    more = (spill + LOG_REC_SIZE - 1) // LOG_REC_SIZE
+    data = struct.pack('<BBHI', rtype, op_code, more, length) + payload
+    return data + b'\0' * ((1 + more) * LOG_REC_SIZE - len(data))
+
+
+def pack_start(pid=1234):
+    """ Pack the LOG_START entry which begins each run. """
+    payload = struct.pack('<8sIIQII', LOG_MAGIC, 1, LOG_REC_SIZE,
+                          1500000000, 0, pid)
+    return pack_entry(LOG_START, LOG_NO_OP, len(payload), payload)
+
+
+def pack_str(str_id, text):
+    """ Pack a LOG_STR entry. """
+    text = text.encode('utf-8')
+    return pack_entry(LOG_STR, LOG_NO_OP, len(text),
+                      struct.pack('<Q', str_id) + text)
+
+
+def pack_fmt(op_code, fmt_id, *args):
+    """ Pack a LOG_FMT entry. """
+    return pack_entry(LOG_FMT, op_code, len(args),
+                      struct.pack('<%dQ' % (1 + len(args)), fmt_id, *args))
+
+
+def pack_text(text):
+    """ Pack a LOG_TEXT entry. """
+    text = text.encode('utf-8')
+    return pack_entry(LOG_TEXT, LOG_NO_OP, len(text), text)
+
+
+class TestBinLog(unittest.TestCase):
+    """ Test reading fuseGenned binary logs. """
+
+    def setUp(self):
+        fd_, self.path = tempfile.mkstemp()
+        os.close(fd_)
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    # utility functions #############################################
+
+    def write(self, data):
+        """ Replace the contents of the test file. """
+        with open(self.path, 'wb') as file:
+            file.write(data)
+
+    # actual unit tests #############################################
+
+    def test_c_format(self):
+        """ Verify that args are rendered with the widths C gives them. """
+        self.assertEqual(
+            c_format('%d %d %lld', [2**64 - 1, 2**32 + 5, 2**64 - 1]),
+            '-1 5 -1')
+        self.assertEqual(c_format('0x%08x 0x%08lx', [0x123456789, 0x12]),
+                         '0x23456789 0x00000012')
+        self.assertEqual(c_format('0%o %05o %u%%', [0o644, 0o22, 7]),
+                         '0644 00022 7%')
+        self.assertEqual(c_format('"%s" "%s" "%s"', [0, 3, 4], {3: 'abc'}),
+                         '"(null)" "abc" "<string 4>"')
+
+    def test_read_log(self):
+        """
+        Strings may follow entries which use them, payloads may span
+        records, and an entry cut short at the end is ignored.
+        """
+        fmt = '\nxxx_read(path="%s", size=%lld, offset=%lld)\n'
+        long_path = '/' + 'x' * 200
+        self.write(pack_start() +
+                   pack_str(1, fmt) +
+                   pack_fmt(15, 1, 2, 4096, 8192) +
+                   pack_text('    ERROR xxx_read pread: No such file\n') +
+                   pack_str(2, long_path) +
+                   pack_fmt(15, 1, 3, 10, 0) +
+                   pack_str(3, '/b') +
+                   pack_str(4, long_path)[:LOG_REC_SIZE])
+        runs = read_log(self.path)
+        self.assertEqual(len(runs), 1)
+        self.assertEqual(runs[0].pid, 1234)
+        self.assertEqual(runs[0].strings[2], long_path)
+        self.assertEqual(list(runs[0].lines()), [
+            '\nxxx_read(path="%s", size=4096, offset=8192)\n' % long_path,
+            '    ERROR xxx_read pread: No such file\n',
+            '\nxxx_read(path="/b", size=10, offset=0)\n', ])
+
+    def test_runs(self):
+        """ Each run appended to the log numbers its strings afresh. """
+        self.write(pack_start(1) + pack_str(1, 'first %d\n') +
+                   pack_fmt(LOG_NO_OP, 1, 1) +
+                   pack_start(2) + pack_str(1, 'second %d\n') +
+                   pack_fmt(LOG_NO_OP, 1, 2))
+        runs = read_log(self.path)
+        self.assertEqual([run.pid for run in runs], [1, 2])
+        self.assertEqual([list(run.lines()) for run in runs],
+                         [['first 1\n'], ['second 2\n']])
+
+
+if __name__ == '__main__':
+    unittest.main()
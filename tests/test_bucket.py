@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+
+# fusegen/test_bucket.py
+
+""" Test reading fuseGenned statistics files. """
+
+import os
+import struct
+import tempfile
+import unittest
+
+from fusegen import OP_NAMES
+from fusegen.bucket import (BUCKET_MAGIC, HDR_CLOSED, REC_PASSTHROUGH,
+                            REC_SIZE, REC_SIZES, count_ops, decode,
+                            iter_bucket, numpy, open_bucket, overlapping,
+                            read_bucket, read_bucket_array)
+from fusegen.stats import BILLION, OpStats, summarize
+
+
+def pack_op(sec, nsec, late_sec, late_n_sec, byte_count, op_code):
+    """ Pack a record the way the generated C bitfields lay it out. """
+    byte0 = (late_sec & 0x7f) | ((byte_count & 1) << 7)
+    byte1 = (byte_count >> 1) & 0xff
+    byte2 = (byte_count >> 9) & 0xff
+    return struct.pack('IIIBBBB', sec, nsec, late_n_sec,
+                       byte0, byte1, byte2, op_code)
+
+
+def pack_op_v2(sec, nsec, late_sec, late_n_sec, byte_count, op_code,
+               offset, fh, tid, weight=1, flags=0):
+    """ Pack a version 2 record. """
+    return struct.pack('<IIIIQQIIHHI', sec, nsec, late_sec, late_n_sec,
+                       offset, fh, byte_count, tid, op_code, flags, weight)
+
+
+def pack_header(count, flags=0, dropped=0, hdr_size=4096, version=1,
+                sample_every=0, op_calls=None, mono_sec=100):
+    """
+    Pack a header padded to hdr_size bytes.  A version 2 header says
+    the file system started at 1500000000.25 s since the epoch, when
+    CLOCK_MONOTONIC read mono_sec + 0.75.
+    """
+    hdr = struct.pack('<8sIIIIQQ', BUCKET_MAGIC, version, hdr_size,
+                      REC_SIZES[version], flags, count, dropped)
+    if version >= 2:
+        names = b''.join(
+            struct.pack('16s', name.encode('ascii')) for name in OP_NAMES)
+        calls = op_calls or [0] * 64
+        hdr += struct.pack('<QIIQII128s1024sII64Q', 1500000000, 250000000,
+                           len(OP_NAMES), mono_sec, 750000000, 0,
+                           b'inst_mode=mmap rec_version=2', names,
+                           sample_every, 0, *calls)
+    return hdr + b'\0' * (hdr_size - len(hdr))
+
+
+class TestBucket(unittest.TestCase):
+    """ Test reading fuseGenned statistics files. """
+
+    def setUp(self):
+        fd_, self.path = tempfile.mkstemp()
+        os.close(fd_)
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    # utility functions #############################################
+
+    def write(self, data):
+        """ Replace the contents of the test file. """
+        with open(self.path, 'wb') as file:
+            file.write(data)
+
+    def check_array(self):
+        """
+        Verify that reading the test file into an array gives the same
+        header and records as reading it record by record.
+        """
+        header, ops = read_bucket(self.path)
+        a_header, a_ops = read_bucket_array(self.path)
+        self.assertEqual(vars(a_header), vars(header))
+        self.assertEqual(len(a_ops), len(ops))
+        for row, op_ in zip(a_ops.tolist(), ops):
+            if header.rec_version == 1:
+                self.assertEqual(row[6:9], (0, 0, 0))
+                op_ = op_[:6] + row[6:9] + op_[9:]
+            self.assertEqual(row, tuple(op_))
+        self.assertEqual(count_ops(a_ops, len(OP_NAMES)),
+                         count_ops(ops, len(OP_NAMES)))
+        self.assertEqual(overlapping(a_ops), overlapping(ops))
+        return a_header, a_ops
+
+    # actual unit tests #############################################
+
+    def test_decode(self):
+        """ Verify that every field survives packing and unpacking. """
+        fields = (1234, 999999999, 127, 5, 131071, 16)
+        self.assertEqual(decode(pack_op(*fields))[:6], fields)
+
+    def test_headerless(self):
+        """ Files written by WriteBucket are bare arrays of records. """
+        recs = [(10, ndx, 0, 100, ndx, ndx) for ndx in range(1, 6)]
+        self.write(b''.join(pack_op(*r) for r in recs))
+        header, ops = read_bucket(self.path)
+        self.assertEqual(header.version, 0)
+        self.assertTrue(header.closed)
+        self.assertEqual([op_[:6] for op_ in ops], recs)
+
+    def test_closed(self):
+        """ A cleanly closed mapped file holds exactly count records. """
+        recs = [(10, ndx, 0, 100, ndx, ndx) for ndx in range(1, 4)]
+        self.write(pack_header(3, HDR_CLOSED, dropped=7) +
+                   b''.join(pack_op(*r) for r in recs))
+        header, ops = read_bucket(self.path)
+        self.assertEqual(header.version, 1)
+        self.assertTrue(header.closed)
+        self.assertEqual(header.dropped, 7)
+        self.assertIsNone(header.real_offset)
+        self.assertEqual([op_[:6] for op_ in ops], recs)
+
+    def test_in_progress(self):
+        """
+        A file still being written may have unfilled slots, and slots
+        claimed beyond the end of the data.
+        """
+        recs = [(10, 1, 0, 100, 1, 1), (10, 3, 0, 100, 3, 3)]
+        unfilled = pack_op(0, 0, 0, 0, 0, 2)    # opCode set at entry
+        data = pack_op(*recs[0]) + unfilled + pack_op(*recs[1])
+        self.write(pack_header(100) + data + b'\0' * REC_SIZE)
+        header, ops = read_bucket(self.path)
+        self.assertFalse(header.closed)
+        self.assertEqual(header.count, 100)
+        self.assertEqual([op_[:6] for op_ in ops], recs)
+
+    def test_v2(self):
+        """
+        Version 2 records hold full-width counts and latencies, and the
+        header names the opcodes and relates the clocks.
+        """
+        recs = [(100, 5, 3, 7, 1 << 20, 16, 1 << 40, 9, 1234, 1, 0),
+                (101, 0, 400, 0, 0, 20, 0, 9, 1235, 1, REC_PASSTHROUGH)]
+        self.write(pack_header(2, HDR_CLOSED, version=2) +
+                   b''.join(pack_op_v2(*r) for r in recs))
+        header, ops = read_bucket(self.path)
+        self.assertEqual(header.rec_version, 2)
+        self.assertFalse(header.sampled)
+        self.assertIsNone(header.op_calls)
+        self.assertEqual(header.op_names, OP_NAMES)
+        self.assertEqual(header.build_flags, 'inst_mode=mmap rec_version=2')
+        self.assertEqual(ops, recs)
+        self.assertEqual(ops[0].offset, 1 << 40)
+        self.assertEqual(ops[1].flags, REC_PASSTHROUGH)
+        self.assertAlmostEqual(header.to_realtime(ops[1].sec, ops[1].nsec),
+                               1500000000.5)
+        # 1500000000.25 s since the epoch when CLOCK_MONOTONIC read 100.75
+        self.assertEqual(header.real_offset,
+                         (1500000000 - 100) * BILLION - 500000000)
+
+    def test_sampled(self):
+        """
+        A sampling file system weights each record by the calls it stands
+        for, and keeps exact counts of calls in the header.
+        """
+        calls = [0] * 64
+        calls[15] = 25
+        recs = [(100, 5, 0, 7, 4096, 15, 0, 9, 1234, 10),
+                (101, 5, 0, 7, 4096, 15, 0, 9, 1234, 10)]
+        self.write(pack_header(2, HDR_CLOSED, version=2, sample_every=10,
+                               op_calls=calls) +
+                   b''.join(pack_op_v2(*r) for r in recs))
+        header, ops = read_bucket(self.path)
+        self.assertTrue(header.sampled)
+        self.assertEqual(header.sample_every, 10)
+        self.assertEqual(header.op_calls, calls[:len(OP_NAMES)])
+        self.assertEqual(sum(op_.weight for op_ in ops), 20)
+
+    def test_windows(self):
+        """
+        A window of slots is decoded a chunk at a time, starting at its
+        first slot, and skips unfilled slots.
+        """
+        recs = [(10, ndx, 0, 100, ndx, ndx % 40) for ndx in range(1, 101)]
+        data = [pack_op(*r) for r in recs]
+        data[50] = pack_op(0, 0, 0, 0, 0, 2)     # unfilled
+        self.write(pack_header(100, HDR_CLOSED) + b''.join(data))
+        header, count = open_bucket(self.path)
+        self.assertEqual(count, 100)
+
+        modes = [False] if numpy is None else [False, True]
+        for arrays in modes:
+            chunks = list(iter_bucket(self.path, header, 45, 62, arrays,
+                                      chunk_recs=8))
+            self.assertEqual([len(chunk) for chunk in chunks], [7, 8, 1])
+            ops = [tuple(op_)[:6] for chunk in chunks for op_ in chunk]
+            self.assertEqual(ops, recs[45:50] + recs[51:62])
+
+    def test_overlapping(self):
+        """ The first record may be compared with the one before it. """
+        recs = [(10, 100, 0, 50, 0, 1), (10, 120, 0, 50, 0, 1),
+                (10, 200, 0, 50, 0, 1)]
+        self.write(b''.join(pack_op(*r) for r in recs))
+        _, ops = read_bucket(self.path)
+        self.assertEqual(overlapping(ops), [False, True, False])
+        self.assertEqual(overlapping(ops[1:], ops[0]), [True, False])
+        self.assertEqual(overlapping(ops[1:]), [False, False])
+        if numpy is not None:
+            _, a_ops = read_bucket_array(self.path)
+            self.assertEqual(overlapping(a_ops[1:], ops[0]), [True, False])
+
+    def test_summarize(self):
+        """
+        Summarize a window of a file's records, or all of them in time
+        series on the wall clock.
+        """
+        recs = [(100, ndx * 1000, 0, 500, 4096, 16, 0, 9, 1234)
+                for ndx in range(10)]
+        self.write(pack_header(10, HDR_CLOSED, version=2) +
+                   b''.join(pack_op_v2(*r) for r in recs))
+        header, count = open_bucket(self.path)
+        for arrays in ([False, True] if numpy is not None else [False]):
+            stats, series = summarize(
+                (self.path, header, 2, 8, arrays, 0, None, 0))
+            self.assertEqual(stats.recorded[16], 6)
+            self.assertEqual(stats.byte_count[16], 6 * 4096)
+            self.assertIsNone(series)
+
+            stats, series = summarize((self.path, header, 0, count, arrays,
+                                       1000, None, header.real_offset))
+            self.assertEqual(stats.recorded[16], 10)
+            self.assertEqual(series.origin,
+                             100 * BILLION + header.real_offset)
+            self.assertEqual(list(series.windows()), list(range(10)))
+            self.assertEqual(series.sums(3, 16), (1, 4096, 500))
+            self.assertEqual(series.peak_in_flight(3), 1)
+
+    def test_summarize_clocks(self):
+        """
+        Files from hosts whose CLOCK_MONOTONIC differs, started at the
+        same wall-clock time, merge into one span on the wall clock.
+        """
+        fd_, other = tempfile.mkstemp()
+        os.close(fd_)
+        self.addCleanup(os.unlink, other)
+        for path, mono_sec, nsec in ((self.path, 100, 0),
+                                     (other, 5000, 500)):
+            recs = [(mono_sec, ndx * 1000 + nsec, 0, 500, 4096, 16, 0, 9, 1)
+                    for ndx in range(10)]
+            with open(path, 'wb') as file:
+                file.write(pack_header(10, HDR_CLOSED, version=2,
+                                       mono_sec=mono_sec) +
+                           b''.join(pack_op_v2(*r) for r in recs))
+        for arrays in ([False, True] if numpy is not None else [False]):
+            merged = OpStats(len(OP_NAMES))
+            for path in (self.path, other):
+                header, count = open_bucket(path)
+                stats, _ = summarize((path, header, 0, count, arrays,
+                                      0, None, header.real_offset))
+                self.assertEqual(stats.span_ns, 9500)
+                merged.merge(stats)
+            self.assertEqual(merged.span_ns, 10000)
+            self.assertEqual(merged.first_ns,
+                             (1500000000 * BILLION + 250000000) -
+                             750000000)
+
+    @unittest.skipIf(numpy is None, 'needs numpy')
+    def test_array_v1(self):
+        """
+        Bitfields unpacked a column at a time match those unpacked a
+        record at a time, in files with and without headers.
+        """
+        recs = [(10, 5, 127, 100, 131071, 16), (10, 50, 0, 0, 1, 40),
+                (10, 60, 1, 999999999, 65536, 0), (11, 0, 64, 7, 256, 1)]
+        data = b''.join(pack_op(*r) for r in recs)
+        self.write(data)
+        _, ops = self.check_array()
+        self.assertEqual([row[:6] for row in ops.tolist()], recs)
+        self.assertEqual(overlapping(ops), [False, True, False, False])
+
+        unfilled = pack_op(0, 0, 0, 0, 0, 2)
+        self.write(pack_header(100) + data + unfilled + b'\0' * REC_SIZE)
+        _, ops = self.check_array()
+        self.assertEqual(len(ops), len(recs))
+
+    @unittest.skipIf(numpy is None, 'needs numpy')
+    def test_array_v2(self):
+        """ Version 2 records read into an array keep every field. """
+        recs = [(100, 5, 3, 7, 1 << 20, 16, 1 << 40, 9, 1234, 0, 0),
+                (101, 0, 400, 0, 0, 20, 0, 9, 1235, 10, REC_PASSTHROUGH)]
+        self.write(pack_header(2, HDR_CLOSED, version=2) +
+                   b''.join(pack_op_v2(*r) for r in recs) +
+                   pack_op_v2(102, 0, 0, 0, 0, 1, 0, 0, 0))
+        _, ops = self.check_array()
+        self.assertEqual(ops['weight'].tolist(), [1, 10])
+        self.assertEqual(count_ops(ops, len(OP_NAMES))[1][20], 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -7,7 +7,9 @@
 import unittest
 
 # from rnglib        import SimpleRNG
-from fusegen import FuseFunc
+from fusegen import FuseFunc, OP_NAMES
+from fusegen import FUSE2_ONLY_OPS, PATH_TO_FIRST_LINES_3
+from fusegen import LL_OP_NAMES, PATH_TO_FIRST_LINES_LL
 
 
 class TestFuseFunc(unittest.TestCase):
@@ -46,6 +48,36 @@ class TestFuseFunc(unittest.TestCase):
                 p_type = my_p2t[param_]
                 self.assertEqual(p_type_name, p_type)
 
+    def test_fuse3_prototypes(self):
+        """ Verify the FUSE 3 prototypes follow OP_NAMES, less FUSE 2 ops. """
+
+        match_, o_map = FuseFunc.get_func_map('xxx_', PATH_TO_FIRST_LINES_3)
+        expected = [name for name in OP_NAMES if name not in FUSE2_ONLY_OPS]
+        self.assertEqual(sorted(o_map, key=o_map.get), expected)
+
+        # ops which FUSE 3 passes any fuse_file_info
+        for name in ['chmod', 'chown', 'getattr', 'truncate', 'utimens', ]:
+            self.assertEqual(match_[name].params[-1][1], 'fi')
+        self.assertEqual(match_['rename'].first_line(),
+                         'int xxx_rename(const char *path, '
+                         'const char *newpath, unsigned int flags)')
+        self.assertEqual(match_['init'].other_args(), ', cfg')
+
+    def test_lowlevel_prototypes(self):
+        """ Verify the low-level prototypes follow LL_OP_NAMES. """
+
+        match_, o_map = FuseFunc.get_func_map('xxx_', PATH_TO_FIRST_LINES_LL)
+        self.assertEqual(sorted(o_map, key=o_map.get), LL_OP_NAMES)
+
+        # the names must fit the opNames of a v2 data file header
+        self.assertTrue(len(LL_OP_NAMES) <= 64)
+        for name in LL_OP_NAMES:
+            self.assertTrue(len(name) < 16)
+            self.assertEqual(match_[name].f_type, 'void ')
+        self.assertEqual(match_['lookup'].first_line(),
+                         'void xxx_lookup(fuse_req_t req, fuse_ino_t parent, '
+                         'const char *name)')
+
     def test_first_line(self):
         """ UNFINISHED: test handling of first line. """
 
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+
+# fusegen/test_generated.py
+
+""" Test the C code which fuseGen writes for various options. """
+
+import os
+import shutil
+import tempfile
+import unittest
+from argparse import Namespace
+
+from fusegen import BUILD_FLAGS_MAX, join_build_flags, make_fuse_pkg
+
+# make_fuse_pkg() copies files from src/c_src/ under the current directory
+IN_FULL_TREE = os.path.exists(os.path.join('src', 'c_src', 'build'))
+
+
+class TestGenerated(unittest.TestCase):
+    """ Test the C code which fuseGen writes for various options. """
+
+    def setUp(self):
+        self.dev_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dev_dir)
+
+    # utility functions #############################################
+
+    def generate(self, **kwargs):
+        """
+        Generate the package xxxfs with the options given, and return
+        the path to its src/ directory.
+        """
+        if not IN_FULL_TREE:
+            self.skipTest('must be run at the top of a full tree')
+        path_to_pkg = os.path.join(self.dev_dir, 'xxxfs')
+        args = Namespace(ac_prereq='2.69', dev_dir=self.dev_dir,
+                         email_addr='jddixon at gmail dot com', force=True,
+                         instrumenting=False, logging=False,
+                         my_date='2026-10-18', my_version='0.0.0',
+                         path_to_pkg=path_to_pkg, pkg_name='xxxfs',
+                         lc_name='xxxfs', uc_name='XXXFS')
+        for name, value in kwargs.items():
+            setattr(args, name, value)
+        make_fuse_pkg(args)
+        return os.path.join(path_to_pkg, 'src')
+
+    def read_inc(self, path_to_src, name):
+        """ Return the contents of the .inc file for an op. """
+        with open(os.path.join(path_to_src, name + '.inc'), 'r') as file:
+            return file.read()
+
+    # actual unit tests #############################################
+
+    def test_attr_forget(self):
+        """
+        With --attr_cache, create and a truncating open forget the
+        cached attributes of the file.
+        """
+        for fuse_api in (2, 3):
+            path_to_src = self.generate(attr_cache=True, fuse_api=fuse_api)
+            self.assertIn('    if (fi->flags & O_TRUNC)\n'
+                          '        xxxfs_AttrForget(path);',
+                          self.read_inc(path_to_src, 'open'))
+            self.assertIn('    xxxfs_AttrForget(path);',
+                          self.read_inc(path_to_src, 'create'))
+
+        path_to_src = self.generate()
+        self.assertNotIn('AttrForget', self.read_inc(path_to_src, 'open'))
+
+    def test_fallocate_null_fi(self):
+        """
+        fallocate opens the file itself when fi is NULL, and its timing
+        must not read the handle from a NULL fi.
+        """
+        for fuse_api in (2, 3):
+            for at_calls in (False, True):
+                path_to_src = self.generate(instrumenting=True,
+                                            at_calls=at_calls,
+                                            fuse_api=fuse_api)
+                text = self.read_inc(path_to_src, 'fallocate')
+                self.assertIn('    if (fi != NULL)\n', text)
+                self.assertIn('ClockMeOut(&tEntry, myData, 0, offset, '
+                              '(fi ? fi->fh : 0));', text)
+                self.assertNotIn('offset, fi->fh);', text)
+
+    def test_at_calls_open_flags(self):
+        """
+        With --at_calls, truncate does not open the file for writing,
+        and fallocate opens it without blocking, as a FIFO would.
+        """
+        path_to_src = self.generate(at_calls=True)
+        text = self.read_inc(path_to_src, 'truncate')
+        self.assertIn('fd = openat(rootfd, rpath, O_PATH);', text)
+        self.assertIn('status = truncate(procname, newsize);', text)
+        self.assertNotIn('O_WRONLY', text)
+        self.assertIn('openat(rootfd, rpath, O_WRONLY | O_NONBLOCK)',
+                      self.read_inc(path_to_src, 'fallocate'))
+
+    def test_build_flags(self):
+        """
+        Build flags too long for a data file header lose whole flags
+        from the end, and say so.
+        """
+        flags = ['inst_mode=mmap', 'rec_version=2', 'logging']
+        self.assertEqual(join_build_flags(flags),
+                         'inst_mode=mmap rec_version=2 logging')
+        flags += ['time_ops=%s' % ','.join(['getattr'] * 20), 'io_uring']
+        text = join_build_flags(flags)
+        self.assertEqual(text, 'inst_mode=mmap rec_version=2 logging ...')
+        flags = ['flag%03d' % ndx for ndx in range(40)]
+        text = join_build_flags(flags)
+        self.assertLessEqual(len(text), BUILD_FLAGS_MAX)
+        self.assertGreater(len(text), BUILD_FLAGS_MAX - len(' flag000'))
+        self.assertTrue(text.startswith('flag000 flag001 '))
+        self.assertTrue(text.endswith(' ...'))
+
+    def test_build_flags_header(self):
+        """ The header gets the whole build flags string, with its null. """
+        path_to_src = self.generate(instrumenting=True, rec_version=2,
+                                    time_ops=['getattr'] * 20)
+        with open(os.path.join(path_to_src, 'util.c'), 'r') as file:
+            text = file.read()
+        self.assertIn('memcpy(hdr->buildFlags, '
+                      '"inst_mode=mutex rec_version=2 ...", 34);', text)
+
+    def test_listxattr_ptr(self):
+        """ listxattr declares ptr only if it logs the attributes. """
+        path_to_src = self.generate(instrumenting=True)
+        self.assertNotIn('ptr', self.read_inc(path_to_src, 'listxattr'))
+        path_to_src = self.generate(instrumenting=True, logging=True)
+        self.assertIn('    char *ptr;',
+                      self.read_inc(path_to_src, 'listxattr'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+
+# fusegen/test_stats.py
+
+""" Test summarizing the calls in fuseGenned statistics files. """
+
+import unittest
+
+from fusegen.bucket import OpRecord, numpy
+from fusegen.stats import (BILLION, HIST_BUCKETS, OpStats, TimeSeries,
+                           format_ns, hist_bucket, hist_floor)
+
+if numpy is not None:
+    from fusegen.bucket import OP_DTYPE
+
+
+def make_op(sec, nsec, late_ns, byte_count, op_code, weight=1):
+    """ Make a version 2 style record with a latency given in ns. """
+    return OpRecord(sec, nsec, late_ns // BILLION, late_ns % BILLION,
+                    byte_count, op_code, 0, 0, 0, weight, 0)
+
+
+def make_ops():
+    """ Make records of two opcodes with a spread of latencies. """
+    ops = [make_op(10, ndx * 1000, ndx * 100, 4096, 15)
+           for ndx in range(1, 1001)]
+    ops.append(make_op(11, 0, 3 * BILLION + 7, 0, 2, weight=5))
+    ops.append(make_op(12, 0, 40, 0, 2, weight=5))
+    return ops
+
+
+def make_series_ops():
+    """
+    Make calls, some overlapping, some spanning windows of 100 ns, and
+    one taking no time.
+    """
+    return [make_op(0, 10, 50, 100, 1),          # 10 up to 60
+            make_op(0, 20, 30, 200, 2, weight=2),  # 20 up to 50
+            make_op(0, 40, 250, 0, 1),           # 40 up to 290
+            make_op(0, 150, 0, 0, 3),            # never in flight
+            make_op(0, 420, 10, 10, 2)]          # 420 up to 430
+
+
+class TestStats(unittest.TestCase):
+    """ Test summarizing the calls in fuseGenned statistics files. """
+
+    def check_stats(self, stats):
+        """ Verify the summary of the records from make_ops(). """
+        self.assertEqual(stats.recorded[15], 1000)
+        self.assertEqual(stats.calls[2], 10)
+        self.assertEqual(stats.total_ns[15], 100 * 1000 * 1001 // 2)
+        self.assertEqual(stats.total_ns[2], 5 * (3 * BILLION + 47))
+        self.assertEqual(stats.max_ns[2], 3 * BILLION + 7)
+        self.assertEqual(stats.byte_count[15], 4096 * 1000)
+        self.assertEqual(stats.span_ns, 4 * BILLION + 7 - 1000)
+
+        # percentiles are exact to within a bucket's width, 1/32
+        for pct in (50, 90, 99, 99.9):
+            exact = pct * 1000
+            self.assertLessEqual(exact, stats.percentile(15, pct))
+            self.assertLess(stats.percentile(15, pct), exact * 33 / 32)
+        self.assertEqual(stats.percentile(15, 100), 100000)
+        self.assertEqual(stats.percentile(2, 50), 40)
+        self.assertEqual(stats.percentile(2, 51), 3 * BILLION + 7)
+
+        rows = stats.histogram(15)
+        self.assertEqual(rows[0], (64, 1))
+        self.assertEqual(rows[-1][0], 65536)
+        self.assertEqual(sum(count for _, count in rows), 1000)
+        self.assertEqual(len(stats.histogram(2)), 27)
+        self.assertEqual(stats.histogram(3), [])
+
+    def test_buckets(self):
+        """ Every latency falls in a bucket which spans it. """
+        values = list(range(300)) + [(1 << 64) - 1]
+        values += [(1 << bits) + delta for bits in range(8, 64)
+                   for delta in (-1, 0, 1)]
+        for value in values:
+            ndx = hist_bucket(value)
+            self.assertLess(ndx, HIST_BUCKETS)
+            self.assertLessEqual(hist_floor(ndx), value)
+            self.assertLess(value, hist_floor(ndx + 1))
+
+    def test_format(self):
+        """ Times are shown in units which suit them. """
+        self.assertEqual(format_ns(999), '999 ns')
+        self.assertEqual(format_ns(1500), '1.5 us')
+        self.assertEqual(format_ns(2500000000), '2.5 s')
+
+    def test_records(self):
+        """ Summarize records a record at a time, in two chunks. """
+        ops = make_ops()
+        stats = OpStats(40)
+        stats.add(ops[:500])
+        stats.add(ops[500:])
+        self.check_stats(stats)
+
+    def test_merge(self):
+        """ Summaries of parts of the records merge into a whole. """
+        ops = make_ops()
+        stats, other = OpStats(40), OpStats(40)
+        stats.add(ops[:700])
+        other.add(ops[700:])
+        stats.merge(other)
+        self.check_stats(stats)
+
+    def check_series(self, series):
+        """ Verify the time series of the calls from make_series_ops(). """
+        self.assertEqual(list(series.windows()), [0, 1, 2, 3, 4])
+        self.assertEqual(series.sums(0, 1), (2, 100, 300))
+        self.assertEqual(series.sums(0, 2), (2, 400, 60))
+        self.assertEqual(series.sums(1, 3), (1, 0, 0))
+        self.assertEqual(series.sums(3, 1), (0, 0, 0))
+        self.assertEqual(series.sums(4, 2), (1, 10, 10))
+
+        # in flight: 50 + 2 * 30 + 60 ns of window 0, then 100, 90, 0, 10
+        self.assertEqual([series.mean_in_flight(win) for win in range(5)],
+                         [1.7, 1.0, 0.9, 0.0, 0.1])
+        self.assertEqual([series.peak_in_flight(win) for win in range(5)],
+                         [3, 1, 1, 0, 1])
+
+    def test_series(self):
+        """ Count calls and concurrency in windows of time. """
+        ops = make_series_ops()
+        series = TimeSeries(40, 100)
+        series.add(ops)
+        self.assertEqual(series.origin, 10)     # by default, the first call
+
+        series = TimeSeries(40, 100, origin=0)
+        series.add(ops[:2])
+        series.add(ops[2:])
+        self.check_series(series)
+
+        other = TimeSeries(40, 100, origin=0)
+        other.add(ops[1:])
+        series = TimeSeries(40, 100, origin=0)
+        series.add(ops[:1])
+        series.merge(other)
+        self.check_series(series)
+
+        # an offset moves the calls onto another clock
+        series = TimeSeries(40, 100, origin=5000, offset=5000)
+        series.add(ops)
+        self.check_series(series)
+
+    @unittest.skipIf(numpy is None, 'needs numpy')
+    def test_array_series(self):
+        """ Time series of arrays match those of OpRecords. """
+        ops = make_series_ops()
+        array = numpy.array([tuple(op_) for op_ in ops], OP_DTYPE)
+        series = TimeSeries(40, 100, origin=0)
+        series.add(array[:3])
+        series.add(array[3:])
+        self.check_series(series)
+        series = TimeSeries(40, 100, origin=5000, offset=5000)
+        series.add(array)
+        self.check_series(series)
+
+    @unittest.skipIf(numpy is None, 'needs numpy')
+    def test_array(self):
+        """ Summaries of arrays match those of OpRecords. """
+        ops = make_ops()
+        array = numpy.array([tuple(op_) for op_ in ops], OP_DTYPE)
+        stats = OpStats(40)
+        stats.add(array[:300])
+        stats.add(array[300:300])
+        stats.add(array[300:])
+        self.check_stats(stats)
+        slow = OpStats(40)
+        slow.add(ops)
+        self.assertEqual(vars(stats), vars(slow))
+
+
+if __name__ == '__main__':
+    unittest.main()